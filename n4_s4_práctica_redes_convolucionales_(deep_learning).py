@@ -33,17 +33,13 @@ En esta notebook, exploraremos el funcionamiento y la implementación de las Red
 """
 
 # Importación de librerías necesarias
+# El código de la práctica vive en el paquete practica_cnn; cada módulo importa su framework
+# (TensorFlow o PyTorch) solo cuando se usa. También se puede ejecutar por partes desde la
+# línea de comandos: python -m practica_cnn --help
 
 import numpy as np
-import seaborn as sns
-import tensorflow as tf
 import matplotlib.pyplot as plt
-from tensorflow.keras.datasets import mnist
-from tensorflow.keras.optimizers import Adam
-from tensorflow.keras.models import Sequential
-from tensorflow.keras.layers import Conv2D, MaxPooling2D, Flatten, Dense, Dropout
-from sklearn.metrics import classification_report, confusion_matrix
-from sklearn.model_selection import train_test_split
+from practica_cnn import keras_cnn, evaluation, plotting
 
 """## Carga y Preprocesamiento de Datos
 
@@ -51,12 +47,21 @@ Antes de construir nuestro modelo, necesitamos cargar y preprocesar el dataset M
 
 """
 
-# Cargar el dataset MNIST
-(x_train, y_train), (x_test, y_test) = mnist.load_data()
+"""### Almacén local de MNIST mapeado en memoria
+La parte de Keras (`mnist.load_data()`) y la de PyTorch (`datasets.MNIST`) cargaban el mismo dataset de dos formas distintas, ambas con descarga en la primera ejecución y decodificando todo a arrays nuevos en memoria. En su lugar usamos un único formato en disco: un `.npy` por array más un pequeño `index.json`, construido a partir de los archivos IDX (por ejemplo, los de `./data/MNIST/raw`) o del `mnist.npz` de Keras si ya están en la máquina.
 
-# Normalización y reshaping de los datos
-x_train = x_train.reshape((x_train.shape[0], 28, 28, 1)).astype('float32') / 255
-x_test = x_test.reshape((x_test.shape[0], 28, 28, 1)).astype('float32') / 255
+Ambas mitades abren los arrays con `np.load(..., mmap_mode='r')`: no se copia nada al arrancar y varios procesos (por ejemplo, los workers de un `DataLoader`) comparten las mismas páginas del page cache en lugar de tener cada uno su copia privada.
+"""
+
+# Usar el almacén local para ambas mitades de la práctica (ver practica_cnn.data)
+USAR_STORE_MNIST = True
+
+# Mantener los datos en uint8 y escalar dentro del modelo (4 veces menos memoria que float32)
+USAR_PIPELINE_UINT8 = True
+
+# Cargar el dataset MNIST, con normalización y reshaping de los datos
+(x_train, y_train), (x_test, y_test) = keras_cnn.load_data(uint8_input=USAR_PIPELINE_UINT8,
+                                                           use_store=USAR_STORE_MNIST)
 
 # Verificar shapes de los datasets
 print("Train set shape:", x_train.shape)
@@ -87,19 +92,10 @@ Implementar la normalización adecuada es fundamental para el rendimiento y la e
 A continuación, construiremos nuestra red neuronal convolucional. Explicaremos paso a paso la función de las capas convolucionales, de pooling, y cómo estas contribuyen a la efectividad del modelo en tareas de clasificación de imágenes.
 """
 
-# Definición del modelo CNN
-model_cnn = Sequential([
-    Conv2D(32, kernel_size=(3, 3), activation='relu', input_shape=(28, 28, 1)),
-    MaxPooling2D(pool_size=(2, 2)),
-    Conv2D(64, (3, 3), activation='relu'),
-    MaxPooling2D(pool_size=(2, 2)),
-    Flatten(),
-    Dense(128, activation='relu'),
-    Dropout(0.5),
-    Dense(10, activation='softmax')
-])
-
-model_cnn.compile(optimizer='adam', loss='sparse_categorical_crossentropy', metrics=['accuracy'])
+# Definición y compilación del modelo CNN (con datos uint8, la primera capa escala a [0, 1])
+model_cnn = keras_cnn.build_model_cnn(uint8_input=USAR_PIPELINE_UINT8)
+
+# Resumen del modelo
 model_cnn.summary()
 
 """### Descripción de las Capas del Modelo CNN
@@ -141,14 +137,31 @@ En conclusión, aunque las capas densas en MLP son potentes para capturar intera
 Entrenaremos nuestra CNN con el dataset MNIST y evaluaremos su rendimiento. También compararemos estos resultados con el modelo MLP previamente construido.
 """
 
-# División del dataset en train y test
-X_train, X_val, y_train, y_val = train_test_split(x_train, y_train, test_size=0.2, random_state=42)
+"""### Aumentación de datos por lotes
+Ni `model_cnn.fit` ni la transformación de torchvision aumentan los datos. Aplicar transformaciones aleatorias imagen por imagen en Python hundiría el throughput, así que `practica_cnn.augment.BatchAugment` trabaja sobre el lote completo. Arma una sola grilla de muestreo con un desplazamiento y una rotación pequeña por imagen, más una distorsión elástica suave, y muestrea todo el lote con interpolación bilineal. En Keras se aplica dentro del pipeline tf.data, solo a los lotes de entrenamiento, con una semilla por lote que sale de un generador sembrado. En PyTorch se aplica al armar cada lote del `DataLoader` (`collate_fn`). Con la misma semilla, la aumentación es reproducible.
+"""
+
+from practica_cnn import augment
 
-# Entrenamiento del modelo CNN
-history_cnn = model_cnn.fit(X_train, y_train, epochs=15, batch_size=128, validation_data=(X_val, y_val))
+# Activar la aumentación por lotes en el entrenamiento (CNN y MobileNetV2 sin caché de embeddings)
+USAR_AUMENTACION = False
+
+batch_augment = None
+if USAR_AUMENTACION:
+    batch_augment = augment.BatchAugment(max_shift=0.1, max_rotation=10.0, elastic_alpha=0.03, seed=0)
+
+# División en train y validación por índices y entrenamiento con el pipeline tf.data
+history_cnn = keras_cnn.train_model_cnn(model_cnn, x_train, y_train, epochs=15, batch_size=128, augment=batch_augment)
+
+"""## Caché de predicciones
+Todas las celdas de evaluación y de reporte (pérdida, accuracy, matriz de confusión, reporte por clase e imágenes mal clasificadas) se pueden derivar de una única pasada de inferencia sobre el conjunto de prueba. La caché guarda esa salida indexada por una huella de los pesos del modelo y por una huella del contenido del dataset (imágenes y etiquetas): si cambian los pesos (por ejemplo, al seguir entrenando) o los datos, la entrada deja de coincidir y se vuelve a predecir automáticamente.
+"""
+
+prediction_cache = evaluation.PredictionCache(model_cnn)
 
 # Evaluación del modelo
-test_loss, test_acc = model_cnn.evaluate(x_test, y_test)
+test_results = prediction_cache.get(x_test, y_test)
+test_loss, test_acc = test_results.loss, test_results.accuracy
 print("Accuracy del modelo CNN en el conjunto de prueba:", test_acc)
 
 """## Evaluación de la CNN
@@ -157,26 +170,12 @@ Después de entrenar el modelo, evaluamos su rendimiento en el conjunto de prueb
 """
 
 # Gráficas de entrenamiento y validación
-plt.figure(figsize=(12, 5))
-plt.subplot(1, 2, 1)
-plt.plot(history_cnn.history['accuracy'], label='Precisión en entrenamiento')
-plt.plot(history_cnn.history['val_accuracy'], label='Precisión en validación')
-plt.title('Curva de Precisión')
-plt.xlabel('Época')
-plt.ylabel('Precisión')
-plt.legend()
-
-plt.subplot(1, 2, 2)
-plt.plot(history_cnn.history['loss'], label='Pérdida en entrenamiento')
-plt.plot(history_cnn.history['val_loss'], label='Pérdida en validación')
-plt.title('Curva de Pérdida')
-plt.xlabel('Época')
-plt.ylabel('Pérdida')
-plt.legend()
+plotting.plot_training_history(history_cnn.history)
 plt.show()
 
 # Evaluación del modelo
-test_loss, test_acc = model_cnn.evaluate(x_test, y_test, verbose=2)
+test_results = prediction_cache.get(x_test, y_test)
+test_loss, test_acc = test_results.loss, test_results.accuracy
 print(f'Exactitud en el conjunto de prueba: {test_acc}')
 
 """## Visualización de Resultados
@@ -184,35 +183,18 @@ print(f'Exactitud en el conjunto de prueba: {test_acc}')
 Visualizaremos algunas predicciones del modelo junto con los valores reales para ver cómo se comporta nuestra CNN en la práctica.
 """
 
-# Función para visualizar resultados
-def plot_images(images, cls_true, cls_pred=None):
-    assert len(images) == len(cls_true) == 9
-
-    fig, axes = plt.subplots(3, 3, figsize=(9, 9))
-    fig.subplots_adjust(hspace=0.3, wspace=0.3)
-
-    for i, ax in enumerate(axes.flat):
-        ax.imshow(images[i].reshape(28, 28), cmap='binary')
-        if cls_pred is None:
-            ax_title = "True: {0}".format(cls_true[i])
-        else:
-            ax_title = "True: {0}, Pred: {1}".format(cls_true[i], cls_pred[i])
-
-        ax.set_title(ax_title)
-        ax.set_xticks([])
-        ax.set_yticks([])
-
 # Obtener imágenes de prueba
 images = x_test[0:9]
 
-# Obtener etiquetas de clase verdaderas
+# Obtener las clases verdaderas para esas imágenes
 cls_true = y_test[0:9]
 
-# Obtener las predicciones de clase
-cls_pred = model_cnn.predict(images)
-cls_pred = np.argmax(cls_pred, axis=1)
+# Predicciones del modelo (desde la caché)
+cls_pred = prediction_cache.get(x_test, y_test).predicted_classes[0:9]
 
-plot_images(images, cls_true, cls_pred)
+# Graficar las imágenes y sus etiquetas
+plotting.plot_images(images, cls_true, cls_pred)
+plt.show()
 
 """## Métricas de evaluación - Matriz de Confusión
 
@@ -220,62 +202,133 @@ Utilizamos Seaborn para crear una visualización de la matriz de confusión y me
 """
 
 # Obteniendo la matriz de confusión y el reporte de clasificación
-predictions = model_cnn.predict(x_test)
-predicted_classes = np.argmax(predictions, axis=1)
-conf_matrix = confusion_matrix(y_test, predicted_classes)
-clas_report = classification_report(y_test, predicted_classes, output_dict=True)
+test_results = prediction_cache.get(x_test, y_test)
+predicted_classes = test_results.predicted_classes
+conf_matrix = test_results.confusion_matrix
+clas_report = test_results.classification_report
 
 # Visualización de la matriz de confusión con Seaborn
-plt.figure(figsize=(10, 8))
-sns.heatmap(conf_matrix, annot=True, fmt='d', cmap='Blues', cbar=False)
-plt.xlabel('Predicted Label')
-plt.ylabel('True Label')
-plt.title('Matriz de Confusión')
+plotting.plot_confusion_matrix(conf_matrix, cbar=False)
 plt.show()
 
 # Visualización del reporte de clasificación
-fig, ax = plt.subplots(figsize=(12, 6))
-sns.barplot(x=list(clas_report.keys())[:-3], y=[d['precision'] for d in list(clas_report.values())[:-3]], ax=ax)
-ax.set_ylabel('Precision')
-ax.set_title('Precisión por Clase')
+plotting.plot_precision_per_class(clas_report)
 plt.show()
 
 """## Visualización de casos donde el modelo no performa correctamente"""
 
-# Continuación de la función para mostrar las imágenes mal clasificadas de cada clase
-def plot_misclassified_images(model, images, true_labels, predicted_labels, class_names, max_images=5):
-    misclassified_idx = np.where(predicted_labels != true_labels)[0]
-    num_classes = len(class_names)
-    fig, axes = plt.subplots(num_classes, max_images, figsize=(5*max_images, 5*num_classes))
-
-    for i in range(num_classes):
-        class_misclassified_idx = misclassified_idx[true_labels[misclassified_idx] == i]
-        if not class_misclassified_idx.size:
-            continue
-        for j in range(max_images):
-            if j < len(class_misclassified_idx):
-                img_idx = class_misclassified_idx[j]
-                ax = axes[i, j] if num_classes > 1 else axes[j]
-                ax.imshow(images[img_idx], cmap='gray')
-                ax.set_title(f'True: {class_names[true_labels[img_idx]]}\nPredicted: {class_names[predicted_labels[img_idx]]}')
-                ax.axis('off')
-            else:
-                axes[i, j].axis('off')
-    plt.tight_layout()
-    plt.show()
-
-# Obteniendo las predicciones del modelo
-predictions = model_cnn.predict(x_test)
-predicted_classes = np.argmax(predictions, axis=1)
-
-# Define class_names if not already defined
-class_names = ['0', '1', '2', '3', '4', '5', '6', '7', '8', '9']
-
-# Mostrando las imágenes mal clasificadas
-plot_misclassified_images(model_cnn, x_test, y_test, predicted_classes, class_names)
+# Mostrando las imágenes mal clasificadas de cada clase
+predicted_classes = prediction_cache.get(x_test, y_test).predicted_classes
+plotting.plot_misclassified_images(model_cnn, x_test, y_test, predicted_classes, evaluation.CLASS_NAMES)
+plt.show()
+
+# Pares (verdadera -> predicha) más frecuentes entre los errores
+for true_class, predicted_class, count in plotting.confusion_pairs(y_test, predicted_classes, num_classes=10)[:10]:
+    print(f'{true_class} -> {predicted_class}: {count}')
 
 # APRECIAR QUE HAY ALGUNOS DATOS QUE PARECERÍAN MAL ETIQUETADOS.
 
+"""## Etiquetas sospechosas y casi-duplicados con kNN sobre embeddings
+En lugar de buscar a ojo las imágenes mal etiquetadas, `practica_cnn.neighbors` usa los embeddings de la penúltima capa. Para `model_cnn` es la salida de la `Dense(128)`; para MobileNetV2, las features después del pooling global. Sobre las 70k imágenes de train y test busca los k vecinos más cercanos por similitud coseno. La búsqueda exacta es por bloques: cada bloque de consultas se multiplica contra toda la base. La aproximada usa un índice IVF, que agrupa la base con k-means y revisa solo las listas más cercanas a cada consulta. Con los vecinos se marcan:
+- **etiquetas sospechosas**: imágenes cuyos vecinos coinciden, casi todos, en otra clase;
+- **casi-duplicados entre train y test**: pares de splits distintos con embeddings casi idénticos, que inflan la accuracy en test.
+
+Desde la línea de comandos: `python -m practica_cnn neighbors cnn` (o `mobilenet --pca-dim 128 --method ivf`).
+"""
+
+from practica_cnn import neighbors
+
+# Buscar etiquetas sospechosas y casi-duplicados (tarda alrededor de un minuto en CPU con el kNN exacto)
+BUSCAR_VECINOS = False
+
+if BUSCAR_VECINOS:
+    all_images = np.concatenate([x_train, x_test]).reshape(-1, 28, 28)
+    all_embeddings = np.concatenate([neighbors.cnn_embeddings(model_cnn, x_train),
+                                     neighbors.cnn_embeddings(model_cnn, x_test)])
+    neighbors_report = neighbors.analyze_dataset(all_embeddings, all_images, np.concatenate([y_train, y_test]),
+                                                 len(y_train), k=10, method='exact')
+    neighbors.print_neighbors_report(neighbors_report)
+
+"""## Evaluación en streaming sobre shards
+La evaluación anterior necesita todo `x_test` y todas sus probabilidades en memoria. Con colecciones de millones de imágenes eso no escala. `practica_cnn.streaming` recorre la colección repartida en shards (`.npz`, `.tar` con PNG y etiqueta por imagen, o directorios con `.npy`):
+- un pool de hilos lectores trae los shards siguientes en segundo plano;
+- la inferencia se hace por lotes;
+- los resultados se acumulan en métricas corrientes y en la matriz de confusión;
+- las predicciones de cada imagen se escriben en un CSV a medida que salen.
+
+La memoria queda acotada por el tamaño del shard y la cantidad de shards en vuelo, no por el tamaño de la colección. Desde la línea de comandos: `python -m practica_cnn write-shards` y `python -m practica_cnn evaluate-shards cnn --readers 8 --predictions predicciones.csv`.
+"""
+
+from practica_cnn import streaming
+
+# Evaluar model_cnn en streaming sobre el conjunto de prueba repartido en shards de 1000 imágenes
+EVALUACION_STREAMING = False
+
+if EVALUACION_STREAMING:
+    test_shards = streaming.write_shards(x_test, y_test, './data/shards/test', shard_size=1000)
+    streaming_results = streaming.evaluate_shards(keras_cnn.make_predict_batch(model_cnn, USAR_PIPELINE_UINT8),
+                                                  test_shards, num_readers=4,
+                                                  predictions_path='./reports/cnn_predictions.csv')
+    streaming.print_streaming_report(streaming_results)
+
+"""## Barrido de hiperparámetros en paralelo
+Los filtros de las `Conv2D`, la capa `Dense(128)`, el `Dropout(0.5)`, el `batch_size=128` y las 15 épocas se eligieron a mano, una corrida por vez. `practica_cnn.sweep` entrena muchas configuraciones en un pool de procesos. Cada worker tiene su propia porción de núcleos (afinidad de CPU e hilos intra-op/inter-op de TensorFlow acotados) para no competir con los demás, y todos leen los datos del mismo almacén mapeado en memoria, sin copias por proceso.
+
+Para no gastar las 15 épocas en configuraciones malas se usa successive halving: todas empiezan con una época; en cada ronda sigue solo el mejor tercio, con el triple de épocas, retomando el modelo guardado. `EarlyStopping` corta las que dejan de mejorar. Desde la línea de comandos: `python -m practica_cnn sweep-cnn --trials 27`.
+"""
+
+from practica_cnn import cli
+
+# Ejecutar el barrido (usa todos los núcleos de la máquina). Corre desde la línea de comandos: los workers
+# se lanzan con spawn y, desde este script, volverían a ejecutarlo entero
+BARRIDO_HIPERPARAMETROS = False
+
+if BARRIDO_HIPERPARAMETROS:
+    cli.run_subcommand('sweep-cnn', '--trials', 27, '--threads-per-worker', 4, '--min-epochs', 1, '--max-epochs', 15,
+                       '--eta', 3)
+
+"""## Entrenamiento hasta una accuracy objetivo
+Las 15 épocas fijas de la CNN (y las 3 de MobileNetV2) no dicen cuánto cuesta llegar a un modelo bueno. `practica_cnn.time_to_accuracy` entrena hasta que la accuracy de validación alcanza un objetivo, se agota un presupuesto de tiempo o `val_accuracy` deja de mejorar durante `patience` épocas, y reporta el tiempo y las épocas hasta el objetivo. La tasa de aprendizaje sigue un schedule one-cycle (o coseno) por paso, que suele llegar antes al objetivo que una tasa fija.
+
+Al final de cada época se guarda un checkpoint en un hilo de fondo: el entrenamiento solo paga la copia de pesos y estado del optimizador, y la escritura a disco corre en paralelo con la época siguiente. Si la corrida se interrumpe, se retoma desde el último checkpoint con el mismo paso del schedule y el reloj acumulado. Desde la línea de comandos: `python -m practica_cnn train-to-target cnn --target-accuracy 0.99 --time-budget 600`.
+"""
+
+from practica_cnn import time_to_accuracy
+
+# Entrenar una CNN nueva hasta 99% de accuracy de validación (como mucho 10 minutos)
+ENTRENAR_HASTA_OBJETIVO = False
+
+if ENTRENAR_HASTA_OBJETIVO:
+    model_cnn_target = keras_cnn.build_model_cnn(uint8_input=USAR_PIPELINE_UINT8)
+    target_report = time_to_accuracy.train_cnn_to_target(model_cnn_target, x_train, y_train, target_accuracy=0.99,
+                                                         time_budget_s=600, max_epochs=15, schedule='one_cycle',
+                                                         augment=batch_augment)
+    time_to_accuracy.print_target_report(target_report)
+
+"""## Servicio de inferencia con micro-batching
+En producción las imágenes llegan de a una. Llamar a `model_cnn.predict` por cada petición desperdicia casi todo el tiempo en overhead por llamada. Este servicio basado en `asyncio` acumula las peticiones concurrentes en lotes dinámicos, limitados por un tamaño máximo de lote y un tiempo máximo de espera, hace una sola pasada del modelo por lote y devuelve a cada cliente su resultado.
+
+El front-end es HTTP mínimo sobre TCP o sobre un socket Unix, sin dependencias externas:
+- `POST /predict` con los 784 bytes de la imagen (`application/octet-stream`) o `{"image": [...]}` en JSON.
+- `GET /metrics` con la profundidad de la cola, el histograma de tamaños de lote y la latencia p50/p99.
+
+Todo corre en local, por lo que se puede hacer una prueba de carga en una máquina sin GPU.
+"""
+
+import asyncio
+from practica_cnn import server
+
+# Ejecutar una prueba de carga local del servicio (usa asyncio.run, pensado para ejecutar como script)
+PROBAR_SERVIDOR = False
+
+# Forward por lotes de píxeles uint8 con firma fija, para no retrazar el grafo con cada tamaño de lote
+predict_batch = keras_cnn.make_predict_batch(model_cnn, uint8_input=USAR_PIPELINE_UINT8)
+
+if PROBAR_SERVIDOR:
+    # Imágenes de prueba como píxeles uint8, el formato que recibe el servicio
+    raw_test = x_test if USAR_PIPELINE_UINT8 else np.round(x_test * 255)
+    asyncio.run(server.load_test(predict_batch, raw_test[:2000].astype(np.uint8)))
+
 """# Uso de un modelo pre-entrenado para no armar una red convolucional de cero
 
 ## MobileNetV2: Una Arquitectura Eficiente para Visión por Computadora
@@ -309,62 +362,59 @@ Para comenzar, importamos todas las bibliotecas necesarias para cargar y procesa
 """
 
 import torch
-import torchvision
-import torchvision.transforms as transforms
-from torch.utils.data import DataLoader
-from torchvision import datasets
-import torch.nn as nn
-import torch.optim as optim
-from torchvision.models import mobilenet_v2
+from practica_cnn import mobilenet
 
 """## Preparar el DataLoader para MNIST
 Configuramos las transformaciones para adaptar las imágenes del MNIST para MobileNetV2, que requiere imágenes de 224x224 píxeles en 3 canales. Además, normalizamos las imágenes según los parámetros usados comúnmente para imágenes preentrenadas en ImageNet.
 """
 
-# Transformaciones para expandir y normalizar las imágenes MNIST
-transform = transforms.Compose([
-    transforms.Resize(224),  # Redimensionar la imagen para que se ajuste a MobileNetV2
-    transforms.Grayscale(3),  # Convertir la imagen a 3 canales
-    transforms.ToTensor(),
-    transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-])
+# Resolución de entrada de MobileNetV2 (224 es la original; ver el barrido de resolución más abajo)
+RESOLUCION_MOBILENET = 224
 
-# Cargar los datasets
-train_dataset = datasets.MNIST(root='./data', train=True, download=True, transform=transform)
-test_dataset = datasets.MNIST(root='./data', train=False, download=True, transform=transform)
+# Transformaciones para expandir y normalizar las imágenes MNIST:
+# Resize, Grayscale(3), ToTensor y Normalize con la media y desviación de ImageNet
+print(mobilenet.make_transform(RESOLUCION_MOBILENET))
 
-# Crear los DataLoaders
-train_loader = DataLoader(train_dataset, batch_size=128, shuffle=True)
-test_loader = DataLoader(test_dataset, batch_size=128, shuffle=False)
+# Cargar los datasets (desde el almacén local, o con datasets.MNIST si USAR_STORE_MNIST es False)
+train_dataset, test_dataset = mobilenet.load_datasets(use_store=USAR_STORE_MNIST, resized=False,
+                                                      size=RESOLUCION_MOBILENET)
 
-"""## Adaptar MobileNetV2 para MNIST
-Cargamos el modelo MobileNetV2 preentrenado y modificamos la última capa clasificadora para producir 10 salidas, una para cada clase del MNIST. También aseguramos que el modelo se ejecute en GPU si está disponible.
+"""## Almacén de imágenes pre-redimensionadas
+La transformación anterior se ejecuta en Python, imagen por imagen, en cada época: `Resize(224)` sobre PIL, la conversión a 3 canales idénticos y la normalización. Como el resultado es siempre el mismo, hacemos el redimensionado una única vez en lotes y lo guardamos en disco como `uint8` de un solo canal, mapeado en memoria (un tercio del espacio que ocuparían tres canales iguales).
+
+La normalización y la replicación a 3 canales se aplican después sobre el lote completo, ya en el dispositivo, con una sola operación vectorizada.
 """
 
-#
+# Activar el almacén pre-redimensionado en lugar de transformar imagen por imagen en cada época
+USAR_STORE_REDIMENSIONADO = True
 
-# Cargar MobileNetV2 preentrenado
-model = mobilenet_v2(pretrained=True)
+if USAR_STORE_REDIMENSIONADO:
+    train_dataset = mobilenet.ResizedMNIST(
+        *mobilenet.build_resized_store(train_dataset, 'train', size=RESOLUCION_MOBILENET))
+    test_dataset = mobilenet.ResizedMNIST(
+        *mobilenet.build_resized_store(test_dataset, 'test', size=RESOLUCION_MOBILENET))
+
+# Crear los DataLoaders
+train_loader = mobilenet.make_loader(train_dataset, batch_size=128, shuffle=True, augment=batch_augment)
+test_loader = mobilenet.make_loader(test_dataset, batch_size=128, shuffle=False)
 
-# Congelar todas las capas del modelo para no entrenarlas nuevamente
-for param in model.parameters():
-    param.requires_grad = False
+"""## Adaptar MobileNetV2 para MNIST
+Cargamos el modelo MobileNetV2 preentrenado y modificamos la última capa clasificadora para producir 10 salidas, una para cada clase del MNIST. También aseguramos que el modelo se ejecute en GPU si está disponible.
+"""
 
-# Modificar la última capa para 10 clases de MNIST
-model.classifier[1] = nn.Linear(model.classifier[1].in_features, 10)
-model.classifier[1].requires_grad = True  # Asegurarse de que la última capa es entrenable
+# Cargar MobileNetV2 preentrenado, congelar todas sus capas y reemplazar la última por una de 10 clases
+# (por debajo de 128 se quitan las primeras reducciones de stride para no terminar en un mapa de 1x1)
+model = mobilenet.build_mobilenet(pretrained=True, input_size=RESOLUCION_MOBILENET)
 
-# Mover el modelo a GPU si está disponible
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-model = model.to(device)
+# GPU si está disponible
+device = mobilenet.device
 
 """## Definir función de pérdida y optimizador para el modelo
 Definimos la función de pérdida y el optimizador que se usarán para entrenar MobileNetV2. Utilizamos la pérdida de entropía cruzada y el optimizador Adam.
 
 """
 
-criterion = nn.CrossEntropyLoss()
-optimizer = optim.Adam(model.parameters(), lr=0.001)
+criterion, optimizer = mobilenet.build_optimizer(model, lr=0.001)
 
 # Asegurarse de que CuDNN esté habilitado para optimizaciones
 torch.backends.cudnn.enabled = True
@@ -373,66 +423,176 @@ torch.backends.cudnn.enabled = True
 Entrenamos el modelo usando el DataLoader, que carga las imágenes en lotes. Este proceso se repite para un número definido de épocas.
 """
 
-# Función para el entrenamiento
-def train_model(num_epochs):
-    model.train()
-    for epoch in range(num_epochs):
-        running_loss = 0.0
-        for images, labels in train_loader:
-            images, labels = images.to(device), labels.to(device)
-            optimizer.zero_grad()
-            outputs = model(images)
-            loss = criterion(outputs, labels)
-            loss.backward()
-            optimizer.step()
-            running_loss += loss.item()
-        print(f'Epoch {epoch+1}, Loss: {running_loss/len(train_loader)}')
+# Función para el entrenamiento: mobilenet.train_model(model, train_loader, criterion, optimizer, num_epochs)
+# imprime la pérdida media y las imágenes por segundo de cada época
+
+"""## Modo de entrenamiento de alto rendimiento
+`train_model` llama a `loss.item()` en cada paso, lo que obliga a esperar a que termine el cómputo del lote antes de lanzar el siguiente. Esta variante acumula la pérdida y los aciertos en el dispositivo y solo los lee cada `log_interval` pasos. Además, opcionalmente:
+- usa autocast con `bfloat16` (también en CPU),
+- usa el formato de memoria `channels_last`, más eficiente para las convoluciones,
+- compila el modelo con `torch.compile`,
+- pone los gradientes a `None` en lugar de llenarlos de ceros.
+
+Ambas funciones informan imágenes por segundo en cada época, de modo que se pueden comparar directamente.
+"""
+
+# Activar el entrenamiento de alto rendimiento (mobilenet.train_model_fast) en lugar de train_model
+USAR_ENTRENAMIENTO_RAPIDO = True
+
+"""## Entrenamiento del clasificador desde embeddings cacheados
+Como todo el backbone está congelado, la salida de `model.features` (tras el pooling global, un vector de 1280 valores por imagen) es siempre la misma para una imagen dada. En lugar de pasar las 60.000 imágenes de 224x224 por toda la red en cada época, calculamos esos embeddings una sola vez, los guardamos en disco como arrays `.npy` mapeados en memoria y entrenamos la capa `nn.Linear` directamente sobre ellos.
+
+La caché se identifica con un hash de los pesos del backbone y de la transformación aplicada, de modo que se reutiliza entre distintas pruebas de hiperparámetros del clasificador y se invalida sola si cambia cualquiera de los dos.
+
+Los resultados no son idénticos a los del entrenamiento original: para que los embeddings sean fijos, el backbone corre en modo evaluación, así que las capas BatchNorm usan sus estadísticas guardadas en lugar de las de cada lote (y no se actualizan). Por eso viene desactivado; al activarlo, la accuracy puede cambiar respecto de la reportada más abajo.
+"""
+
+# Activar el entrenamiento del clasificador a partir de la caché de embeddings
+USAR_CACHE_EMBEDDINGS = False
 
 # Entrenar el modelo
-train_model(3)
+if USAR_CACHE_EMBEDDINGS:
+    train_features, train_labels = mobilenet.build_embedding_cache(model, train_dataset, 'train')
+    test_features, test_labels = mobilenet.build_embedding_cache(model, test_dataset, 'test')
+    mobilenet.train_head_from_cache(model, criterion, optimizer, 3, train_features, train_labels)
+elif USAR_ENTRENAMIENTO_RAPIDO:
+    mobilenet.train_model_fast(model, train_loader, criterion, optimizer, 3)
+else:
+    mobilenet.train_model(model, train_loader, criterion, optimizer, 3)
+
+"""## Entrenamiento en paralelo de datos (DDP)
+`train_model` corre en un solo proceso: en una máquina con muchos núcleos, la mayoría queda ociosa durante el forward del backbone. `practica_cnn.distributed` entrena con `DistributedDataParallel` y el backend gloo. Cada proceso recibe su parte de `train_dataset` mediante un `DistributedSampler` y trabaja con su propia porción de núcleos. Las métricas de cada época se suman entre procesos con `all_reduce`, y solo el rank 0 guarda checkpoints.
+
+Como usa varios procesos, se lanza desde la línea de comandos y no dentro de la notebook:
+- En una máquina: `python -m practica_cnn train-ddp --nproc 4`.
+- En varias: `torchrun --nnodes 2 --nproc-per-node 4 --rdzv-backend c10d --rdzv-endpoint host:29500 -m practica_cnn train-ddp`.
+- Para medir cómo escala el tiempo por época al agregar procesos: `python -m practica_cnn train-ddp --scaling 1 2 4 8 --epochs 1`.
+"""
 
 """## Evaluación del Modelo
 Evaluamos el modelo en el conjunto de pruebas para verificar su precisión, utilizando el DataLoader para procesar las imágenes en lotes.
 
 """
 
-model.eval()
-correct = 0
-total = 0
-with torch.no_grad():
-    for images, labels in test_loader:
-        images, labels = images.to(device), labels.to(device)
-        outputs = model(images)
-        _, predicted = torch.max(outputs.data, 1)
-        total += labels.size(0)
-        correct += (predicted == labels).sum().item()
-
-print(f'Accuracy: {100 * correct / total}%')
-
-# Suponiendo que 'model' es tu modelo y 'test_loader' es tu DataLoader para el conjunto de prueba
-model.eval()
-all_labels = []
-all_preds = []
-
-with torch.no_grad():
-    for images, labels in test_loader:
-        images, labels = images.to(device), labels.to(device)
-        outputs = model(images)
-        _, predicted = torch.max(outputs.data, 1)
-        all_labels.extend(labels.cpu().numpy())
-        all_preds.extend(predicted.cpu().numpy())
-
-# Calcular la matriz de confusión
-conf_mat = confusion_matrix(all_labels, all_preds)
+if USAR_CACHE_EMBEDDINGS:
+    # Con la caché, una sola pasada del clasificador sobre los embeddings de test
+    model.classifier.eval()
+    results = mobilenet.evaluate_streaming(
+        mobilenet.iterate_embedding_batches(test_features, test_labels, batch_size=1024), model.classifier)
+else:
+    model.eval()
+    results = mobilenet.evaluate_streaming(test_loader, model)
+
+print(f'Accuracy: {100 * results["accuracy"]}%')
+for digit, (precision, recall) in enumerate(zip(results['precision'], results['recall'])):
+    print(f'Clase {digit}: precision={precision:.4f}, recall={recall:.4f}')
+
+# Matriz de confusión acumulada durante la evaluación
+conf_mat = results['confusion_matrix']
 
 # Dibujar la matriz de confusión usando Seaborn
-plt.figure(figsize=(10, 8))
-sns.heatmap(conf_mat, annot=True, fmt='d', cmap='Blues', xticklabels=range(10), yticklabels=range(10))
-plt.title('Confusion Matrix for MobileNetV2 on MNIST')
-plt.xlabel('Predicted Labels')
-plt.ylabel('True Labels')
+plotting.plot_confusion_matrix(conf_mat, title='Confusion Matrix for MobileNetV2 on MNIST',
+                               xlabel='Predicted Labels', ylabel='True Labels',
+                               xticklabels=range(10), yticklabels=range(10))
 plt.show()
 
+"""## Barrido de resolución de entrada
+`Resize(224)` multiplica por 64 la cantidad de píxeles de cada dígito de 28x28: casi todo el cómputo del backbone se va en píxeles interpolados que no agregan información. `RESOLUCION_MOBILENET` permite entrenar con entradas de 32, 64, 96 o 128 píxeles. Como el clasificador va después del pooling global, no hay que cambiarlo; lo que sí se ajusta es el stride: el backbone reduce la imagen 32 veces, y a 32x32 el mapa final quedaría en 1x1, así que `mobilenet.adapt_strides` pasa las primeras convoluciones de stride 2 a stride 1 hasta que el mapa final tenga al menos 4x4. Los pesos preentrenados siguen sirviendo.
+
+El barrido entrena el clasificador para cada resolución (sobre la caché de embeddings) y reporta accuracy, imágenes por segundo de inferencia, FLOPs por imagen y memoria de activaciones. Con una accuracy objetivo, recomienda la resolución más rápida que la alcanza. Desde la línea de comandos: `python -m practica_cnn sweep-resolution --target-accuracy 0.98`.
+"""
+
+# Ejecutar el barrido de resolución (entrena un clasificador por resolución). Corre desde la línea de
+# comandos: el pico de memoria en CPU se mide en procesos lanzados con spawn, que volverían a ejecutar este script
+BARRIDO_RESOLUCION = False
+
+if BARRIDO_RESOLUCION:
+    cli.run_subcommand('sweep-resolution', '--sizes', 32, 64, 96, 128, 224, '--target-accuracy', 0.98,
+                       *([] if USAR_STORE_MNIST else ['--no-store']))
+
+"""# Exportación optimizada para inferencia
+Para servir los modelos en CPU no conviene usar los modelos de entrenamiento tal cual. En esta sección exportamos:
+- `model_cnn` a **TFLite**, en float32, con cuantización de rango dinámico (pesos int8) y con cuantización entera completa calibrada con un subconjunto de `x_train`.
+- MobileNetV2 a **TorchScript** en float32 y con cuantización estática post-entrenamiento a int8, fusionando antes las capas Conv-BN. Si está instalado `onnxruntime`, también se exporta la versión float32 a **ONNX**.
+
+Cada artefacto se valida contra la accuracy del modelo float sin exportar (el de Keras y el de PyTorch en modo eager) en el conjunto de prueba y se mide su latencia (p50/p99 para una imagen) y su throughput en lotes en CPU.
+"""
+
+from practica_cnn import export
+
+# Activar la exportación y validación de los modelos
+EXPORTAR_MODELOS = False
+
+"""## Keras → TFLite"""
+
+if EXPORTAR_MODELOS:
+    float_accuracy = prediction_cache.get(x_test, y_test).accuracy
+    export.print_export_report(export.export_keras_models(model_cnn, x_train, x_test, y_test, float_accuracy))
+
+"""## PyTorch → TorchScript / ONNX con cuantización int8
+Cuantizamos el mismo MobileNetV2 que entrenamos con la cuantización en modo grafo (FX) de PyTorch: se traza el modelo, se fusionan Conv-BN, se calibran los observadores con algunos lotes de entrenamiento y se convierte a int8. No usamos la variante cuantizable de torchvision porque reemplaza las activaciones ReLU6 por ReLU: sería otra red, y la diferencia de accuracy mezclaría el error de cuantización con el cambio de activación.
+"""
+
+if EXPORTAR_MODELOS:
+    export.print_export_report(export.export_torch_models(model, train_loader, test_loader))
+
+"""## Destilación de MobileNetV2 en la CNN y poda estructurada
+MobileNetV2 es más preciso, pero `model_cnn` es mucho más barato de servir. Con **destilación de conocimiento** usamos MobileNetV2 como profesor y la CNN como alumno. El alumno tiene la misma arquitectura Conv2D(32)-Conv2D(64)-Dense(128) y aprende de las probabilidades suavizadas del profesor (con temperatura T) además de las etiquetas. Las probabilidades del profesor indican qué dígitos se parecen entre sí, información que una etiqueta sola no trae. Los logits del profesor se calculan una sola vez, a partir de la caché de embeddings, y se guardan en disco.
+
+Después se aplica **poda estructurada**: se quitan los filtros de las convoluciones y las unidades de la `Dense(128)` de menor norma L1. El resultado es un modelo realmente más chico y no uno con pesos en cero. Cada modelo podado se ajusta con la misma pérdida de destilación. Para cada nivel de poda se reportan parámetros, tamaño, accuracy en test y latencia. Desde la línea de comandos: `python -m practica_cnn distill --sparsities 0 0.25 0.5 0.75`.
+"""
+
+from practica_cnn import distill
+
+# Destilar y podar (entrena un alumno y un ajuste fino por nivel de poda)
+DESTILAR_CNN = False
+
+if DESTILAR_CNN:
+    distill.distill_and_prune(model, train_dataset, x_train, y_train, x_test, y_test,
+                              sparsities=(0.0, 0.25, 0.5, 0.75), uint8_input=USAR_PIPELINE_UINT8)
+
+"""# Benchmark de los dos caminos: CNN desde cero vs MobileNetV2
+La comparación cualitativa de más abajo afirma, por ejemplo, que MobileNetV2 procesa imágenes rápidamente. Para decidir una arquitectura de despliegue necesitamos números. Este benchmark no necesita red: usa datos sintéticos con la forma de MNIST y una MobileNetV2 sin pesos preentrenados (la arquitectura y el costo de cómputo son los mismos). Para cada modelo mide:
+- throughput de entrenamiento (imágenes/s por paso de optimización),
+- throughput de inferencia para distintos tamaños de lote,
+- latencia p50/p90/p99 de una predicción de una sola imagen,
+- memoria residente máxima del proceso (RSS) y tiempo de carga del modelo desde disco.
+
+Los resultados se guardan en JSON y se comparan con una línea base guardada para marcar regresiones.
+"""
+
+from practica_cnn import cli
+
+# Ejecutar el benchmark y compararlo con la línea base (./benchmarks/baseline.json)
+EJECUTAR_BENCHMARK = False
+
+# Cada modelo se mide en un proceso propio; el benchmark corre desde la línea de comandos para que esos
+# procesos no vuelvan a ejecutar este script
+if EJECUTAR_BENCHMARK:
+    cli.run_subcommand('benchmark', *([] if USAR_PIPELINE_UINT8 else ['--float-input']))
+
+"""# Perfilado por capa
+`model_cnn.summary()` muestra la cantidad de parámetros, pero no dónde se va el tiempo ni la memoria. El módulo `practica_cnn.profiling` instrumenta ambos modelos: en PyTorch con hooks de forward y backward en cada módulo, y en Keras ejecutando un paso de entrenamiento capa por capa (o cada N lotes durante `fit` con `KerasLayerProfiler.callback`). Por capa y por paso registra el tiempo de forward y de backward, una estimación de FLOPs, la memoria de la activación de salida y la cantidad de asignaciones.
+
+El resultado es una tabla de capas calientes ordenada por tiempo y una traza JSON que se abre en `chrome://tracing` o en ui.perfetto.dev. Así se ve, por ejemplo, si dominan los primeros bloques de MobileNetV2 a 224x224 o la capa `Dense(128)` de la CNN, y se optimiza donde realmente rinde. Ningún perfilado actualiza los pesos. Desde la línea de comandos: `python -m practica_cnn profile {cnn,mobilenet}`.
+"""
+
+import os
+from practica_cnn import profiling
+
+# Perfilar ambos modelos por capa y guardar las trazas en ./profiles
+PERFILAR_CAPAS = False
+
+if PERFILAR_CAPAS:
+    os.makedirs('./profiles', exist_ok=True)
+    cnn_profiler = profiling.profile_model_cnn(model_cnn, x_train, y_train, steps=10)
+    cnn_profiler.print_hot_layers()
+    cnn_profiler.save_chrome_trace('./profiles/cnn_trace.json')
+
+    mobilenet_profiler = profiling.profile_mobilenet(model, test_loader, criterion, steps=3)
+    mobilenet_profiler.print_hot_layers()
+    mobilenet_profiler.save_chrome_trace('./profiles/mobilenet_trace.json')
+
 """# Conclusión comparativa: Diseño de CNN desde cero vs Uso de Modelos Preentrenados
 
 Al enfrentarnos al desafío de implementar soluciones de visión por computadora, tenemos dos caminos principales: diseñar una red neuronal convolucional (CNN) desde cero o aprovechar los modelos ya preentrenados. Cada enfoque tiene sus ventajas y desventajas y puede ser más conveniente en diferentes escenarios.
@@ -0,0 +1,20 @@
+"""Práctica de redes convolucionales sobre MNIST: CNN de Keras desde cero y MobileNetV2 preentrenada.
+
+Los submódulos que dependen de TensorFlow, PyTorch, scikit-learn o matplotlib se importan solo
+cuando se usan (`practica_cnn.keras_cnn`, `practica_cnn.mobilenet`, ...), de modo que un proceso
+que trabaja con una sola de las dos mitades no paga la inicialización de la otra.
+"""
+
+import importlib
+
+_SUBMODULES = ('data', 'augment', 'keras_cnn', 'mobilenet', 'evaluation', 'streaming', 'neighbors', 'plotting',
+               'export', 'server', 'benchmark', 'profiling', 'resolution', 'sweep', 'time_to_accuracy', 'distributed',
+               'distill', 'runtime', 'cli')
+
+__all__ = list(_SUBMODULES)
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module(f'.{name}', __name__)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
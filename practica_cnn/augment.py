@@ -0,0 +1,125 @@
+"""Aumentación de datos por lotes y vectorizada, para las dos mitades de la práctica.
+
+En lugar de transformar imagen por imagen en Python, cada lote se deforma con una sola grilla de
+muestreo: una transformación afín por imagen (desplazamiento y rotación) más una distorsión elástica
+suave, aplicadas con interpolación bilineal sobre todo el lote a la vez.
+
+- Keras: `keras_cnn.make_tf_dataset(..., augment=BatchAugment())` la aplica dentro del pipeline tf.data,
+  con NumPy, sobre los lotes uint8 de 28x28. Cada lote recibe una semilla propia del pipeline.
+- PyTorch: `mobilenet.make_loader(..., augment=BatchAugment())` la aplica al armar el lote (`collate_fn`),
+  con `affine_grid` y `grid_sample`, también a 224x224.
+
+Las coordenadas están normalizadas a [-1, 1] (la convención de `grid_sample`), así que los parámetros no
+dependen de la resolución: `max_shift=0.1` es el 10% del lado de la imagen. Fuera de la imagen se repite
+el borde (fondo negro en MNIST). Los parámetros salen de un `np.random.Generator` sembrado: con la misma
+semilla se obtiene la misma aumentación.
+"""
+
+import numpy as np
+
+
+# Interpolación lineal de `points` puntos de control a `size` píxeles, como matriz (size, points)
+def _interpolation_matrix(points, size):
+    t = np.linspace(0, points - 1, size)
+    lower = np.minimum(np.floor(t).astype(int), points - 2)
+    frac = t - lower
+    matrix = np.zeros((size, points), dtype=np.float32)
+    matrix[np.arange(size), lower] = 1 - frac
+    matrix[np.arange(size), lower + 1] = frac
+    return matrix
+
+
+class BatchAugment:
+    def __init__(self, max_shift=0.1, max_rotation=10.0, elastic_alpha=0.03, elastic_grid=4, seed=0):
+        self.max_shift = max_shift
+        self.max_rotation = max_rotation
+        self.elastic_alpha = elastic_alpha
+        self.elastic_grid = elastic_grid
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+
+    # Parámetros de un lote: matrices afines (B, 2, 3) que llevan cada punto de salida a su origen, y
+    # desplazamientos elásticos en una grilla gruesa (B, g, g, 2), interpolados después a toda la imagen
+    def sample_params(self, batch, rng=None):
+        rng = self.rng if rng is None else rng
+        angle = np.deg2rad(rng.uniform(-self.max_rotation, self.max_rotation, batch))
+        shift = 2 * rng.uniform(-self.max_shift, self.max_shift, (batch, 2))
+        cos, sin = np.cos(angle), np.sin(angle)
+        theta = np.stack([np.stack([cos, -sin, shift[:, 0]], axis=1),
+                          np.stack([sin, cos, shift[:, 1]], axis=1)], axis=1).astype(np.float32)
+        field = 2 * self.elastic_alpha * rng.uniform(-1, 1, (batch, self.elastic_grid, self.elastic_grid, 2))
+        return theta, field.astype(np.float32)
+
+    # Grilla de muestreo (B, H, W, 2) en coordenadas normalizadas (x, y), centros de píxel como en
+    # grid_sample con align_corners=False
+    def sampling_grid(self, theta, field, height, width):
+        ys = (2 * np.arange(height, dtype=np.float32) + 1) / height - 1
+        xs = (2 * np.arange(width, dtype=np.float32) + 1) / width - 1
+        base = np.stack(np.meshgrid(xs, ys), axis=-1)
+        base = np.concatenate([base, np.ones((height, width, 1), dtype=np.float32)], axis=-1)
+        grid = (base.reshape(1, -1, 3) @ theta.transpose(0, 2, 1)).reshape(-1, height, width, 2)
+        rows, cols = _interpolation_matrix(self.elastic_grid, height), _interpolation_matrix(self.elastic_grid, width)
+        return grid + (rows @ field.transpose(0, 3, 1, 2) @ cols.T).transpose(0, 2, 3, 1)
+
+    # NumPy: lotes (B, H, W) o (B, H, W, C); se devuelve el mismo dtype (uint8 redondeado)
+    def __call__(self, images, seed=None):
+        rng = None if seed is None else np.random.default_rng(seed)
+        images = np.asarray(images)
+        x = images.reshape(images.shape[:3] + (-1,)).astype(np.float32)
+        batch, height, width, channels = x.shape
+        grid = self.sampling_grid(*self.sample_params(batch, rng), height, width)
+
+        # De coordenadas normalizadas a píxeles, con el borde repetido fuera de la imagen
+        px = np.clip(((grid[..., 0] + 1) * width - 1) / 2, 0, width - 1)
+        py = np.clip(((grid[..., 1] + 1) * height - 1) / 2, 0, height - 1)
+        x0 = np.minimum(np.floor(px).astype(np.int64), width - 2)
+        y0 = np.minimum(np.floor(py).astype(np.int64), height - 2)
+        wx, wy = (px - x0)[..., None], (py - y0)[..., None]
+
+        flat = x.reshape(batch, height * width, channels)
+
+        def gather(yy, xx):
+            return np.take_along_axis(flat, (yy * width + xx).reshape(batch, -1, 1), axis=1).reshape(x.shape)
+
+        out = ((1 - wy) * ((1 - wx) * gather(y0, x0) + wx * gather(y0, x0 + 1))
+               + wy * ((1 - wx) * gather(y0 + 1, x0) + wx * gather(y0 + 1, x0 + 1)))
+        if images.dtype == np.uint8:
+            out = np.clip(np.rint(out), 0, 255)
+        return out.astype(images.dtype).reshape(images.shape)
+
+    # PyTorch: lotes (B, H, W) uint8 del almacén o (B, C, H, W) float de la transformación por imagen
+    def apply_torch(self, images):
+        import torch
+        import torch.nn.functional as F
+
+        theta, field = self.sample_params(images.size(0))
+        height, width = images.shape[-2:]
+        grid = F.affine_grid(torch.from_numpy(theta), (images.size(0), 1, height, width), align_corners=False)
+        rows = torch.from_numpy(_interpolation_matrix(self.elastic_grid, height))
+        cols = torch.from_numpy(_interpolation_matrix(self.elastic_grid, width))
+        grid = grid + (rows @ torch.from_numpy(field).permute(0, 3, 1, 2) @ cols.T).permute(0, 2, 3, 1)
+
+        x = images.unsqueeze(1) if images.dim() == 3 else images
+        out = F.grid_sample(x.float(), grid.to(x.device), mode='bilinear', padding_mode='border', align_corners=False)
+        if images.dtype == torch.uint8:
+            out = out.round_().clamp_(0, 255)
+        return out.to(images.dtype).view(images.shape)
+
+
+# collate_fn que arma el lote con `collate_fn` y le aplica la aumentación; cada worker del DataLoader
+# siembra su propio generador para no repetir los parámetros de los demás
+class AugmentCollate:
+    def __init__(self, augment, collate_fn):
+        self.augment = augment
+        self.collate_fn = collate_fn
+        self.worker_id = None
+
+    def __call__(self, batch):
+        from torch.utils.data import get_worker_info
+
+        info = get_worker_info()
+        if info is not None and self.worker_id != info.id:
+            self.worker_id = info.id
+            self.augment.rng = np.random.default_rng([self.augment.seed, info.id])
+        images, labels = self.collate_fn(batch)
+        return self.augment.apply_torch(images), labels
@@ -0,0 +1,181 @@
+"""Benchmark sin red de los dos caminos: la CNN de Keras y MobileNetV2.
+
+Usa datos sintéticos con la forma de MNIST y una MobileNetV2 sin pesos preentrenados (la arquitectura
+y el costo de cómputo son los mismos). Para cada modelo mide throughput de entrenamiento, throughput de
+inferencia por tamaño de lote, latencia p50/p90/p99 de una sola imagen, RSS máxima y tiempo de carga.
+Cada modelo se mide en un proceso aparte, así que la RSS máxima es la de ese modelo y su framework.
+Los resultados se guardan en JSON y se comparan con una línea base para marcar regresiones.
+"""
+
+import os
+import json
+import time
+import platform
+import resource
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+BENCHMARK_DIR = './benchmarks'
+BENCHMARK_BASELINE = os.path.join(BENCHMARK_DIR, 'baseline.json')
+MODELS = ('model_cnn', 'mobilenet_v2')
+
+
+def synthetic_mnist(n, size=28, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 256, (n, size, size), dtype=np.uint8), rng.integers(0, 10, n).astype(np.int64)
+
+
+# Memoria residente máxima del proceso hasta el momento (ru_maxrss está en KB en Linux)
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def time_calls(fn, repeats, warmup=3):
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return np.asarray(times)
+
+
+def latency_percentiles(times):
+    return {f'latency_p{p}_ms': float(np.percentile(times, p) * 1000) for p in (50, 90, 99)}
+
+
+def benchmark_keras_cnn(uint8_input=True, batch_sizes=(1, 32, 128, 512), train_batch_size=128, train_steps=20,
+                        latency_repeats=100):
+    import tensorflow as tf
+    from .keras_cnn import build_model_cnn
+
+    images, labels = synthetic_mnist(max(max(batch_sizes), train_batch_size))
+    images = images.reshape(-1, 28, 28, 1)
+    if not uint8_input:
+        images = images.astype('float32') / 255
+    bench_model = build_model_cnn(uint8_input)
+
+    results = {}
+    x, y = images[:train_batch_size], labels[:train_batch_size]
+    times = time_calls(lambda: bench_model.train_on_batch(x, y), train_steps)
+    results['train_img_s'] = train_batch_size / float(np.median(times))
+
+    forward = tf.function(lambda x: bench_model(x, training=False))
+    for batch_size in batch_sizes:
+        batch = tf.constant(images[:batch_size].astype(np.float32))
+        times = time_calls(lambda: forward(batch).numpy(), max(5, 2000 // batch_size))
+        results[f'infer_img_s_bs{batch_size}'] = batch_size / float(np.median(times))
+
+    # Latencia de model.predict con una sola imagen, como en plot_images
+    results.update(latency_percentiles(time_calls(lambda: bench_model.predict(images[:1], verbose=0), latency_repeats)))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'model_cnn.keras')
+        bench_model.save(path)
+        results['load_time_s'] = float(np.median(time_calls(lambda: tf.keras.models.load_model(path), 3, warmup=1)))
+    results['peak_rss_mb'] = peak_rss_mb()
+    return results
+
+
+def benchmark_mobilenet(batch_sizes=(1, 8, 32, 64), train_batch_size=32, train_steps=5, latency_repeats=30, size=224):
+    import torch
+    from .mobilenet import build_mobilenet, build_optimizer, to_model_input, device
+
+    images, labels = synthetic_mnist(max(max(batch_sizes), train_batch_size), size=size)
+    images, labels = torch.from_numpy(images), torch.from_numpy(labels)
+    net = build_mobilenet(pretrained=False, input_size=size)
+    criterion, bench_optimizer = build_optimizer(net)
+
+    results = {}
+    x, y = to_model_input(images[:train_batch_size]), labels[:train_batch_size].to(device)
+    def train_step():
+        bench_optimizer.zero_grad()
+        loss = criterion(net(x), y)
+        loss.backward()
+        bench_optimizer.step()
+        loss.item()
+    net.train()
+    times = time_calls(train_step, train_steps, warmup=1)
+    results['train_img_s'] = train_batch_size / float(np.median(times))
+
+    net.eval()
+    with torch.no_grad():
+        for batch_size in batch_sizes:
+            batch = to_model_input(images[:batch_size])
+            times = time_calls(lambda: net(batch).cpu(), max(3, 64 // batch_size), warmup=1)
+            results[f'infer_img_s_bs{batch_size}'] = batch_size / float(np.median(times))
+        single = images[:1]
+        results.update(latency_percentiles(time_calls(lambda: net(to_model_input(single)).argmax(1).cpu(), latency_repeats)))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'mobilenet_v2.pt')
+        torch.save(net.state_dict(), path)
+        def load():
+            loaded = build_mobilenet(pretrained=False, input_size=size)
+            loaded.load_state_dict(torch.load(path, map_location=device))
+        results['load_time_s'] = float(np.median(time_calls(load, 3, warmup=1)))
+    results['peak_rss_mb'] = peak_rss_mb()
+    return results
+
+
+# Se ejecuta en un proceso nuevo por modelo: devuelve las versiones del framework y las mediciones
+def _benchmark_in_process(name, uint8_input):
+    if name == 'model_cnn':
+        import tensorflow as tf
+        return {'tensorflow': tf.__version__}, benchmark_keras_cnn(uint8_input)
+    import torch
+    return {'torch': str(torch.__version__), 'torch_threads': torch.get_num_threads()}, benchmark_mobilenet()
+
+
+# Cada modelo se mide en su propio proceso (spawn): la RSS máxima solo crece dentro de un proceso, y en uno
+# compartido la de MobileNetV2 incluiría a TensorFlow y a la CNN medidos antes
+def run_benchmarks(models=MODELS, uint8_input=True):
+    environment = {'platform': platform.platform(), 'python': platform.python_version()}
+    results = {}
+    for name in MODELS:
+        if name not in models:
+            continue
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as pool:
+            versions, results[name] = pool.submit(_benchmark_in_process, name, uint8_input).result()
+        environment.update(versions)
+    return {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'environment': environment, 'models': results}
+
+
+# Compara con la línea base: throughput (img/s) cuanto más alto mejor; latencias, memoria y carga, cuanto más bajo mejor
+def compare_to_baseline(results, baseline, tolerance=0.10):
+    regressions = []
+    print(f'{"Modelo":<14}{"Métrica":<22}{"Base":>12}{"Actual":>12}{"Cambio":>9}')
+    for name, metrics in results['models'].items():
+        for key, value in metrics.items():
+            base = baseline.get('models', {}).get(name, {}).get(key)
+            if not base:
+                continue
+            change = (value - base) / base
+            worse = change < -tolerance if '_img_s' in key else change > tolerance
+            print(f'{name:<14}{key:<22}{base:>12.2f}{value:>12.2f}{change:>+9.1%}{"  REGRESIÓN" if worse else ""}')
+            if worse:
+                regressions.append((name, key, base, value))
+    return regressions
+
+
+# Ejecuta el benchmark, guarda latest.json y compara con la línea base (o la crea si no existe)
+def run_and_compare(benchmark_dir=BENCHMARK_DIR, baseline_path=None, tolerance=0.10, **kwargs):
+    baseline_path = baseline_path or os.path.join(benchmark_dir, 'baseline.json')
+    os.makedirs(benchmark_dir, exist_ok=True)
+    benchmark_results = run_benchmarks(**kwargs)
+    with open(os.path.join(benchmark_dir, 'latest.json'), 'w') as f:
+        json.dump(benchmark_results, f, indent=2)
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            regressions = compare_to_baseline(benchmark_results, json.load(f), tolerance)
+        print(f'{len(regressions)} regresiones respecto de la línea base')
+        return regressions
+    with open(baseline_path, 'w') as f:
+        json.dump(benchmark_results, f, indent=2)
+    print(json.dumps(benchmark_results['models'], indent=2))
+    print(f'Línea base guardada en {baseline_path}')
+    return []
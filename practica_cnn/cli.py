@@ -0,0 +1,608 @@
+"""Línea de comandos: `python -m practica_cnn <subcomando>`.
+
+Cada subcomando importa solo los módulos (y por lo tanto los frameworks) que necesita, y al terminar
+escribe en stderr un reporte de arranque: tiempo de cada import, momento en que el proceso quedó
+listo para trabajar, frameworks cargados y tiempo total.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import importlib
+import itertools
+
+_CLI_START = time.perf_counter()
+_FRAMEWORKS = ('tensorflow', 'torch', 'torchvision', 'sklearn', 'matplotlib', 'seaborn')
+
+
+class StartupTimer:
+    def __init__(self, command):
+        self.command = command
+        self.imports = []
+        self.ready_at = None
+
+    def import_module(self, name):
+        start = time.perf_counter()
+        module = importlib.import_module(name, __package__)
+        self.imports.append((name.lstrip('.'), time.perf_counter() - start))
+        return module
+
+    def ready(self):
+        self.ready_at = time.perf_counter() - _CLI_START
+
+    def report(self):
+        imports = ', '.join(f'{name} {seconds:.2f}s' for name, seconds in self.imports)
+        frameworks = ', '.join(m for m in _FRAMEWORKS if m in sys.modules) or 'ninguno'
+        ready = f'{self.ready_at:.2f}s' if self.ready_at is not None else '-'
+        print(f'[arranque] {self.command}: imports [{imports}]; listo en {ready}; frameworks cargados: {frameworks}; '
+              f'total {time.perf_counter() - _CLI_START:.2f}s', file=sys.stderr)
+
+
+# Ejecuta un subcomando en un proceso aparte y muestra su salida a medida que llega. Lo usan las celdas
+# del notebook que lanzan procesos con spawn: un proceso hijo vuelve a importar el script principal, y si
+# ese script es el notebook sin `if __name__ == '__main__'`, lo ejecutaría entero otra vez
+def run_subcommand(*argv):
+    import subprocess
+
+    command = [sys.executable, '-m', __package__, *map(str, argv)]
+    with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True) as process:
+        for line in process.stdout:
+            print(line, end='', flush=True)
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, command)
+
+
+def _history_path(model_path):
+    return os.path.splitext(model_path)[0] + '.history.json'
+
+
+# Reporte de train-to-target; va aparte para no pisar el historial de Keras que usa `report`
+def _target_report_path(model_path):
+    return os.path.splitext(model_path)[0] + '.target.json'
+
+
+def train_cnn(args, timer):
+    keras_cnn = timer.import_module('.keras_cnn')
+    timer.ready()
+    uint8_input = not args.float_input
+    (x_train, y_train), _ = keras_cnn.load_data(uint8_input, use_store=not args.no_store)
+    model_cnn = keras_cnn.build_model_cnn(uint8_input)
+    augment = timer.import_module('.augment').BatchAugment(seed=args.seed) if args.augment else None
+    history = keras_cnn.train_model_cnn(model_cnn, x_train, y_train, epochs=args.epochs, batch_size=args.batch_size,
+                                        augment=augment)
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    model_cnn.save(args.output)
+    with open(_history_path(args.output), 'w') as f:
+        json.dump({k: [float(v) for v in values] for k, values in history.history.items()}, f)
+    print(f'Modelo guardado en {args.output}')
+
+
+def train_mobilenet(args, timer):
+    mobilenet = timer.import_module('.mobilenet')
+    timer.ready()
+    # La caché de embeddings guarda un embedding fijo por imagen: no admite aumentación
+    if args.augment and args.mode == 'cache':
+        sys.exit('--augment requiere --mode fast o --mode plain')
+    train_dataset, test_dataset = mobilenet.load_datasets(use_store=not args.no_store, resized=not args.no_resized,
+                                                          size=args.input_size)
+    augment = timer.import_module('.augment').BatchAugment(seed=args.seed) if args.augment else None
+    train_loader = mobilenet.make_loader(train_dataset, batch_size=args.batch_size, shuffle=True, augment=augment)
+    model = mobilenet.build_mobilenet(input_size=args.input_size)
+    criterion, optimizer = mobilenet.build_optimizer(model, lr=args.lr)
+    if args.mode == 'cache':
+        features, labels = mobilenet.build_embedding_cache(model, train_dataset, 'train')
+        mobilenet.train_head_from_cache(model, criterion, optimizer, args.epochs, features, labels,
+                                        batch_size=args.batch_size)
+    elif args.mode == 'fast':
+        mobilenet.train_model_fast(model, train_loader, criterion, optimizer, args.epochs,
+                                   use_bf16=not args.no_bf16, compile_model=args.compile)
+    else:
+        mobilenet.train_model(model, train_loader, criterion, optimizer, args.epochs)
+    mobilenet.save_mobilenet(model, args.output)
+    print(f'Modelo guardado en {args.output}')
+
+
+# Sin RANK en el entorno se lanzan --nproc procesos locales; con torchrun, este proceso es un rank más
+def train_ddp(args, timer):
+    distributed = timer.import_module('.distributed')
+    timer.ready()
+    kwargs = dict(batch_size=args.batch_size, lr=args.lr, use_store=not args.no_store, resized=not args.no_resized,
+                  input_size=args.input_size, pretrained=not args.no_pretrained)
+    if args.scaling:
+        distributed.measure_scaling(args.scaling, num_epochs=args.epochs, **kwargs)
+    elif 'RANK' in os.environ:
+        distributed.run(num_epochs=args.epochs, output=args.output, checkpoint_path=args.checkpoint, **kwargs)
+    else:
+        distributed.launch_local(args.nproc, num_epochs=args.epochs, output=args.output, checkpoint_path=args.checkpoint,
+                                 **kwargs)
+
+
+# Entrena hasta la accuracy objetivo o el presupuesto de tiempo. MobileNetV2 se valida sobre el 20% del
+# split de entrenamiento, igual que la CNN; con --mode cache se entrena solo el clasificador
+def train_to_target(args, timer):
+    if args.model == 'cnn':
+        keras_cnn = timer.import_module('.keras_cnn')
+    else:
+        mobilenet = timer.import_module('.mobilenet')
+    time_to_accuracy = timer.import_module('.time_to_accuracy')
+    timer.ready()
+    augment = timer.import_module('.augment').BatchAugment(seed=args.seed) if args.augment else None
+    kwargs = dict(target_accuracy=args.target_accuracy, time_budget_s=args.time_budget, max_lr=args.max_lr,
+                  schedule=args.schedule, patience=args.patience, resume=not args.no_resume)
+    if args.model == 'cnn':
+        uint8_input = not args.float_input
+        (x_train, y_train), _ = keras_cnn.load_data(uint8_input, use_store=not args.no_store)
+        model_cnn = keras_cnn.build_model_cnn(uint8_input)
+        report = time_to_accuracy.train_cnn_to_target(
+            model_cnn, x_train, y_train, max_epochs=args.max_epochs or 15, batch_size=args.batch_size,
+            checkpoint_path=args.checkpoint or time_to_accuracy.CNN_CHECKPOINT, augment=augment, **kwargs)
+        output = args.output or keras_cnn.MODEL_PATH
+        os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+        model_cnn.save(output)
+    else:
+        if args.augment and args.mode == 'cache':
+            sys.exit('--augment requiere --mode plain')
+        from sklearn.model_selection import train_test_split
+        import torch
+        train_dataset, _ = mobilenet.load_datasets(use_store=not args.no_store, resized=not args.no_resized,
+                                                   size=args.input_size)
+        train_idx, val_idx = train_test_split(range(len(train_dataset)), test_size=0.2, random_state=42)
+        model = mobilenet.build_mobilenet(input_size=args.input_size).to(mobilenet.device)
+        if args.mode == 'cache':
+            features, labels = mobilenet.build_embedding_cache(model, train_dataset, 'train')
+            module = model.classifier
+            train_batches = mobilenet.EmbeddingBatches(features, labels, args.batch_size, shuffle=True,
+                                                       indices=train_idx)
+            val_batches = mobilenet.EmbeddingBatches(features, labels, 1024, indices=val_idx)
+        else:
+            module = model
+            subset = torch.utils.data.Subset
+            train_batches = mobilenet.make_loader(subset(train_dataset, train_idx), batch_size=args.batch_size,
+                                                  shuffle=True, augment=augment)
+            val_batches = mobilenet.make_loader(subset(train_dataset, val_idx), batch_size=256, shuffle=False)
+        criterion, optimizer = mobilenet.build_optimizer(module, lr=args.max_lr)
+        report = time_to_accuracy.train_torch_to_target(
+            module, train_batches, val_batches, criterion, optimizer, max_epochs=args.max_epochs or 10,
+            checkpoint_path=args.checkpoint or time_to_accuracy.mobilenet_checkpoint_path(args.mode, args.input_size),
+            config={'model': 'mobilenet', 'mode': args.mode, 'input_size': args.input_size}, **kwargs)
+        output = args.output or mobilenet.MODEL_PATH
+        mobilenet.save_mobilenet(model, output)
+    time_to_accuracy.print_target_report(report)
+    with open(_target_report_path(output), 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Modelo guardado en {output}')
+
+
+def _evaluate_cnn(args, timer):
+    keras_cnn = timer.import_module('.keras_cnn')
+    evaluation = timer.import_module('.evaluation')
+    timer.ready()
+    model_cnn = keras_cnn.load_model_cnn(args.model or keras_cnn.MODEL_PATH)
+    _, (x_test, y_test) = keras_cnn.load_data(keras_cnn.expects_uint8(model_cnn), use_store=not args.no_store)
+    return model_cnn, x_test, y_test, evaluation.PredictionCache(model_cnn).get(x_test, y_test)
+
+
+def _evaluate_mobilenet(args, timer):
+    mobilenet = timer.import_module('.mobilenet')
+    timer.ready()
+    model = mobilenet.load_mobilenet(args.model or mobilenet.MODEL_PATH, input_size=args.input_size)
+    _, test_dataset = mobilenet.load_datasets(use_store=not args.no_store, resized=not args.no_resized,
+                                              size=args.input_size)
+    model.eval()
+    return mobilenet.evaluate_streaming(mobilenet.make_loader(test_dataset, batch_size=256, shuffle=False), model)
+
+
+def evaluate(args, timer):
+    if args.model_type == 'cnn':
+        _, _, _, results = _evaluate_cnn(args, timer)
+        print(f'Loss: {results.loss:.4f}, Accuracy: {results.accuracy:.4f}')
+        report = results.classification_report
+        for digit in range(10):
+            entry = report[str(digit)]
+            print(f'Clase {digit}: precision={entry["precision"]:.4f}, recall={entry["recall"]:.4f}')
+    else:
+        results = _evaluate_mobilenet(args, timer)
+        print(f'Accuracy: {results["accuracy"]:.4f}')
+        for digit, (precision, recall) in enumerate(zip(results['precision'], results['recall'])):
+            print(f'Clase {digit}: precision={precision:.4f}, recall={recall:.4f}')
+
+
+def report(args, timer):
+    import matplotlib
+    matplotlib.use('Agg')
+    os.makedirs(args.output_dir, exist_ok=True)
+    figures = {}
+    if args.model_type == 'cnn':
+        _, x_test, y_test, results = _evaluate_cnn(args, timer)
+        plotting = timer.import_module('.plotting')
+        history_path = _history_path(args.model or timer.import_module('.keras_cnn').MODEL_PATH)
+        if os.path.exists(history_path):
+            with open(history_path) as f:
+                figures['training_history'] = plotting.plot_training_history(json.load(f))
+        figures['predictions'] = plotting.plot_images(x_test[0:9], y_test[0:9], results.predicted_classes[0:9])
+        figures['confusion_matrix'] = plotting.plot_confusion_matrix(results.confusion_matrix, cbar=False)
+        figures['precision_per_class'] = plotting.plot_precision_per_class(results.classification_report)
+        # Los errores van directo a PNG (sin figura) junto con el conteo de pares de confusión
+        path = plotting.save_misclassified_png(os.path.join(args.output_dir, 'cnn_misclassified.png'), x_test, y_test,
+                                               results.predicted_classes, num_classes=10, max_images=args.max_images)
+        print(f'Guardado {path}')
+        pairs = plotting.confusion_pairs(y_test, results.predicted_classes, num_classes=10)
+        path = os.path.join(args.output_dir, 'cnn_confusion_pairs.json')
+        with open(path, 'w') as f:
+            json.dump([{'true': t, 'predicted': p, 'count': n} for t, p, n in pairs], f, indent=2)
+        print(f'Guardado {path}')
+        for t, p, n in pairs[:10]:
+            print(f'  {t} -> {p}: {n}')
+    else:
+        results = _evaluate_mobilenet(args, timer)
+        plotting = timer.import_module('.plotting')
+        figures['confusion_matrix'] = plotting.plot_confusion_matrix(
+            results['confusion_matrix'], title='Confusion Matrix for MobileNetV2 on MNIST',
+            xlabel='Predicted Labels', ylabel='True Labels', xticklabels=range(10), yticklabels=range(10))
+    for name, fig in figures.items():
+        path = os.path.join(args.output_dir, f'{args.model_type}_{name}.png')
+        fig.savefig(path, bbox_inches='tight')
+        print(f'Guardado {path}')
+
+
+def write_shards(args, timer):
+    data = timer.import_module('.data')
+    streaming = timer.import_module('.streaming')
+    timer.ready()
+    images, labels = data.open_mnist_store()[0 if args.split == 'train' else 1]
+    paths = streaming.write_shards(images, labels, args.output_dir, shard_size=args.shard_size,
+                                   shard_format=args.format)
+    print(f'{len(paths)} shards escritos en {args.output_dir}')
+
+
+# Evaluación en streaming sobre shards: métricas corrientes y predicciones por imagen en CSV
+def evaluate_shards(args, timer):
+    streaming = timer.import_module('.streaming')
+    if args.model_type == 'cnn':
+        keras_cnn = timer.import_module('.keras_cnn')
+        model_cnn = keras_cnn.load_model_cnn(args.model or keras_cnn.MODEL_PATH)
+        predict_batch = keras_cnn.make_predict_batch(model_cnn, keras_cnn.expects_uint8(model_cnn))
+    else:
+        mobilenet = timer.import_module('.mobilenet')
+        model = mobilenet.load_mobilenet(args.model or mobilenet.MODEL_PATH, input_size=args.input_size)
+        predict_batch = mobilenet.make_predict_batch(model, args.input_size)
+    timer.ready()
+    shards = streaming.list_shards(args.shards)
+    if args.scaling:
+        streaming.measure_reader_scaling(predict_batch, shards, args.scaling, batch_size=args.batch_size)
+        return
+    results = streaming.evaluate_shards(predict_batch, shards, batch_size=args.batch_size, num_readers=args.readers,
+                                        predictions_path=args.predictions)
+    streaming.print_streaming_report(results)
+    if args.predictions:
+        print(f'Predicciones guardadas en {args.predictions}')
+
+
+# kNN sobre embeddings de train + test: etiquetas sospechosas y casi-duplicados entre splits
+def find_neighbors(args, timer):
+    import numpy as np
+    neighbors = timer.import_module('.neighbors')
+    data = timer.import_module('.data')
+    (x_train, y_train), (x_test, y_test) = data.open_mnist_store()
+    if args.model_type == 'cnn':
+        keras_cnn = timer.import_module('.keras_cnn')
+        model_cnn = keras_cnn.load_model_cnn(args.model or keras_cnn.MODEL_PATH)
+        timer.ready()
+        (x_train_cnn, _), (x_test_cnn, _) = keras_cnn.load_data(keras_cnn.expects_uint8(model_cnn))
+        embeddings = np.concatenate([neighbors.cnn_embeddings(model_cnn, x_train_cnn),
+                                     neighbors.cnn_embeddings(model_cnn, x_test_cnn)])
+    else:
+        mobilenet = timer.import_module('.mobilenet')
+        model = mobilenet.load_mobilenet(args.model or mobilenet.MODEL_PATH, input_size=args.input_size)
+        timer.ready()
+        train_dataset, test_dataset = mobilenet.load_datasets(size=args.input_size)
+        embeddings = neighbors.mobilenet_embeddings(model, train_dataset, test_dataset)
+    report = neighbors.analyze_dataset(embeddings, np.concatenate([x_train, x_test]), np.concatenate([y_train, y_test]),
+                                       len(y_train), k=args.k, method=args.method, nprobe=args.nprobe,
+                                       pca_dim=args.pca_dim, min_agreement=args.min_agreement,
+                                       duplicate_threshold=args.duplicate_threshold, output_dir=args.output_dir)
+    neighbors.print_neighbors_report(report)
+    print(f'Reporte guardado en {args.output_dir}')
+
+
+def serve(args, timer):
+    import asyncio
+    keras_cnn = timer.import_module('.keras_cnn')
+    server = timer.import_module('.server')
+    model_cnn = keras_cnn.load_model_cnn(args.model or keras_cnn.MODEL_PATH)
+    uint8_input = keras_cnn.expects_uint8(model_cnn)
+    predict_batch = keras_cnn.make_predict_batch(model_cnn, uint8_input)
+    timer.ready()
+    server_kwargs = dict(max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms)
+    if args.load_test:
+        _, (x_test, _) = keras_cnn.load_data(uint8_input=True)
+        asyncio.run(server.load_test(predict_batch, x_test[:args.load_test], concurrency=args.concurrency,
+                                     host=args.host, port=args.port, **server_kwargs))
+    else:
+        print(f'Sirviendo en {args.unix_socket or f"http://{args.host}:{args.port}"}')
+        asyncio.run(server.serve_forever(predict_batch, host=args.host, port=args.port,
+                                         unix_socket=args.unix_socket, **server_kwargs))
+
+
+def export(args, timer):
+    export_module = timer.import_module('.export')
+    if args.model_type == 'cnn':
+        model_cnn, x_test, y_test, results = _evaluate_cnn(args, timer)
+        keras_cnn = timer.import_module('.keras_cnn')
+        (x_train, _), _ = keras_cnn.load_data(keras_cnn.expects_uint8(model_cnn), use_store=not args.no_store)
+        reports = export_module.export_keras_models(model_cnn, x_train, x_test, y_test, results.accuracy,
+                                                    export_dir=args.output_dir)
+    else:
+        mobilenet = timer.import_module('.mobilenet')
+        timer.ready()
+        model = mobilenet.load_mobilenet(args.model or mobilenet.MODEL_PATH, input_size=args.input_size)
+        train_dataset, test_dataset = mobilenet.load_datasets(use_store=not args.no_store, resized=not args.no_resized,
+                                                              size=args.input_size)
+        reports = export_module.export_torch_models(
+            model, mobilenet.make_loader(train_dataset, batch_size=128, shuffle=True),
+            mobilenet.make_loader(test_dataset, batch_size=128, shuffle=False), export_dir=args.output_dir)
+    export_module.print_export_report(reports)
+
+
+def benchmark(args, timer):
+    benchmark_module = timer.import_module('.benchmark')
+    timer.ready()
+    regressions = benchmark_module.run_and_compare(args.output_dir, args.baseline, args.tolerance,
+                                                   models=args.models, uint8_input=not args.float_input)
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+def sweep_cnn(args, timer):
+    sweep = timer.import_module('.sweep')
+    timer.ready()
+    sweep.run_sweep(sweep.sample_configs(args.trials, seed=args.seed), num_workers=args.workers,
+                    threads_per_worker=args.threads_per_worker, min_epochs=args.min_epochs, max_epochs=args.max_epochs,
+                    eta=args.eta, patience=args.patience, output_dir=args.output_dir)
+
+
+def sweep_resolution(args, timer):
+    resolution = timer.import_module('.resolution')
+    timer.ready()
+    resolution.run_sweep(args.sizes, target_accuracy=args.target_accuracy, output_path=args.output,
+                         epochs=args.epochs, use_store=not args.no_store, pretrained=not args.no_pretrained)
+
+
+# Sin un profesor entrenado en --teacher, se entrena el clasificador de MobileNetV2 sobre la caché de embeddings
+def distill(args, timer):
+    mobilenet = timer.import_module('.mobilenet')
+    keras_cnn = timer.import_module('.keras_cnn')
+    distill_module = timer.import_module('.distill')
+    timer.ready()
+    train_dataset, _ = mobilenet.load_datasets(use_store=not args.no_store, resized=not args.no_resized,
+                                               size=args.input_size)
+    if os.path.exists(args.teacher):
+        teacher = mobilenet.load_mobilenet(args.teacher, input_size=args.input_size)
+    else:
+        print(f'No existe {args.teacher}: se entrena el clasificador del profesor')
+        teacher = mobilenet.build_mobilenet(pretrained=not args.no_pretrained, input_size=args.input_size)
+        criterion, optimizer = mobilenet.build_optimizer(teacher)
+        features, labels = mobilenet.build_embedding_cache(teacher, train_dataset, 'train')
+        mobilenet.train_head_from_cache(teacher, criterion, optimizer, args.teacher_epochs, features, labels)
+    (x_train, y_train), (x_test, y_test) = keras_cnn.load_data(use_store=not args.no_store)
+    distill_module.distill_and_prune(teacher, train_dataset, x_train, y_train, x_test, y_test,
+                                     sparsities=args.sparsities, epochs=args.epochs,
+                                     finetune_epochs=args.finetune_epochs, temperature=args.temperature,
+                                     alpha=args.alpha, output_dir=args.output_dir)
+
+
+# Perfilado por capa sobre datos sintéticos: el modelo entrenado (--model) o uno recién construido
+def profile(args, timer):
+    profiling = timer.import_module('.profiling')
+    benchmark_module = timer.import_module('.benchmark')
+    if args.model_type == 'cnn':
+        keras_cnn = timer.import_module('.keras_cnn')
+        model_cnn = keras_cnn.load_model_cnn(args.model) if args.model else keras_cnn.build_model_cnn()
+        timer.ready()
+        batch_size = args.batch_size or 128
+        images, labels = benchmark_module.synthetic_mnist(batch_size)
+        images = images.reshape(-1, 28, 28, 1)
+        if not keras_cnn.expects_uint8(model_cnn):
+            images = images.astype('float32') / 255
+        profiler = profiling.profile_model_cnn(model_cnn, images, labels, steps=args.steps, batch_size=batch_size)
+    else:
+        import torch
+        mobilenet = timer.import_module('.mobilenet')
+        model = mobilenet.load_mobilenet(args.model) if args.model else mobilenet.build_mobilenet(pretrained=False)
+        criterion, _ = mobilenet.build_optimizer(model)
+        timer.ready()
+        images, labels = benchmark_module.synthetic_mnist(args.batch_size or 32, size=224)
+        batch = (torch.from_numpy(images), torch.from_numpy(labels))
+        profiler = profiling.profile_mobilenet(model, itertools.repeat(batch), criterion, steps=args.steps,
+                                               count_allocations=not args.no_allocations)
+    profiler.print_hot_layers(args.top)
+    os.makedirs(args.output_dir, exist_ok=True)
+    path = profiler.save_chrome_trace(os.path.join(args.output_dir, f'{args.model_type}_trace.json'))
+    print(f'Traza guardada en {path} (abrir en chrome://tracing o ui.perfetto.dev)')
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='practica_cnn', description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    def add_data_args(p, resized=False):
+        p.add_argument('--no-store', action='store_true', help='no usar el almacén local de MNIST')
+        if resized:
+            p.add_argument('--no-resized', action='store_true', help='usar la transformación por imagen')
+            p.add_argument('--input-size', type=int, default=224, help='resolución de entrada de MobileNetV2')
+
+    p = subparsers.add_parser('train-cnn', help='entrenar la CNN de Keras')
+    p.add_argument('--epochs', type=int, default=15)
+    p.add_argument('--batch-size', type=int, default=128)
+    p.add_argument('--float-input', action='store_true', help='datos float32 en lugar de uint8')
+    p.add_argument('--augment', action='store_true', help='aumentación por lotes (desplazamiento, rotación, elástica)')
+    p.add_argument('--seed', type=int, default=0, help='semilla de la aumentación')
+    p.add_argument('--output', default='./models/model_cnn.keras')
+    add_data_args(p)
+    p.set_defaults(func=train_cnn)
+
+    p = subparsers.add_parser('train-mobilenet', help='entrenar el clasificador de MobileNetV2')
+    p.add_argument('--epochs', type=int, default=3)
+    p.add_argument('--batch-size', type=int, default=128)
+    p.add_argument('--lr', type=float, default=0.001)
+    p.add_argument('--mode', choices=('cache', 'fast', 'plain'), default='cache')
+    p.add_argument('--no-bf16', action='store_true')
+    p.add_argument('--compile', action='store_true')
+    p.add_argument('--augment', action='store_true', help='aumentación por lotes (solo con --mode fast o plain)')
+    p.add_argument('--seed', type=int, default=0, help='semilla de la aumentación')
+    p.add_argument('--output', default='./models/mobilenet_v2.pt')
+    add_data_args(p, resized=True)
+    p.set_defaults(func=train_mobilenet)
+
+    p = subparsers.add_parser('train-to-target', help='entrenar hasta una accuracy objetivo o un presupuesto de tiempo')
+    p.add_argument('model', choices=('cnn', 'mobilenet'))
+    p.add_argument('--target-accuracy', type=float, default=0.99, help='accuracy de validación objetivo')
+    p.add_argument('--time-budget', type=float, default=None, help='presupuesto de tiempo en segundos')
+    p.add_argument('--max-epochs', type=int, default=None, help='por defecto 15 (cnn) o 10 (mobilenet)')
+    p.add_argument('--schedule', choices=('one_cycle', 'cosine', 'constant'), default='one_cycle')
+    p.add_argument('--max-lr', type=float, default=3e-3, help='tasa de aprendizaje máxima del schedule')
+    p.add_argument('--patience', type=int, default=3, help='épocas sin mejorar val_accuracy antes de parar')
+    p.add_argument('--batch-size', type=int, default=128)
+    p.add_argument('--checkpoint', default=None, help='checkpoint desde el que se retoma y que se actualiza')
+    p.add_argument('--no-resume', action='store_true', help='empezar de cero aunque exista el checkpoint')
+    p.add_argument('--mode', choices=('cache', 'plain'), default='cache', help='solo mobilenet')
+    p.add_argument('--float-input', action='store_true', help='solo cnn: datos float32 en lugar de uint8')
+    p.add_argument('--augment', action='store_true', help='aumentación por lotes (con mobilenet, solo --mode plain)')
+    p.add_argument('--seed', type=int, default=0, help='semilla de la aumentación')
+    p.add_argument('--output', default=None)
+    add_data_args(p, resized=True)
+    p.set_defaults(func=train_to_target)
+
+    p = subparsers.add_parser('train-ddp', help='entrenar MobileNetV2 en paralelo de datos (DDP, gloo)')
+    p.add_argument('--nproc', type=int, default=2, help='procesos locales (ignorado bajo torchrun)')
+    p.add_argument('--epochs', type=int, default=3)
+    p.add_argument('--batch-size', type=int, default=128, help='lote por proceso')
+    p.add_argument('--lr', type=float, default=0.001)
+    p.add_argument('--no-pretrained', action='store_true')
+    p.add_argument('--output', default='./models/mobilenet_v2.pt')
+    p.add_argument('--checkpoint', default='./models/mobilenet_v2_ddp.ckpt')
+    p.add_argument('--scaling', type=int, nargs='+', metavar='N',
+                   help='medir el tiempo por época con N procesos locales (por ejemplo: 1 2 4)')
+    add_data_args(p, resized=True)
+    p.set_defaults(func=train_ddp)
+
+    for name, func, help_text in (('evaluate', evaluate, 'evaluar un modelo entrenado'),
+                                  ('report', report, 'generar las gráficas de evaluación'),
+                                  ('export', export, 'exportar para inferencia en CPU')):
+        p = subparsers.add_parser(name, help=help_text)
+        p.add_argument('model_type', choices=('cnn', 'mobilenet'))
+        p.add_argument('--model', help='ruta del modelo entrenado')
+        if name != 'evaluate':
+            p.add_argument('--output-dir', default='./reports' if name == 'report' else './export')
+        if name == 'report':
+            p.add_argument('--max-images', type=int, default=5, help='imágenes mal clasificadas por clase')
+        add_data_args(p, resized=True)
+        p.set_defaults(func=func)
+
+    p = subparsers.add_parser('write-shards', help='repartir un split de MNIST en shards .npz o .tar')
+    p.add_argument('--split', choices=('train', 'test'), default='test')
+    p.add_argument('--shard-size', type=int, default=10000)
+    p.add_argument('--format', choices=('npz', 'tar'), default='npz')
+    p.add_argument('--output-dir', default='./data/shards')
+    p.set_defaults(func=write_shards)
+
+    p = subparsers.add_parser('evaluate-shards', help='evaluar en streaming, con memoria acotada, sobre shards')
+    p.add_argument('model_type', choices=('cnn', 'mobilenet'))
+    p.add_argument('shards', nargs='?', default='./data/shards', help='shard, directorio de shards o patrón glob')
+    p.add_argument('--model', help='ruta del modelo entrenado')
+    p.add_argument('--batch-size', type=int, default=1024)
+    p.add_argument('--readers', type=int, default=4, help='hilos lectores de shards')
+    p.add_argument('--predictions', help='CSV con la predicción de cada imagen')
+    p.add_argument('--scaling', type=int, nargs='+', metavar='N',
+                   help='medir img/s con N hilos lectores (por ejemplo: 1 2 4 8)')
+    p.add_argument('--input-size', type=int, default=224, help='resolución de entrada de MobileNetV2')
+    p.set_defaults(func=evaluate_shards)
+
+    p = subparsers.add_parser('neighbors', help='etiquetas sospechosas y casi-duplicados train/test con kNN')
+    p.add_argument('model_type', choices=('cnn', 'mobilenet'), help='de qué modelo salen los embeddings')
+    p.add_argument('--model', help='ruta del modelo entrenado')
+    p.add_argument('--k', type=int, default=10)
+    p.add_argument('--method', choices=('exact', 'ivf'), default='exact', help='kNN exacto por bloques o índice IVF')
+    p.add_argument('--nprobe', type=int, default=16, help='listas revisadas por consulta con --method ivf')
+    p.add_argument('--pca-dim', type=int, help='reducir los embeddings con PCA (por ejemplo 128 para mobilenet)')
+    p.add_argument('--min-agreement', type=float, default=0.8)
+    p.add_argument('--duplicate-threshold', type=float, default=0.99)
+    p.add_argument('--input-size', type=int, default=224, help='resolución de entrada de MobileNetV2')
+    p.add_argument('--output-dir', default='./reports/neighbors')
+    p.set_defaults(func=find_neighbors)
+
+    p = subparsers.add_parser('serve', help='servir model_cnn con micro-batching')
+    p.add_argument('--model', help='ruta del modelo entrenado')
+    p.add_argument('--host', default='127.0.0.1')
+    p.add_argument('--port', type=int, default=8000)
+    p.add_argument('--unix-socket')
+    p.add_argument('--max-batch-size', type=int, default=64)
+    p.add_argument('--max-wait-ms', type=float, default=5)
+    p.add_argument('--load-test', type=int, default=0, metavar='N', help='hacer una prueba de carga local con N peticiones')
+    p.add_argument('--concurrency', type=int, default=64)
+    p.set_defaults(func=serve)
+
+    p = subparsers.add_parser('benchmark', help='benchmark sin red de ambos modelos')
+    p.add_argument('--models', nargs='+', choices=('model_cnn', 'mobilenet_v2'), default=['model_cnn', 'mobilenet_v2'])
+    p.add_argument('--output-dir', default='./benchmarks')
+    p.add_argument('--baseline')
+    p.add_argument('--tolerance', type=float, default=0.10)
+    p.add_argument('--fail-on-regression', action='store_true')
+    p.add_argument('--float-input', action='store_true', help='CNN con entrada float32 en lugar de uint8')
+    p.set_defaults(func=benchmark)
+
+    p = subparsers.add_parser('sweep-cnn', help='barrido de hiperparámetros de la CNN en paralelo con successive halving')
+    p.add_argument('--trials', type=int, default=27)
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--workers', type=int, help='por defecto, núcleos / hilos por worker')
+    p.add_argument('--threads-per-worker', type=int, default=4)
+    p.add_argument('--min-epochs', type=int, default=1)
+    p.add_argument('--max-epochs', type=int, default=15)
+    p.add_argument('--eta', type=int, default=3)
+    p.add_argument('--patience', type=int, default=3)
+    p.add_argument('--output-dir', default='./sweeps')
+    p.set_defaults(func=sweep_cnn)
+
+    p = subparsers.add_parser('sweep-resolution', help='accuracy frente a img/s y memoria por resolución de MobileNetV2')
+    p.add_argument('--sizes', type=int, nargs='+', default=[32, 64, 96, 128, 224])
+    p.add_argument('--epochs', type=int, default=3)
+    p.add_argument('--target-accuracy', type=float, help='recomendar la resolución más rápida que la alcanza')
+    p.add_argument('--no-pretrained', action='store_true')
+    p.add_argument('--output', default='./benchmarks/resolution_sweep.json')
+    add_data_args(p)
+    p.set_defaults(func=sweep_resolution)
+
+    p = subparsers.add_parser('distill', help='destilar MobileNetV2 en la CNN y podar filtros y unidades')
+    p.add_argument('--teacher', default='./models/mobilenet_v2.pt', help='ruta del MobileNetV2 entrenado')
+    p.add_argument('--teacher-epochs', type=int, default=3, help='épocas del profesor si no existe --teacher')
+    p.add_argument('--no-pretrained', action='store_true')
+    p.add_argument('--epochs', type=int, default=5)
+    p.add_argument('--finetune-epochs', type=int, default=2, help='épocas de ajuste fino después de podar')
+    p.add_argument('--sparsities', type=float, nargs='+', default=[0.0, 0.25, 0.5, 0.75])
+    p.add_argument('--temperature', type=float, default=4.0)
+    p.add_argument('--alpha', type=float, default=0.9, help='peso de la pérdida de destilación')
+    p.add_argument('--output-dir', default='./models/distill')
+    add_data_args(p, resized=True)
+    p.set_defaults(func=distill)
+
+    p = subparsers.add_parser('profile', help='perfilado por capa con tabla de capas calientes y traza Chrome')
+    p.add_argument('model_type', choices=('cnn', 'mobilenet'))
+    p.add_argument('--model', help='ruta del modelo entrenado (por defecto, uno recién construido)')
+    p.add_argument('--steps', type=int, default=5)
+    p.add_argument('--batch-size', type=int, help='128 para cnn, 32 para mobilenet')
+    p.add_argument('--top', type=int, default=15)
+    p.add_argument('--no-allocations', action='store_true', help='no contar asignaciones (menos sobrecarga)')
+    p.add_argument('--output-dir', default='./profiles')
+    p.set_defaults(func=profile)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    timer = StartupTimer(args.command)
+    try:
+        args.func(args, timer)
+    finally:
+        timer.report()
@@ -0,0 +1,86 @@
+"""Almacén local de MNIST mapeado en memoria, compartido por la parte de Keras y la de PyTorch.
+
+Formato: un `.npy` por array (`{split}_images.npy`, `{split}_labels.npy`) más un `index.json`,
+construido a partir de los archivos IDX originales o del `mnist.npz` de Keras. Los arrays se abren
+con `np.load(..., mmap_mode='r')`, así que no se copian al arrancar y varios procesos comparten las
+mismas páginas del page cache.
+"""
+
+import os
+import gzip
+import json
+import struct
+
+import numpy as np
+
+MNIST_STORE = './data/mnist_store'
+MNIST_IDX_FILES = {
+    'train': ('train-images-idx3-ubyte', 'train-labels-idx1-ubyte'),
+    'test': ('t10k-images-idx3-ubyte', 't10k-labels-idx1-ubyte'),
+}
+
+
+# Lector de archivos IDX (el formato original de MNIST), comprimidos con gzip o no
+def read_idx(path):
+    with (gzip.open if path.endswith('.gz') else open)(path, 'rb') as f:
+        data = f.read()
+    zero, dtype_code, ndim = struct.unpack('>HBB', data[:4])
+    if zero != 0 or dtype_code != 0x08:
+        raise ValueError(f'{path} no es un archivo IDX de tipo uint8')
+    shape = struct.unpack(f'>{ndim}I', data[4:4 + 4 * ndim])
+    return np.frombuffer(data, dtype=np.uint8, offset=4 + 4 * ndim).reshape(shape)
+
+
+# Busca MNIST ya descargado: IDX de torchvision o el mnist.npz de Keras
+def find_local_mnist_source(idx_dirs=('./data/MNIST/raw',), npz_paths=('~/.keras/datasets/mnist.npz',)):
+    for idx_dir in idx_dirs:
+        if all(os.path.exists(os.path.join(idx_dir, name)) or os.path.exists(os.path.join(idx_dir, name + '.gz'))
+               for names in MNIST_IDX_FILES.values() for name in names):
+            return idx_dir
+    for npz_path in map(os.path.expanduser, npz_paths):
+        if os.path.exists(npz_path):
+            return npz_path
+    return None
+
+
+def build_mnist_store(store_path, source):
+    if source.endswith('.npz'):
+        with np.load(source) as npz:
+            arrays = {'train': (npz['x_train'], npz['y_train']), 'test': (npz['x_test'], npz['y_test'])}
+    else:
+        def idx_path(name):
+            path = os.path.join(source, name)
+            return path if os.path.exists(path) else path + '.gz'
+        arrays = {split: (read_idx(idx_path(images)), read_idx(idx_path(labels)))
+                  for split, (images, labels) in MNIST_IDX_FILES.items()}
+
+    os.makedirs(store_path, exist_ok=True)
+    index = {'format': 1, 'source': os.path.abspath(source), 'splits': {}}
+    for split, (images, labels) in arrays.items():
+        entry = {}
+        for kind, array in (('images', images), ('labels', labels)):
+            file_name = f'{split}_{kind}.npy'
+            np.save(os.path.join(store_path, file_name), np.ascontiguousarray(array, dtype=np.uint8))
+            entry[kind] = {'file': file_name, 'shape': list(array.shape), 'dtype': 'uint8'}
+        index['splits'][split] = entry
+    # El índice se escribe al final: su presencia indica que el almacén está completo
+    with open(os.path.join(store_path, 'index.json'), 'w') as f:
+        json.dump(index, f, indent=2)
+
+
+def open_mnist_split(store_path, split):
+    with open(os.path.join(store_path, 'index.json')) as f:
+        entry = json.load(f)['splits'][split]
+    return tuple(np.load(os.path.join(store_path, entry[kind]['file']), mmap_mode='r') for kind in ('images', 'labels'))
+
+
+# Abre el almacén; si no existe, lo construye desde archivos locales (o descarga el npz de Keras una única vez)
+def open_mnist_store(store_path=MNIST_STORE):
+    if not os.path.exists(os.path.join(store_path, 'index.json')):
+        source = find_local_mnist_source()
+        if source is None:
+            from tensorflow.keras.datasets import mnist
+            mnist.load_data()
+            source = find_local_mnist_source()
+        build_mnist_store(store_path, source)
+    return open_mnist_split(store_path, 'train'), open_mnist_split(store_path, 'test')
@@ -0,0 +1,184 @@
+"""Entrenamiento de MobileNetV2 en paralelo de datos con DistributedDataParallel (backend gloo, CPU).
+
+Cada proceso (rank) entrena sobre su parte de `train_dataset`, repartida por un `DistributedSampler`;
+DDP promedia los gradientes del clasificador entre ranks en cada paso. Para no sobresuscribir los
+núcleos, cada proceso de una máquina fija su afinidad a una porción propia de núcleos y usa ese mismo
+número de hilos en PyTorch.
+
+- Las métricas de cada época (pérdida, accuracy, imágenes) se suman entre ranks con `all_reduce`; la
+  evaluación usa particiones disjuntas del test y suma las matrices de confusión.
+- Solo el rank 0 escribe checkpoints y el modelo final.
+- Lanzamiento local: `python -m practica_cnn train-ddp --nproc 4` arranca los procesos en esta máquina.
+- Varias máquinas: con torchrun, que define RANK, WORLD_SIZE, LOCAL_RANK y MASTER_ADDR/MASTER_PORT:
+  `torchrun --nnodes 2 --nproc-per-node 4 --rdzv-backend c10d --rdzv-endpoint host:29500 -m practica_cnn train-ddp`
+"""
+
+import os
+import json
+import time
+import socket
+
+import torch
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import Subset
+from torch.utils.data.distributed import DistributedSampler
+
+from .mobilenet import (MODEL_PATH, INPUT_SIZE, StreamingMetrics, load_datasets, make_loader, build_mobilenet,
+                        build_optimizer, save_mobilenet)
+from .runtime import core_slices, cpu_input
+
+CHECKPOINT_PATH = './models/mobilenet_v2_ddp.ckpt'
+cpu = torch.device('cpu')
+
+
+# Porción de núcleos de este proceso dentro de su máquina: afinidad y número de hilos de PyTorch
+def pin_threads(local_rank, local_world_size):
+    num_cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    threads = max(1, num_cores // local_world_size)
+    # Con más procesos que núcleos, los que sobran comparten porción con los primeros
+    slices = core_slices(local_world_size, threads)
+    cores = slices[local_rank % len(slices)]
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(len(cores))
+    return cores
+
+
+def log(message):
+    if dist.get_rank() == 0:
+        print(message, flush=True)
+
+
+# Evaluación distribuida: cada rank toma test[rank::world_size] (sin el relleno de DistributedSampler,
+# que duplicaría ejemplos) y se suman las matrices de confusión
+def evaluate_distributed(model, test_dataset, batch_size=256):
+    rank, world_size = dist.get_rank(), dist.get_world_size()
+    shard = Subset(test_dataset, range(rank, len(test_dataset), world_size))
+    metrics = StreamingMetrics(10, cpu)
+    model.eval()
+    with torch.no_grad():
+        for images, labels in make_loader(shard, batch_size=batch_size, shuffle=False):
+            metrics.update(model(cpu_input(images)).argmax(1), labels)
+    dist.all_reduce(metrics.confusion, op=dist.ReduceOp.SUM)
+    return metrics.compute()
+
+
+def train_ddp(num_epochs=3, batch_size=128, lr=0.001, use_store=True, resized=True, input_size=INPUT_SIZE,
+              pretrained=True, output=MODEL_PATH, checkpoint_path=CHECKPOINT_PATH, result_path=None, seed=0):
+    rank, world_size = dist.get_rank(), dist.get_world_size()
+    local_rank = int(os.environ.get('LOCAL_RANK', rank))
+    local_world_size = int(os.environ.get('LOCAL_WORLD_SIZE', world_size))
+    cores = pin_threads(local_rank, local_world_size)
+    log(f'{world_size} procesos, {len(cores)} hilos por proceso')
+
+    # El rank 0 construye los almacenes y descarga los pesos; el resto espera y los reutiliza
+    if rank != 0:
+        dist.barrier()
+    train_dataset, test_dataset = load_datasets(use_store=use_store, resized=resized, size=input_size)
+    torch.manual_seed(seed)
+    model = build_mobilenet(pretrained=pretrained, input_size=input_size).to(cpu)
+    if rank == 0:
+        dist.barrier()
+
+    # DDP difunde los parámetros del rank 0 al construirse: todos arrancan con el mismo clasificador
+    ddp_model = DistributedDataParallel(model)
+    criterion, optimizer = build_optimizer(ddp_model, lr=lr)
+    sampler = DistributedSampler(train_dataset, num_replicas=world_size, rank=rank, shuffle=True, seed=seed)
+    train_loader = make_loader(train_dataset, batch_size=batch_size, shuffle=False, sampler=sampler)
+
+    epoch_times = []
+    for epoch in range(num_epochs):
+        sampler.set_epoch(epoch)
+        ddp_model.train()
+        # Suma de pérdidas, aciertos, imágenes y pasos de este rank, acumulados sin sincronizar por paso
+        totals = torch.zeros(4, dtype=torch.float64)
+        start = time.perf_counter()
+        for images, labels in train_loader:
+            optimizer.zero_grad(set_to_none=True)
+            outputs = ddp_model(cpu_input(images))
+            loss = criterion(outputs, labels)
+            loss.backward()
+            optimizer.step()
+            totals += torch.stack([loss.detach().double(), (outputs.argmax(1) == labels).sum().double(),
+                                   torch.tensor(float(labels.size(0)), dtype=torch.float64),
+                                   torch.tensor(1.0, dtype=torch.float64)])
+        epoch_time = torch.tensor([time.perf_counter() - start])
+        dist.all_reduce(totals, op=dist.ReduceOp.SUM)
+        dist.all_reduce(epoch_time, op=dist.ReduceOp.MAX)
+        loss_sum, correct, seen, steps = totals.tolist()
+        epoch_times.append(epoch_time.item())
+        log(f'Epoch {epoch+1}, Loss: {loss_sum/steps}, Accuracy: {correct/seen:.4f}, '
+            f'{epoch_time.item():.1f}s, {seen/epoch_time.item():.1f} img/s')
+
+        if rank == 0:
+            os.makedirs(os.path.dirname(checkpoint_path) or '.', exist_ok=True)
+            torch.save({'epoch': epoch + 1, 'model': model.state_dict(), 'optimizer': optimizer.state_dict(),
+                        'input_size': input_size, 'world_size': world_size}, checkpoint_path + '.tmp')
+            os.replace(checkpoint_path + '.tmp', checkpoint_path)
+        dist.barrier()
+
+    results = evaluate_distributed(model, test_dataset)
+    log(f'Accuracy en test: {results["accuracy"]:.4f}')
+    if rank == 0:
+        save_mobilenet(model, output)
+        log(f'Modelo guardado en {output}')
+        if result_path:
+            with open(result_path, 'w') as f:
+                json.dump({'world_size': world_size, 'threads_per_process': len(cores), 'epoch_times': epoch_times,
+                           'accuracy': results['accuracy']}, f)
+    return results
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _worker(local_rank, world_size, master_port, kwargs):
+    os.environ.update(MASTER_ADDR='127.0.0.1', MASTER_PORT=str(master_port), RANK=str(local_rank),
+                      WORLD_SIZE=str(world_size), LOCAL_RANK=str(local_rank), LOCAL_WORLD_SIZE=str(world_size))
+    run(**kwargs)
+
+
+# Punto de entrada de cada proceso: inicializa el grupo gloo a partir del entorno (torchrun o launch_local)
+def run(**kwargs):
+    dist.init_process_group('gloo')
+    try:
+        return train_ddp(**kwargs)
+    finally:
+        dist.destroy_process_group()
+
+
+# Lanza num_procs procesos en esta máquina
+def launch_local(num_procs, **kwargs):
+    import torch.multiprocessing as mp
+
+    mp.start_processes(_worker, args=(num_procs, _free_port(), kwargs), nprocs=num_procs, start_method='spawn')
+
+
+# Tiempo por época con 1, 2, 4, ... procesos: aceleración y eficiencia respecto de un proceso
+# La aceleración se mide siempre contra una corrida real con un solo proceso, que se agrega si falta
+def measure_scaling(process_counts=(1, 2, 4), num_epochs=1, result_dir='./benchmarks', **kwargs):
+    os.makedirs(result_dir, exist_ok=True)
+    process_counts = sorted(set(process_counts) | {1})
+    # Los modelos de la medición no pisan el modelo entrenado
+    kwargs.setdefault('output', os.path.join(result_dir, 'ddp_scaling_model.pt'))
+    kwargs.setdefault('checkpoint_path', os.path.join(result_dir, 'ddp_scaling.ckpt'))
+    rows = []
+    for num_procs in process_counts:
+        result_path = os.path.join(result_dir, f'ddp_{num_procs}.json')
+        launch_local(num_procs, num_epochs=num_epochs, result_path=result_path, **kwargs)
+        with open(result_path) as f:
+            rows.append(json.load(f))
+    base = min(rows[0]['epoch_times'])
+    print(f'{"Procesos":>9}{"Hilos/proc":>11}{"s/época":>10}{"Aceleración":>13}{"Eficiencia":>12}')
+    for row in rows:
+        epoch_time = min(row['epoch_times'])
+        speedup = base / epoch_time
+        print(f'{row["world_size"]:>9}{row["threads_per_process"]:>11}{epoch_time:>10.1f}{speedup:>13.2f}'
+              f'{speedup / row["world_size"]:>12.1%}')
+    with open(os.path.join(result_dir, 'ddp_scaling.json'), 'w') as f:
+        json.dump(rows, f, indent=2)
+    return rows
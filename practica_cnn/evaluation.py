@@ -0,0 +1,107 @@
+"""Evaluación de la CNN de Keras a partir de una única pasada de inferencia cacheada.
+
+Todas las métricas y reportes (pérdida, accuracy, matriz de confusión, reporte por clase e índices
+mal clasificados) se derivan de las mismas probabilidades. La caché se indexa por una huella de los
+pesos del modelo y por una huella del contenido del dataset: si cambian los pesos o los datos, se
+vuelve a predecir.
+"""
+
+import weakref
+import hashlib
+import functools
+
+import numpy as np
+from sklearn.metrics import classification_report, confusion_matrix
+
+CLASS_NAMES = ['0', '1', '2', '3', '4', '5', '6', '7', '8', '9']
+
+
+# Huella de los pesos: cambia en cuanto se modifica cualquier peso del modelo
+def weights_fingerprint(model):
+    h = hashlib.sha256()
+    for w in model.get_weights():
+        h.update(np.ascontiguousarray(w).tobytes())
+    return h.hexdigest()
+
+
+# Identidad del dataset: contenido de las imágenes y de las etiquetas, más la forma y el tipo. Las imágenes
+# se recorren por bloques para no copiar de una vez un array grande (o mapeado en memoria)
+def dataset_fingerprint(images, labels, block_size=4096):
+    h = hashlib.sha256(np.ascontiguousarray(labels).tobytes())
+    h.update(f'{images.shape}-{images.dtype}'.encode())
+    for start in range(0, len(images), block_size):
+        h.update(np.ascontiguousarray(images[start:start + block_size]))
+    return h.hexdigest()
+
+
+# Resultados derivados de una sola pasada de inferencia
+class PredictionResults:
+    def __init__(self, probabilities, labels, class_names=None):
+        self.probabilities = probabilities
+        self.labels = np.asarray(labels)
+        self.class_names = class_names
+        # Todas las clases del modelo, aunque alguna no aparezca en las etiquetas ni en las predicciones
+        self.classes = np.arange(np.shape(probabilities)[1])
+
+    @functools.cached_property
+    def predicted_classes(self):
+        return np.argmax(self.probabilities, axis=1)
+
+    # Misma definición que sparse_categorical_crossentropy de Keras sobre probabilidades
+    @functools.cached_property
+    def loss(self):
+        eps = 1e-7
+        p = np.clip(self.probabilities[np.arange(len(self.labels)), self.labels], eps, 1 - eps)
+        return float(-np.mean(np.log(p)))
+
+    @functools.cached_property
+    def accuracy(self):
+        return float(np.mean(self.predicted_classes == self.labels))
+
+    @functools.cached_property
+    def confusion_matrix(self):
+        return confusion_matrix(self.labels, self.predicted_classes, labels=self.classes)
+
+    @functools.cached_property
+    def classification_report(self):
+        return classification_report(self.labels, self.predicted_classes, labels=self.classes,
+                                     target_names=self.class_names, output_dict=True, zero_division=0)
+
+    @functools.cached_property
+    def misclassified_idx(self):
+        return np.where(self.predicted_classes != self.labels)[0]
+
+
+# Caché de predicciones por (pesos, dataset); las entradas de pesos anteriores se descartan
+class PredictionCache:
+    def __init__(self, model, batch_size=128):
+        self.model = model
+        self.batch_size = batch_size
+        self._entries = {}
+        self._fingerprints = {}
+
+    # La huella del dataset se calcula una vez por par de arrays: los siguientes get con los mismos objetos no
+    # vuelven a recorrer las imágenes. Se guardan referencias débiles para no reutilizar un id de un array ya
+    # liberado; si se modifica un array en el lugar hay que pasar una copia para que se vuelva a predecir
+    def _dataset_fingerprint(self, images, labels):
+        key = (id(images), id(labels))
+        cached = self._fingerprints.get(key)
+        if cached and cached[0]() is images and cached[1]() is labels:
+            return cached[2]
+        fingerprint = dataset_fingerprint(images, labels)
+        try:
+            self._fingerprints[key] = (weakref.ref(images), weakref.ref(labels), fingerprint)
+        except TypeError:
+            pass
+        return fingerprint
+
+    def get(self, images, labels):
+        from .keras_cnn import make_tf_dataset
+
+        weights_key = weights_fingerprint(self.model)
+        key = (weights_key, self._dataset_fingerprint(images, labels))
+        if key not in self._entries:
+            self._entries = {k: v for k, v in self._entries.items() if k[0] == weights_key}
+            probabilities = self.model.predict(make_tf_dataset(images, labels, batch_size=self.batch_size), verbose=0)
+            self._entries[key] = PredictionResults(probabilities, labels)
+        return self._entries[key]
@@ -0,0 +1,190 @@
+"""Exportación optimizada para inferencia en CPU, con validación de accuracy y medición de latencia.
+
+- `model_cnn` a TFLite: float32, cuantización de rango dinámico y cuantización entera completa
+  calibrada con un subconjunto de `x_train`.
+- MobileNetV2 a TorchScript en float32 y con cuantización estática int8 en modo grafo (FX), que fusiona
+  Conv-BN y conserva ReLU6, y a ONNX en float32 si está instalado `onnxruntime`.
+
+Las diferencias de accuracy se miden contra el modelo float sin exportar (Keras o PyTorch eager).
+
+TensorFlow y PyTorch se importan dentro de las funciones que los usan.
+"""
+
+import os
+import time
+
+import numpy as np
+
+from .runtime import cpu_input
+
+EXPORT_DIR = './export'
+
+
+# Latencia para una imagen (p50/p99) y throughput en lotes de una función de predicción
+def benchmark_predict(predict, single, batch, repeats=50, batch_repeats=10, warmup=5):
+    for _ in range(warmup):
+        predict(single)
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        predict(single)
+        latencies.append((time.perf_counter() - start) * 1000)
+    predict(batch)
+    start = time.perf_counter()
+    for _ in range(batch_repeats):
+        predict(batch)
+    elapsed = time.perf_counter() - start
+    return {
+        'latency_p50_ms': float(np.percentile(latencies, 50)),
+        'latency_p99_ms': float(np.percentile(latencies, 99)),
+        'throughput_img_s': batch_repeats * len(batch) / elapsed,
+    }
+
+
+def print_export_report(reports):
+    print(f'{"Artefacto":<32}{"MB":>8}{"Accuracy":>10}{"Δ vs float":>12}{"p50 ms":>9}{"p99 ms":>9}{"img/s":>10}')
+    for r in reports:
+        print(f'{r["artifact"]:<32}{r["size_mb"]:>8.2f}{r["accuracy"]:>10.4f}{r["accuracy_delta"]:>+12.4f}'
+              f'{r["latency_p50_ms"]:>9.2f}{r["latency_p99_ms"]:>9.2f}{r["throughput_img_s"]:>10.1f}')
+
+
+# Conversión a TFLite: quantization=None (float32), 'dynamic' (pesos int8) o 'int8' (enteros completos)
+def export_tflite(keras_model, path, quantization=None, calibration_images=None):
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(keras_model)
+    if quantization in ('dynamic', 'int8'):
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == 'int8':
+        def representative_dataset():
+            for i in range(len(calibration_images)):
+                yield [calibration_images[i:i + 1].astype(np.float32)]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    with open(path, 'wb') as f:
+        f.write(converter.convert())
+    return path
+
+
+# Ejecuta un modelo TFLite sobre lotes, redimensionando la entrada solo cuando cambia el tamaño del lote
+class TFLiteRunner:
+    def __init__(self, path):
+        import tensorflow as tf
+
+        self.interpreter = tf.lite.Interpreter(model_path=path, num_threads=os.cpu_count())
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+        self.batch_size = None
+
+    def predict(self, images):
+        if len(images) != self.batch_size:
+            self.interpreter.resize_tensor_input(self.input['index'], (len(images),) + images.shape[1:])
+            self.interpreter.allocate_tensors()
+            self.batch_size = len(images)
+        self.interpreter.set_tensor(self.input['index'], images.astype(self.input['dtype']))
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.output['index'])
+
+    def predict_all(self, images, batch_size=256):
+        return np.concatenate([self.predict(images[i:i + batch_size]) for i in range(0, len(images), batch_size)])
+
+
+def export_keras_models(model_cnn, x_train, x_test, y_test, float_accuracy, export_dir=EXPORT_DIR,
+                        calibration_size=500):
+    os.makedirs(export_dir, exist_ok=True)
+    reports = [dict(artifact='model_cnn (Keras float32)', size_mb=sum(w.nbytes for w in model_cnn.get_weights()) / 2**20,
+                    accuracy=float_accuracy, accuracy_delta=0.0,
+                    **benchmark_predict(lambda x: model_cnn(x, training=False).numpy(), x_test[:1], x_test[:128]))]
+    for quantization in (None, 'dynamic', 'int8'):
+        path = export_tflite(model_cnn, os.path.join(export_dir, f'model_cnn_{quantization or "float32"}.tflite'),
+                             quantization, calibration_images=x_train[:calibration_size])
+        runner = TFLiteRunner(path)
+        accuracy = float(np.mean(np.argmax(runner.predict_all(x_test), axis=1) == y_test))
+        reports.append(dict(artifact=os.path.basename(path), size_mb=os.path.getsize(path) / 2**20,
+                            accuracy=accuracy, accuracy_delta=accuracy - float_accuracy,
+                            **benchmark_predict(runner.predict, x_test[:1], x_test[:128])))
+    return reports
+
+
+# Cuantización estática int8 en modo grafo (FX) del mismo MobileNetV2 que se entrenó: se traza el módulo,
+# se fusiona Conv-BN, se calibra y se convierte. A diferencia de la variante cuantizable de torchvision,
+# que reemplaza ReLU6 por ReLU, la red cuantizada conserva las activaciones ReLU6 del modelo float.
+def quantize_mobilenet(float_model, calibration_loader, num_calibration_batches=10):
+    import copy
+    import torch
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    example = cpu_input(next(iter(calibration_loader))[0])
+    qconfig_mapping = get_default_qconfig_mapping(torch.backends.quantized.engine)
+    prepared = prepare_fx(copy.deepcopy(float_model).eval(), qconfig_mapping, (example[:1],))
+    with torch.no_grad():
+        for step, (images, _) in enumerate(calibration_loader):
+            if step >= num_calibration_batches:
+                break
+            prepared(cpu_input(images))
+    return convert_fx(prepared)
+
+
+def cpu_accuracy(net, loader):
+    import torch
+    from .mobilenet import StreamingMetrics
+
+    metrics = StreamingMetrics(10, torch.device('cpu'))
+    with torch.no_grad():
+        for images, labels in loader:
+            metrics.update(net(cpu_input(images)).argmax(1), labels)
+    return metrics.compute()['accuracy']
+
+
+def export_torch_models(model, train_loader, test_loader, export_dir=EXPORT_DIR):
+    import torch
+    from torchvision.models import mobilenet_v2
+    from .mobilenet import StreamingMetrics, adapt_strides
+
+    os.makedirs(export_dir, exist_ok=True)
+    # La resolución de entrada sale de los datos: a baja resolución el backbone lleva strides adaptados
+    example = cpu_input(next(iter(test_loader))[0])
+    input_size = example.shape[-1]
+    float_model = adapt_strides(mobilenet_v2(weights=None, num_classes=10), input_size)
+    float_model.load_state_dict({k: v.cpu() for k, v in model.state_dict().items()})
+    float_model.eval()
+    qmodel = quantize_mobilenet(float_model, train_loader)
+    artifacts = {'mobilenet_v2_float32.pt': torch.jit.trace(float_model, example[:1]),
+                 'mobilenet_v2_int8.pt': torch.jit.trace(qmodel, example[:1])}
+
+    # La referencia es el modelo entrenado en eager y en float32, no uno de los artefactos exportados
+    float_accuracy = cpu_accuracy(float_model, test_loader)
+    with torch.no_grad():
+        timings = benchmark_predict(float_model, example[:1], example)
+    reports = [dict(artifact='mobilenet_v2 (PyTorch float32)',
+                    size_mb=sum(v.numel() * v.element_size() for v in float_model.state_dict().values()) / 2**20,
+                    accuracy=float_accuracy, accuracy_delta=0.0, **timings)]
+    for name, scripted in artifacts.items():
+        path = os.path.join(export_dir, name)
+        scripted.save(path)
+        scripted = torch.jit.load(path)
+        accuracy = cpu_accuracy(scripted, test_loader)
+        with torch.no_grad():
+            timings = benchmark_predict(scripted, example[:1], example)
+        reports.append(dict(artifact=name, size_mb=os.path.getsize(path) / 2**20, accuracy=accuracy,
+                            accuracy_delta=accuracy - float_accuracy, **timings))
+
+    # ONNX (solo float32) si están disponibles onnx y onnxruntime
+    try:
+        import onnxruntime
+    except ImportError:
+        print('onnxruntime no está instalado: se omite la exportación a ONNX')
+        return reports
+    path = os.path.join(export_dir, 'mobilenet_v2_float32.onnx')
+    torch.onnx.export(float_model, example[:1], path, input_names=['images'], output_names=['logits'],
+                      dynamic_axes={'images': {0: 'batch'}, 'logits': {0: 'batch'}})
+    session = onnxruntime.InferenceSession(path, providers=['CPUExecutionProvider'])
+    run_onnx = lambda x: session.run(None, {'images': x.numpy()})[0]
+    metrics = StreamingMetrics(10, torch.device('cpu'))
+    for images, labels in test_loader:
+        metrics.update(torch.from_numpy(run_onnx(cpu_input(images))).argmax(1), labels)
+    accuracy = metrics.compute()['accuracy']
+    reports.append(dict(artifact=os.path.basename(path), size_mb=os.path.getsize(path) / 2**20, accuracy=accuracy,
+                        accuracy_delta=accuracy - float_accuracy, **benchmark_predict(run_onnx, example[:1], example)))
+    return reports
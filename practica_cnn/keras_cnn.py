@@ -0,0 +1,114 @@
+"""CNN de Keras desde cero: carga de datos, modelo, pipeline tf.data y entrenamiento."""
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.datasets import mnist
+from tensorflow.keras.models import Sequential
+from tensorflow.keras.layers import Conv2D, MaxPooling2D, Flatten, Dense, Dropout, Rescaling
+from sklearn.model_selection import train_test_split
+
+from .data import MNIST_STORE, open_mnist_store
+
+MODEL_PATH = './models/model_cnn.keras'
+
+
+# Con uint8_input los datos se quedan en uint8 (4 veces menos memoria que float32) y el escalado
+# se hace dentro del modelo
+def load_data(uint8_input=True, use_store=True, store_path=MNIST_STORE):
+    if use_store:
+        (x_train, y_train), (x_test, y_test) = open_mnist_store(store_path)
+    else:
+        (x_train, y_train), (x_test, y_test) = mnist.load_data()
+
+    x_train = x_train.reshape((x_train.shape[0], 28, 28, 1))
+    x_test = x_test.reshape((x_test.shape[0], 28, 28, 1))
+    if not uint8_input:
+        x_train = x_train.astype('float32') / 255
+        x_test = x_test.astype('float32') / 255
+    return (x_train, y_train), (x_test, y_test)
+
+
+# Definición del modelo CNN (con datos uint8, la primera capa escala a [0, 1]). Los valores por defecto
+# son los de la práctica; el barrido de hiperparámetros (practica_cnn.sweep) los varía.
+def build_model_cnn(uint8_input=True, filters=(32, 64), dense_units=128, dropout=0.5, learning_rate=None):
+    model_cnn = Sequential(([Rescaling(1. / 255, input_shape=(28, 28, 1))] if uint8_input else []) + [
+        Conv2D(filters[0], kernel_size=(3, 3), activation='relu', input_shape=(28, 28, 1)),
+        MaxPooling2D(pool_size=(2, 2)),
+        Conv2D(filters[1], (3, 3), activation='relu'),
+        MaxPooling2D(pool_size=(2, 2)),
+        Flatten(),
+        Dense(dense_units, activation='relu'),
+        Dropout(dropout),
+        Dense(10, activation='softmax')
+    ])
+    optimizer = 'adam' if learning_rate is None else tf.keras.optimizers.Adam(learning_rate)
+    model_cnn.compile(optimizer=optimizer, loss='sparse_categorical_crossentropy', metrics=['accuracy'])
+    return model_cnn
+
+
+# Pipeline tf.data: lotes de índices que se resuelven contra el array original (sin copias del dataset).
+# Con `augment` (practica_cnn.augment.BatchAugment) cada lote se aumenta entero, con una semilla por lote
+# que sale de un generador sembrado del propio pipeline (distinta en cada época, reproducible).
+def make_tf_dataset(images, labels, indices=None, batch_size=128, shuffle=False, seed=42, augment=None):
+    if indices is None:
+        indices = np.arange(len(images))
+
+    def fetch(idx, batch_seed=None):
+        idx = np.sort(idx)  # lectura secuencial; también sirve para arrays mapeados en memoria
+        x = images[idx]
+        if augment is not None:
+            x = augment(x, seed=batch_seed)
+        return x, labels[idx]
+
+    def load_batch(idx, *batch_seed):
+        x, y = tf.numpy_function(fetch, [idx, *batch_seed], (tf.as_dtype(images.dtype), tf.as_dtype(labels.dtype)))
+        x.set_shape((None,) + images.shape[1:])
+        y.set_shape((None,) + labels.shape[1:])
+        return x, y
+
+    dataset = tf.data.Dataset.from_tensor_slices(indices)
+    if shuffle:
+        dataset = dataset.shuffle(len(indices), seed=seed, reshuffle_each_iteration=True)
+    dataset = dataset.batch(batch_size)
+    if augment is not None:
+        seeds = tf.data.Dataset.random(seed=seed, rerandomize_each_iteration=True)
+        dataset = tf.data.Dataset.zip((dataset, seeds))
+    dataset = dataset.map(load_batch, num_parallel_calls=tf.data.AUTOTUNE)
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+
+# División del dataset en train y validación por índices
+def split_indices(num_samples, test_size=0.2, random_state=42):
+    return train_test_split(np.arange(num_samples), test_size=test_size, random_state=random_state)
+
+
+# La aumentación (si se pasa) se aplica solo a los lotes de entrenamiento, no a los de validación
+def train_model_cnn(model_cnn, x_train, y_train, epochs=15, batch_size=128, augment=None, **fit_kwargs):
+    train_idx, val_idx = split_indices(len(x_train))
+    train_ds = make_tf_dataset(x_train, y_train, train_idx, batch_size=batch_size, shuffle=True, augment=augment)
+    val_ds = make_tf_dataset(x_train, y_train, val_idx, batch_size=batch_size)
+    return model_cnn.fit(train_ds, epochs=epochs, validation_data=val_ds, **fit_kwargs)
+
+
+def load_model_cnn(path=MODEL_PATH):
+    return tf.keras.models.load_model(path)
+
+
+# Forward para servir: recibe lotes de píxeles uint8 (0-255) y devuelve las probabilidades por clase.
+# La firma fija evita retrazar el grafo con cada tamaño de lote.
+def make_predict_batch(model_cnn, uint8_input=True):
+    serving_fn = tf.function(lambda x: model_cnn(x, training=False),
+                             input_signature=[tf.TensorSpec((None, 28, 28, 1), tf.float32)])
+
+    def predict_batch(images):
+        x = images.reshape((-1, 28, 28, 1)).astype(np.float32)
+        if not uint8_input:
+            x /= 255
+        return serving_fn(x).numpy()
+
+    return predict_batch
+
+
+# Un modelo guardado con la capa Rescaling espera píxeles uint8 sin escalar
+def expects_uint8(model_cnn):
+    return isinstance(model_cnn.layers[0], Rescaling)
@@ -0,0 +1,391 @@
+"""MobileNetV2 preentrenada adaptada a MNIST: datasets, entrenamiento y evaluación en PyTorch."""
+
+import os
+import time
+import hashlib
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.optim as optim
+import torchvision.transforms as transforms
+from torch.utils.data import DataLoader, default_collate
+from torchvision.models import mobilenet_v2
+from PIL import Image
+
+from .augment import AugmentCollate
+from .data import MNIST_STORE, open_mnist_split
+
+CACHE_DIR = './cache'
+MODEL_PATH = './models/mobilenet_v2.pt'
+INPUT_SIZE = 224
+IMAGENET_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_STD = [0.229, 0.224, 0.225]
+
+# Mover el modelo a GPU si está disponible
+device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+# Transformaciones para expandir y normalizar las imágenes MNIST
+def make_transform(size=INPUT_SIZE):
+    return transforms.Compose([
+        transforms.Resize(size),  # Redimensionar la imagen a la resolución de entrada del modelo
+        transforms.Grayscale(3),  # Convertir la imagen a 3 canales
+        transforms.ToTensor(),
+        transforms.Normalize(mean=IMAGENET_MEAN, std=IMAGENET_STD)
+    ])
+
+
+transform = make_transform()
+
+
+# Dataset sobre el almacén local mapeado en memoria, con la misma interfaz que datasets.MNIST
+class MemmapMNIST(torch.utils.data.Dataset):
+    def __init__(self, store_path, split, transform=None):
+        self.store_path = store_path
+        self.split = split
+        self.transform = transform
+        self.data, self.targets = open_mnist_split(store_path, split)
+
+    # Al enviarse a un worker con spawn se reabre el mapeo en lugar de copiar los arrays
+    def __getstate__(self):
+        return {k: v for k, v in self.__dict__.items() if k not in ('data', 'targets')}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.data, self.targets = open_mnist_split(self.store_path, self.split)
+
+    def __len__(self):
+        return len(self.targets)
+
+    def __getitem__(self, idx):
+        image = Image.fromarray(np.asarray(self.data[idx]), mode='L')
+        if self.transform is not None:
+            image = self.transform(image)
+        return image, int(self.targets[idx])
+
+
+# Redimensiona el dataset por lotes y lo guarda como uint8 (N, size, size) mapeado en memoria
+def build_resized_store(dataset, split, size=224, batch_size=1024):
+    store_path = os.path.join(CACHE_DIR, f'mnist-{size}')
+    images_file = os.path.join(store_path, f'{split}_images.npy')
+    labels_file = os.path.join(store_path, f'{split}_labels.npy')
+
+    if not (os.path.exists(images_file) and os.path.exists(labels_file)):
+        os.makedirs(store_path, exist_ok=True)
+        images = np.lib.format.open_memmap(images_file + '.tmp', mode='w+', dtype=np.uint8,
+                                           shape=(len(dataset.data), size, size))
+        for start in range(0, len(dataset.data), batch_size):
+            batch = torch.from_numpy(np.array(dataset.data[start:start + batch_size])).unsqueeze(1).float()
+            batch = nn.functional.interpolate(batch, size=(size, size), mode='bilinear', align_corners=False)
+            images[start:start + len(batch)] = batch.squeeze(1).round_().clamp_(0, 255).to(torch.uint8).numpy()
+        images.flush()
+        del images
+        np.save(labels_file + '.tmp.npy', np.asarray(dataset.targets).astype(np.int64))
+        os.replace(images_file + '.tmp', images_file)
+        os.replace(labels_file + '.tmp.npy', labels_file)
+
+    return np.load(images_file, mmap_mode='r'), np.load(labels_file, mmap_mode='r')
+
+
+# Dataset sobre el almacén: devuelve lotes uint8 de un canal, sin trabajo por imagen
+class ResizedMNIST(torch.utils.data.Dataset):
+    def __init__(self, images, labels):
+        self.images = images
+        self.labels = labels
+        # Descripción del preprocesamiento (forma parte de la clave de otras cachés)
+        self.transform = f'ResizedMNIST(size={images.shape[-1]}, mean={IMAGENET_MEAN}, std={IMAGENET_STD})'
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, idx):
+        return torch.from_numpy(np.array(self.images[idx])), int(self.labels[idx])
+
+    # El DataLoader pide el lote completo de una vez: una sola lectura del memmap por lote
+    def __getitems__(self, indices):
+        indices = np.asarray(indices)
+        return torch.from_numpy(self.images[indices]), torch.from_numpy(self.labels[indices])
+
+
+# Los lotes ya llegan armados desde __getitems__
+def collate_resized(batch):
+    return batch
+
+
+# Con un sampler (por ejemplo DistributedSampler) el orden lo decide el sampler y shuffle debe ser False;
+# un Subset del almacén también trae los lotes armados desde __getitems__. Con `augment`
+# (practica_cnn.augment.BatchAugment) cada lote se aumenta entero al armarlo.
+def make_loader(dataset, batch_size, shuffle, sampler=None, augment=None):
+    if isinstance(getattr(dataset, 'dataset', dataset), ResizedMNIST):
+        collate_fn = collate_resized
+    else:
+        collate_fn = default_collate
+    if augment is not None:
+        collate_fn = AugmentCollate(augment, collate_fn)
+    return DataLoader(dataset, batch_size=batch_size, shuffle=shuffle, sampler=sampler, collate_fn=collate_fn)
+
+
+def load_datasets(use_store=True, resized=True, store_path=MNIST_STORE, size=INPUT_SIZE):
+    size_transform = make_transform(size)
+    if use_store:
+        train_dataset = MemmapMNIST(store_path, 'train', transform=size_transform)
+        test_dataset = MemmapMNIST(store_path, 'test', transform=size_transform)
+    else:
+        from torchvision import datasets
+        train_dataset = datasets.MNIST(root='./data', train=True, download=True, transform=size_transform)
+        test_dataset = datasets.MNIST(root='./data', train=False, download=True, transform=size_transform)
+    if resized:
+        train_dataset = ResizedMNIST(*build_resized_store(train_dataset, 'train', size=size))
+        test_dataset = ResizedMNIST(*build_resized_store(test_dataset, 'test', size=size))
+    return train_dataset, test_dataset
+
+
+# Normalización y replicación a 3 canales sobre el lote completo: (B, H, W) uint8 -> (B, 3, H, W) float
+def normalize_batch(images):
+    scale = 1.0 / (255.0 * torch.tensor(IMAGENET_STD, device=images.device))
+    shift = -torch.tensor(IMAGENET_MEAN, device=images.device) / torch.tensor(IMAGENET_STD, device=images.device)
+    x = images.unsqueeze(1).float()
+    return torch.addcmul(shift.view(1, 3, 1, 1), x, scale.view(1, 3, 1, 1))
+
+
+# Mueve el lote al dispositivo y, si viene del almacén, lo normaliza allí
+def to_model_input(images):
+    images = images.to(device, non_blocking=True)
+    if images.dtype == torch.uint8:
+        images = normalize_batch(images)
+    return images
+
+
+# El backbone reduce la imagen 32 veces: a 224 el mapa final es de 7x7, pero a 32 quedaría en 1x1.
+# Se quitan las primeras reducciones (stride 2 -> 1) hasta que el mapa final tenga al menos
+# min_feature_map de lado. Los pesos preentrenados siguen siendo válidos; solo cambia el paso.
+def adapt_strides(model, input_size, min_feature_map=4):
+    strided = [m for m in model.features.modules() if isinstance(m, nn.Conv2d) and m.stride == (2, 2)]
+    total_stride = 2 ** len(strided)
+    for conv in strided:
+        if input_size // total_stride >= min_feature_map:
+            break
+        conv.stride = (1, 1)
+        total_stride //= 2
+    return model
+
+
+# MobileNetV2 con todas las capas congeladas y una nueva última capa para las 10 clases de MNIST.
+# El clasificador va después del pooling global, así que sirve para cualquier resolución de entrada.
+def build_mobilenet(pretrained=True, input_size=INPUT_SIZE):
+    model = mobilenet_v2(pretrained=pretrained)
+    adapt_strides(model, input_size)
+    for param in model.parameters():
+        param.requires_grad = False
+    model.classifier[1] = nn.Linear(model.classifier[1].in_features, 10)
+    model.classifier[1].requires_grad = True  # Asegurarse de que la última capa es entrenable
+    return model.to(device)
+
+
+def build_optimizer(model, lr=0.001):
+    return nn.CrossEntropyLoss(), optim.Adam(model.parameters(), lr=lr)
+
+
+def save_mobilenet(model, path=MODEL_PATH):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    torch.save(model.state_dict(), path)
+
+
+def load_mobilenet(path=MODEL_PATH, input_size=INPUT_SIZE):
+    model = build_mobilenet(pretrained=False, input_size=input_size)
+    model.load_state_dict(torch.load(path, map_location=device))
+    return model
+
+
+# Forward para evaluar por lotes de píxeles uint8 de 28x28: redimensiona en el lote igual que
+# build_resized_store, normaliza y devuelve las probabilidades por clase como array de NumPy
+def make_predict_batch(model, input_size=INPUT_SIZE):
+    model.eval()
+
+    def predict_batch(images):
+        x = torch.from_numpy(np.ascontiguousarray(images).reshape(-1, 1, 28, 28)).float().to(device)
+        x = nn.functional.interpolate(x, size=(input_size, input_size), mode='bilinear', align_corners=False)
+        x = x.squeeze(1).round_().clamp_(0, 255).to(torch.uint8)
+        with torch.no_grad():
+            return torch.softmax(model(normalize_batch(x)), dim=1).cpu().numpy()
+
+    return predict_batch
+
+
+def train_model(model, train_loader, criterion, optimizer, num_epochs):
+    model.train()
+    for epoch in range(num_epochs):
+        running_loss = 0.0
+        start = time.perf_counter()
+        for images, labels in train_loader:
+            images, labels = to_model_input(images), labels.to(device)
+            optimizer.zero_grad()
+            outputs = model(images)
+            loss = criterion(outputs, labels)
+            loss.backward()
+            optimizer.step()
+            running_loss += loss.item()
+        images_per_sec = len(train_loader.dataset) / (time.perf_counter() - start)
+        print(f'Epoch {epoch+1}, Loss: {running_loss/len(train_loader)}, {images_per_sec:.1f} img/s')
+
+
+# Modo de alto rendimiento: pérdida y aciertos acumulados en el dispositivo, autocast bfloat16,
+# channels_last, torch.compile opcional y gradientes a None
+def train_model_fast(model, train_loader, criterion, optimizer, num_epochs, use_bf16=True, channels_last=True,
+                     compile_model=False, log_interval=100):
+    net = model
+    if channels_last:
+        net = net.to(memory_format=torch.channels_last)
+    if compile_model:
+        net = torch.compile(net)
+    net.train()
+    for epoch in range(num_epochs):
+        running_loss = torch.zeros((), device=device)
+        correct = torch.zeros((), dtype=torch.int64, device=device)
+        seen = step = 0
+        start = time.perf_counter()
+        for step, (images, labels) in enumerate(train_loader, 1):
+            images, labels = to_model_input(images), labels.to(device, non_blocking=True)
+            if channels_last:
+                images = images.contiguous(memory_format=torch.channels_last)
+            optimizer.zero_grad(set_to_none=True)
+            with torch.autocast(device_type=device.type, dtype=torch.bfloat16, enabled=use_bf16):
+                outputs = net(images)
+                loss = criterion(outputs, labels)
+            loss.backward()
+            optimizer.step()
+            # Acumulación en el dispositivo: sin sincronizar con el host en cada paso
+            running_loss += loss.detach()
+            correct += (outputs.argmax(1) == labels).sum()
+            seen += labels.size(0)
+            if log_interval and step % log_interval == 0:
+                print(f'  Step {step}, Loss: {running_loss.item()/step:.4f}, Accuracy: {correct.item()/seen:.4f}')
+        epoch_loss, epoch_acc = running_loss.item() / max(step, 1), correct.item() / max(seen, 1)
+        images_per_sec = seen / (time.perf_counter() - start)
+        print(f'Epoch {epoch+1}, Loss: {epoch_loss}, Accuracy: {epoch_acc:.4f}, {images_per_sec:.1f} img/s')
+
+
+# Clave de la caché: hash de la arquitectura (incluye los strides), los pesos del backbone y la transformación
+def cache_key(backbone, transform):
+    h = hashlib.sha256()
+    h.update(repr(backbone).encode())
+    for nombre, tensor in backbone.state_dict().items():
+        h.update(nombre.encode())
+        h.update(tensor.detach().cpu().numpy().tobytes())
+    h.update(repr(transform).encode())
+    return h.hexdigest()[:16]
+
+
+# Embeddings de 1280 dimensiones: backbone + pooling global, igual que en MobileNetV2.forward
+def extract_embeddings(model, images):
+    x = model.features(images)
+    x = nn.functional.adaptive_avg_pool2d(x, (1, 1))
+    return torch.flatten(x, 1)
+
+
+# Calcula (o reutiliza) los embeddings de un dataset y los devuelve mapeados en memoria
+def build_embedding_cache(model, dataset, split, batch_size=256):
+    cache_path = os.path.join(CACHE_DIR, f'mobilenet_v2-{cache_key(model.features, dataset.transform)}')
+    features_file = os.path.join(cache_path, f'{split}_features.npy')
+    labels_file = os.path.join(cache_path, f'{split}_labels.npy')
+
+    if not (os.path.exists(features_file) and os.path.exists(labels_file)):
+        os.makedirs(cache_path, exist_ok=True)
+        num_features = model.classifier[1].in_features
+        # Se escribe en archivos temporales y se renombran al final para no dejar cachés a medias
+        features = np.lib.format.open_memmap(features_file + '.tmp', mode='w+', dtype=np.float32,
+                                             shape=(len(dataset), num_features))
+        labels = np.lib.format.open_memmap(labels_file + '.tmp', mode='w+', dtype=np.int64,
+                                           shape=(len(dataset),))
+        loader = make_loader(dataset, batch_size=batch_size, shuffle=False)
+        model.eval()
+        start = 0
+        with torch.no_grad():
+            for images, batch_labels in loader:
+                embeddings = extract_embeddings(model, to_model_input(images))
+                end = start + embeddings.size(0)
+                features[start:end] = embeddings.cpu().numpy()
+                labels[start:end] = batch_labels.numpy()
+                start = end
+        features.flush()
+        labels.flush()
+        del features, labels
+        os.replace(features_file + '.tmp', features_file)
+        os.replace(labels_file + '.tmp', labels_file)
+
+    return np.load(features_file, mmap_mode='r'), np.load(labels_file, mmap_mode='r')
+
+
+# Itera la caché en lotes; los índices de cada lote se ordenan para leer el memmap de forma secuencial
+def iterate_embedding_batches(features, labels, batch_size=128, shuffle=False, indices=None):
+    indices = np.arange(len(labels)) if indices is None else np.asarray(indices)
+    order = np.random.permutation(indices) if shuffle else indices
+    for start in range(0, len(order), batch_size):
+        idx = np.sort(order[start:start + batch_size])
+        yield torch.from_numpy(features[idx]).to(device), torch.from_numpy(labels[idx]).to(device)
+
+
+# Lotes de embeddings que se pueden recorrer una vez por época (con len, como un DataLoader), sobre un
+# subconjunto de índices de la caché
+class EmbeddingBatches:
+    def __init__(self, features, labels, batch_size=128, shuffle=False, indices=None):
+        self.features = features
+        self.labels = labels
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.indices = np.arange(len(labels)) if indices is None else np.asarray(indices)
+
+    def __len__(self):
+        return -(-len(self.indices) // self.batch_size)
+
+    def __iter__(self):
+        return iterate_embedding_batches(self.features, self.labels, self.batch_size, self.shuffle, self.indices)
+
+
+# Entrenamiento del clasificador (model.classifier) a partir de los embeddings cacheados
+def train_head_from_cache(model, criterion, optimizer, num_epochs, features, labels, batch_size=128):
+    model.classifier.train()
+    num_batches = -(-len(labels) // batch_size)
+    for epoch in range(num_epochs):
+        running_loss = 0.0
+        for embeddings, batch_labels in iterate_embedding_batches(features, labels, batch_size, shuffle=True):
+            optimizer.zero_grad()
+            outputs = model.classifier(embeddings)
+            loss = criterion(outputs, batch_labels)
+            loss.backward()
+            optimizer.step()
+            running_loss += loss.item()
+        print(f'Epoch {epoch+1}, Loss: {running_loss/num_batches}')
+
+
+# Métricas acumuladas en el dispositivo: una matriz de confusión que se actualiza por lote
+# sin listas de Python ni sincronizaciones con el host hasta el final
+class StreamingMetrics:
+    def __init__(self, num_classes, device):
+        self.num_classes = num_classes
+        self.confusion = torch.zeros(num_classes * num_classes, dtype=torch.int64, device=device)
+
+    def update(self, predicted, labels):
+        # Equivalente a bincount(labels * C + predicted), pero sin leer el máximo en el host
+        idx = labels.to(torch.int64) * self.num_classes + predicted
+        self.confusion.scatter_add_(0, idx, torch.ones_like(idx))
+
+    def compute(self):
+        conf_mat = self.confusion.view(self.num_classes, self.num_classes).cpu()
+        correct = conf_mat.diagonal().double()
+        return {
+            'accuracy': (correct.sum() / conf_mat.sum().clamp(min=1)).item(),
+            'precision': (correct / conf_mat.sum(0).clamp(min=1)).numpy(),
+            'recall': (correct / conf_mat.sum(1).clamp(min=1)).numpy(),
+            'confusion_matrix': conf_mat.numpy(),
+        }
+
+
+# Una sola pasada de evaluación sobre lotes (imágenes o embeddings) con la función de forward indicada
+def evaluate_streaming(batches, forward, num_classes=10):
+    metrics = StreamingMetrics(num_classes, device)
+    with torch.no_grad():
+        for inputs, labels in batches:
+            outputs = forward(to_model_input(inputs))
+            metrics.update(outputs.argmax(1), labels.to(device, non_blocking=True))
+    return metrics.compute()
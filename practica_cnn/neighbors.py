@@ -0,0 +1,257 @@
+"""Búsqueda de etiquetas sospechosas y de casi-duplicados entre train y test con kNN sobre embeddings.
+
+1. Embeddings de la penúltima capa: la salida de la `Dense(128)` de `model_cnn` o las 1280 features
+   de MobileNetV2 después del pooling global (de la caché de embeddings). Se normalizan a norma 1 y,
+   opcionalmente, se reducen con PCA. Así el producto interno es la similitud coseno.
+2. kNN sobre las 70k imágenes de train + test, de dos formas:
+   - exacta, por bloques: cada bloque de consultas se multiplica contra toda la base (una matmul) y
+     se queda con los k mejores con `argpartition`;
+   - aproximada, con un índice IVF: k-means sobre la base, cada vector va a la lista de su centroide, y
+     cada consulta revisa solo las `nprobe` listas más cercanas. El bucle en Python es por lista,
+     nunca por par de imágenes.
+3. Análisis:
+   - etiqueta sospechosa: la mayoría ponderada de los vecinos coincide en otra clase, con un acuerdo
+     de al menos `min_agreement`;
+   - casi-duplicado: un vecino del otro split (train ↔ test) con similitud de al menos
+     `duplicate_threshold`. También se reporta la similitud coseno de los píxeles del par.
+"""
+
+import os
+import json
+import time
+
+import numpy as np
+
+NEIGHBORS_DIR = './reports/neighbors'
+
+
+def normalize_rows(x):
+    x = np.asarray(x, dtype=np.float32)
+    return x / np.maximum(np.linalg.norm(x, axis=1, keepdims=True), 1e-12)
+
+
+# Embeddings de la Dense(128) de model_cnn (después de la ReLU, antes del Dropout)
+def cnn_embeddings(model_cnn, images, batch_size=1024):
+    import tensorflow as tf
+    from tensorflow.keras.layers import Dense
+
+    dense = next(layer for layer in model_cnn.layers if isinstance(layer, Dense))
+    extractor = tf.keras.Model(model_cnn.inputs, dense.output)
+    return extractor.predict(images, batch_size=batch_size, verbose=0)
+
+
+# Embeddings de MobileNetV2 (pooling global) para train y test, desde la caché de embeddings
+def mobilenet_embeddings(model, train_dataset, test_dataset):
+    from .mobilenet import build_embedding_cache
+
+    train_features, _ = build_embedding_cache(model, train_dataset, 'train')
+    test_features, _ = build_embedding_cache(model, test_dataset, 'test')
+    return np.concatenate([train_features, test_features])
+
+
+# Reducción a `dim` componentes con PCA, ajustado sobre una muestra
+def pca_reduce(x, dim, sample_size=20000, seed=0):
+    rng = np.random.default_rng(seed)
+    sample = x[rng.choice(len(x), min(sample_size, len(x)), replace=False)]
+    mean = sample.mean(axis=0)
+    _, _, vt = np.linalg.svd(sample - mean, full_matrices=False)
+    return (x - mean) @ vt[:dim].T
+
+
+# Combina los k mejores actuales de cada consulta con nuevos candidatos
+def _merge_topk(top_sims, top_idx, sims, idx, k):
+    sims = np.concatenate([top_sims, sims], axis=1)
+    idx = np.concatenate([top_idx, idx], axis=1)
+    best = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+    return np.take_along_axis(sims, best, axis=1), np.take_along_axis(idx, best, axis=1)
+
+
+def _sort_topk(sims, idx):
+    order = np.argsort(-sims, axis=1)
+    return np.take_along_axis(sims, order, axis=1), np.take_along_axis(idx, order, axis=1)
+
+
+# kNN exacto de la base contra sí misma, por bloques de consultas (sin contar a cada punto como su vecino).
+# El bloque sale de `memory_mb`: por cada similitud hay 4 bytes del bloque, 4 de su copia particionada y
+# 1 de la máscara de candidatos; no se arma un array de índices del tamaño del bloque
+def exact_knn(x, k=10, memory_mb=256):
+    n = len(x)
+    chunk_size = max(1, int(memory_mb * 2**20) // (9 * n))
+    sims_out = np.empty((n, k), dtype=np.float32)
+    idx_out = np.empty((n, k), dtype=np.int64)
+    for start in range(0, n, chunk_size):
+        stop = min(start + chunk_size, n)
+        sims = x[start:stop] @ x.T
+        sims[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+        # k-ésima similitud de cada fila: los candidatos la igualan o superan (con empates puede haber más de k)
+        threshold = np.partition(sims, n - k, axis=1)[:, n - k]
+        rows, cols = np.nonzero(sims >= threshold[:, None])
+        values = sims[rows, cols]
+        order = np.lexsort((-values, rows))
+        rows, cols, values = rows[order], cols[order], values[order]
+        take = np.searchsorted(rows, np.arange(stop - start))[:, None] + np.arange(k)
+        sims_out[start:stop], idx_out[start:stop] = values[take], cols[take]
+    return sims_out, idx_out
+
+
+# k-means esférico (centroides de norma 1) con iteraciones de Lloyd vectorizadas
+def kmeans(x, num_clusters, iterations=10, sample_size=50000, chunk_size=8192, seed=0):
+    rng = np.random.default_rng(seed)
+    sample = x[rng.choice(len(x), min(sample_size, len(x)), replace=False)]
+    centroids = sample[rng.choice(len(sample), num_clusters, replace=False)]
+    for _ in range(iterations):
+        assignment = assign_clusters(sample, centroids, chunk_size)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        empty = np.bincount(assignment, minlength=num_clusters) == 0
+        sums[empty] = sample[rng.choice(len(sample), empty.sum(), replace=False)]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+def assign_clusters(x, centroids, chunk_size=8192):
+    return np.concatenate([np.argmax(x[s:s + chunk_size] @ centroids.T, axis=1) for s in range(0, len(x), chunk_size)])
+
+
+class IVFIndex:
+    def __init__(self, x, num_lists=None, seed=0):
+        self.x = x
+        self.num_lists = num_lists or max(1, int(np.sqrt(len(x))))
+        self.centroids = kmeans(x, self.num_lists, seed=seed)
+        assignment = assign_clusters(x, self.centroids)
+        order = np.argsort(assignment, kind='stable')
+        bounds = np.searchsorted(assignment[order], np.arange(self.num_lists + 1))
+        self.lists = [order[bounds[i]:bounds[i + 1]] for i in range(self.num_lists)]
+
+    # Cada consulta revisa sus `nprobe` listas más cercanas; el trabajo se agrupa por lista
+    def search(self, queries, query_ids=None, k=10, nprobe=16, chunk_size=8192):
+        n = len(queries)
+        top_sims = np.full((n, k), -np.inf, dtype=np.float32)
+        top_idx = np.full((n, k), -1, dtype=np.int64)
+        probes = np.concatenate([np.argpartition(-(queries[s:s + chunk_size] @ self.centroids.T),
+                                                 min(nprobe, self.num_lists) - 1, axis=1)[:, :nprobe]
+                                 for s in range(0, n, chunk_size)])
+        for list_id, members in enumerate(self.lists):
+            rows = np.nonzero((probes == list_id).any(axis=1))[0]
+            if len(rows) == 0 or len(members) == 0:
+                continue
+            for s in range(0, len(rows), chunk_size):
+                q = rows[s:s + chunk_size]
+                sims = queries[q] @ self.x[members].T
+                if query_ids is not None:
+                    sims[query_ids[q][:, None] == members[None, :]] = -np.inf
+                top_sims[q], top_idx[q] = _merge_topk(top_sims[q], top_idx[q], sims,
+                                                      np.broadcast_to(members, sims.shape), k)
+        return _sort_topk(top_sims, top_idx)
+
+
+def build_knn(x, k=10, method='exact', num_lists=None, nprobe=16):
+    if method == 'exact':
+        return exact_knn(x, k)
+    index = IVFIndex(x, num_lists)
+    return index.search(x, np.arange(len(x)), k, nprobe)
+
+
+# Voto ponderado por similitud de las etiquetas de los vecinos: clase mayoritaria y fracción de acuerdo
+def neighbor_votes(labels, knn_sims, knn_idx, num_classes=10):
+    weights = np.where(knn_idx >= 0, np.maximum(knn_sims, 0), 0)
+    neighbor_labels = labels[np.maximum(knn_idx, 0)]
+    rows = np.repeat(np.arange(len(labels)), knn_idx.shape[1])
+    votes = np.bincount(rows * num_classes + neighbor_labels.ravel(), weights=weights.ravel(),
+                        minlength=len(labels) * num_classes).reshape(len(labels), num_classes)
+    majority = votes.argmax(axis=1)
+    agreement = votes[np.arange(len(labels)), majority] / np.maximum(votes.sum(axis=1), 1e-12)
+    return majority, agreement
+
+
+def find_suspected_mislabels(labels, knn_sims, knn_idx, min_agreement=0.8, num_classes=10):
+    majority, agreement = neighbor_votes(labels, knn_sims, knn_idx, num_classes)
+    suspects = np.nonzero((majority != labels) & (agreement >= min_agreement))[0]
+    suspects = suspects[np.argsort(-agreement[suspects], kind='stable')]
+    return suspects, majority, agreement
+
+
+# Pares (i, j) con i y j en distinto split y similitud >= umbral; cada par se reporta una sola vez
+def find_cross_split_duplicates(is_test, knn_sims, knn_idx, duplicate_threshold=0.99):
+    rows, cols = np.nonzero((knn_sims >= duplicate_threshold) & (knn_idx >= 0))
+    neighbors = knn_idx[rows, cols]
+    cross = is_test[rows] != is_test[neighbors]
+    test_idx = np.where(is_test[rows], rows, neighbors)[cross]
+    train_idx = np.where(is_test[rows], neighbors, rows)[cross]
+    sims = knn_sims[rows, cols][cross]
+    pairs, first = np.unique(np.stack([test_idx, train_idx], axis=1), axis=0, return_index=True)
+    order = np.argsort(-sims[first], kind='stable')
+    return pairs[order], sims[first][order]
+
+
+def pixel_similarity(images, a, b):
+    x = normalize_rows(np.asarray(images[a]).reshape(len(a), -1))
+    y = normalize_rows(np.asarray(images[b]).reshape(len(b), -1))
+    return np.einsum('ij,ij->i', x, y)
+
+
+# Grilla PNG: por fila, la imagen consultada seguida de sus vecinos más cercanos
+def save_neighbors_png(path, images, query_idx, knn_idx, num_neighbors=5):
+    import matplotlib.image
+    from .plotting import build_montage
+
+    cols = num_neighbors + 1
+    indices = np.concatenate([np.asarray(query_idx)[:, None], knn_idx[query_idx, :num_neighbors]], axis=1)
+    rows, columns = np.divmod(np.arange(indices.size), cols)
+    montage = build_montage(images, rows, columns, indices.ravel(), (len(query_idx), cols))
+    matplotlib.image.imsave(path, montage, cmap='gray', vmin=0, vmax=255)
+    return path
+
+
+def analyze_dataset(embeddings, images, labels, num_train, k=10, method='exact', num_lists=None, nprobe=16,
+                    pca_dim=None, min_agreement=0.8, duplicate_threshold=0.99, output_dir=NEIGHBORS_DIR, top=50):
+    labels = np.asarray(labels, dtype=np.int64)
+    is_test = np.arange(len(labels)) >= num_train
+    x = normalize_rows(embeddings)
+    if pca_dim:
+        x = normalize_rows(pca_reduce(x, pca_dim))
+
+    start = time.perf_counter()
+    knn_sims, knn_idx = build_knn(x, k, method, num_lists, nprobe)
+    knn_seconds = time.perf_counter() - start
+    print(f'kNN ({method}, k={k}, {x.shape[1]} dimensiones) sobre {len(x)} imágenes en {knn_seconds:.1f}s')
+
+    suspects, majority, agreement = find_suspected_mislabels(labels, knn_sims, knn_idx, min_agreement)
+    pairs, sims = find_cross_split_duplicates(is_test, knn_sims, knn_idx, duplicate_threshold)
+    pixel_sims = pixel_similarity(images, pairs[:, 0], pairs[:, 1]) if len(pairs) else np.empty(0)
+    print(f'{len(suspects)} etiquetas sospechosas, {len(pairs)} casi-duplicados entre train y test')
+
+    def split_of(i):
+        return ('test', int(i - num_train)) if is_test[i] else ('train', int(i))
+
+    report = {
+        'k': k, 'method': method, 'dimensions': int(x.shape[1]), 'knn_seconds': knn_seconds,
+        'min_agreement': min_agreement, 'duplicate_threshold': duplicate_threshold,
+        'suspected_mislabels': [{'split': split_of(i)[0], 'index': split_of(i)[1], 'label': int(labels[i]),
+                                 'neighbor_label': int(majority[i]), 'agreement': float(agreement[i])}
+                                for i in suspects],
+        'cross_split_duplicates': [{'test_index': int(t - num_train), 'train_index': int(r),
+                                    'similarity': float(s), 'pixel_similarity': float(p),
+                                    'same_label': bool(labels[t] == labels[r])}
+                                   for (t, r), s, p in zip(pairs, sims, pixel_sims)],
+    }
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, 'neighbors.json'), 'w') as f:
+        json.dump(report, f, indent=2)
+    if len(suspects):
+        save_neighbors_png(os.path.join(output_dir, 'suspected_mislabels.png'), images, suspects[:top], knn_idx)
+    if len(pairs):
+        save_neighbors_png(os.path.join(output_dir, 'cross_split_duplicates.png'), images, pairs[:top, 0],
+                           knn_idx)
+    return report
+
+
+def print_neighbors_report(report, top=10):
+    print(f'{"Split":>6}{"Índice":>8}{"Etiqueta":>10}{"Vecinos":>9}{"Acuerdo":>9}')
+    for entry in report['suspected_mislabels'][:top]:
+        print(f'{entry["split"]:>6}{entry["index"]:>8}{entry["label"]:>10}{entry["neighbor_label"]:>9}'
+              f'{entry["agreement"]:>9.2f}')
+    print(f'{"Test":>6}{"Train":>8}{"Sim.":>8}{"Píxeles":>9}{"Misma etiqueta":>16}')
+    for entry in report['cross_split_duplicates'][:top]:
+        print(f'{entry["test_index"]:>6}{entry["train_index"]:>8}{entry["similarity"]:>8.4f}'
+              f'{entry["pixel_similarity"]:>9.4f}{str(entry["same_label"]):>16}')
@@ -0,0 +1,140 @@
+"""Gráficas de la práctica: curvas de entrenamiento, predicciones, matrices de confusión y errores.
+
+Las funciones devuelven la figura; quien llama decide si mostrarla (`plt.show()`) o guardarla.
+"""
+
+import numpy as np
+import seaborn as sns
+import matplotlib.pyplot as plt
+
+
+# Gráficas de entrenamiento y validación
+def plot_training_history(history):
+    fig = plt.figure(figsize=(12, 5))
+    plt.subplot(1, 2, 1)
+    plt.plot(history['accuracy'], label='Precisión en entrenamiento')
+    plt.plot(history['val_accuracy'], label='Precisión en validación')
+    plt.title('Curva de Precisión')
+    plt.xlabel('Época')
+    plt.ylabel('Precisión')
+    plt.legend()
+
+    plt.subplot(1, 2, 2)
+    plt.plot(history['loss'], label='Pérdida en entrenamiento')
+    plt.plot(history['val_loss'], label='Pérdida en validación')
+    plt.title('Curva de Pérdida')
+    plt.xlabel('Época')
+    plt.ylabel('Pérdida')
+    plt.legend()
+    return fig
+
+
+# Función para visualizar resultados
+def plot_images(images, cls_true, cls_pred=None):
+    assert len(images) == len(cls_true) == 9
+
+    fig, axes = plt.subplots(3, 3, figsize=(9, 9))
+    fig.subplots_adjust(hspace=0.3, wspace=0.3)
+
+    for i, ax in enumerate(axes.flat):
+        ax.imshow(images[i].reshape(28, 28), cmap='binary')
+        if cls_pred is None:
+            ax_title = "True: {0}".format(cls_true[i])
+        else:
+            ax_title = "True: {0}, Pred: {1}".format(cls_true[i], cls_pred[i])
+
+        ax.set_title(ax_title)
+        ax.set_xticks([])
+        ax.set_yticks([])
+    return fig
+
+
+# Visualización de la matriz de confusión con Seaborn
+def plot_confusion_matrix(conf_matrix, title='Matriz de Confusión', xlabel='Predicted Label', ylabel='True Label',
+                          **heatmap_kwargs):
+    fig = plt.figure(figsize=(10, 8))
+    sns.heatmap(conf_matrix, annot=True, fmt='d', cmap='Blues', **heatmap_kwargs)
+    plt.xlabel(xlabel)
+    plt.ylabel(ylabel)
+    plt.title(title)
+    return fig
+
+
+# Visualización del reporte de clasificación
+def plot_precision_per_class(clas_report):
+    fig, ax = plt.subplots(figsize=(12, 6))
+    sns.barplot(x=list(clas_report.keys())[:-3], y=[d['precision'] for d in list(clas_report.values())[:-3]], ax=ax)
+    ax.set_ylabel('Precision')
+    ax.set_title('Precisión por Clase')
+    return fig
+
+
+# Agrupa los errores por clase verdadera con un solo ordenamiento: devuelve, para cada imagen que entra
+# en la grilla, su fila (clase verdadera), su columna (orden dentro de la clase) y su índice en el dataset
+def group_misclassified(true_labels, predicted_labels, num_classes, max_images=5):
+    true_labels, predicted_labels = np.asarray(true_labels), np.asarray(predicted_labels)
+    misclassified_idx = np.flatnonzero(predicted_labels != true_labels)
+    order = misclassified_idx[np.argsort(true_labels[misclassified_idx], kind='stable')]
+    rows = true_labels[order]
+    starts = np.concatenate(([0], np.cumsum(np.bincount(rows, minlength=num_classes))[:-1]))
+    cols = np.arange(len(order)) - starts[rows]
+    keep = cols < max_images
+    return rows[keep], cols[keep], order[keep]
+
+
+# Conteo de cada par (verdadera, predicha) con un bincount; devuelve los pares con errores, de más a menos
+def confusion_pairs(true_labels, predicted_labels, num_classes):
+    counts = np.bincount(np.asarray(true_labels, dtype=np.int64) * num_classes + np.asarray(predicted_labels),
+                         minlength=num_classes * num_classes).reshape(num_classes, num_classes)
+    np.fill_diagonal(counts, 0)
+    true_idx, pred_idx = np.nonzero(counts)
+    order = np.argsort(-counts[true_idx, pred_idx], kind='stable')
+    return [(int(t), int(p), int(counts[t, p])) for t, p in zip(true_idx[order], pred_idx[order])]
+
+
+# Arma la grilla en una sola imagen uint8: todas las imágenes se copian con una única asignación indexada
+def build_montage(images, rows, cols, indices, grid_shape, pad=2, pad_value=255):
+    tiles = np.asarray(images[indices]).reshape(len(indices), *np.shape(images)[1:3])
+    if tiles.dtype != np.uint8:
+        tiles = np.clip(np.round(tiles * 255), 0, 255).astype(np.uint8)
+    h, w = tiles.shape[1:3]
+    montage = np.full((grid_shape[0] * (h + pad) + pad, grid_shape[1] * (w + pad) + pad), pad_value, dtype=np.uint8)
+    y = pad + rows * (h + pad)
+    x = pad + cols * (w + pad)
+    montage[y[:, None, None] + np.arange(h)[None, :, None], x[:, None, None] + np.arange(w)[None, None, :]] = tiles
+    return montage
+
+
+def misclassified_montage(images, true_labels, predicted_labels, num_classes, max_images=5, pad=2):
+    rows, cols, indices = group_misclassified(true_labels, predicted_labels, num_classes, max_images)
+    montage = build_montage(images, rows, cols, indices, (num_classes, max_images), pad)
+    return montage, rows, cols, indices
+
+
+# Escribe la grilla de errores directamente a PNG, sin crear una figura
+def save_misclassified_png(path, images, true_labels, predicted_labels, num_classes, max_images=5):
+    import matplotlib.image
+
+    montage, _, _, _ = misclassified_montage(images, true_labels, predicted_labels, num_classes, max_images)
+    matplotlib.image.imsave(path, montage, cmap='gray', vmin=0, vmax=255)
+    return path
+
+
+# Imágenes mal clasificadas de cada clase: una fila por clase verdadera, un solo imshow para toda la grilla
+# y la clase predicha escrita sobre cada imagen (model se mantiene por compatibilidad; no se usa)
+def plot_misclassified_images(model, images, true_labels, predicted_labels, class_names, max_images=5, pad=2):
+    num_classes = len(class_names)
+    montage, rows, cols, indices = misclassified_montage(images, true_labels, predicted_labels, num_classes,
+                                                         max_images, pad)
+    h, w = np.shape(images)[1:3]
+    fig, ax = plt.subplots(figsize=(1.5 * max_images, 1.5 * num_classes))
+    ax.imshow(montage, cmap='gray', vmin=0, vmax=255, interpolation='nearest')
+    for row, col, idx in zip(rows, cols, indices):
+        ax.text(pad + col * (w + pad) + 1, pad + row * (h + pad) + 1, class_names[predicted_labels[idx]],
+                color='red', fontsize=9, va='top', ha='left')
+    ax.set_yticks(pad + np.arange(num_classes) * (h + pad) + h / 2)
+    ax.set_yticklabels([f'True: {name}' for name in class_names])
+    ax.set_xticks([])
+    ax.set_title('Mal clasificadas por clase verdadera (en rojo, la clase predicha)')
+    fig.tight_layout()
+    return fig
@@ -0,0 +1,331 @@
+"""Perfilado por capa de model_cnn (Keras) y MobileNetV2 (PyTorch).
+
+Para cada capa hoja y cada paso perfilado se registra el tiempo de forward y de backward, una
+estimación de FLOPs del forward, la memoria de la activación de salida y la cantidad de asignaciones.
+Con eso se arma una tabla de capas calientes ordenada por tiempo y una traza JSON para
+chrome://tracing o Perfetto.
+
+- PyTorch: hooks de forward y de backward en cada módulo hoja. Las asignaciones se cuentan con un
+  modo de dispatch que ve cada tensor nuevo creado por los operadores, también durante el backward.
+- Keras: un paso de entrenamiento ejecutado capa por capa en modo eager, con una GradientTape por
+  capa; `KerasLayerProfiler.callback` lo dispara cada N lotes durante `fit`. TensorFlow no expone un
+  contador por operador, así que las asignaciones son los tensores que devuelve cada capa.
+
+Ningún perfilado actualiza los pesos. Los tiempos incluyen una sincronización con el dispositivo por
+capa: el perfilado se activa aparte y no debe quedar encendido durante el entrenamiento normal.
+"""
+
+import json
+import time
+import contextlib
+
+import numpy as np
+
+TRACE_THREADS = ('paso', 'forward', 'backward')
+
+
+# Estadísticas acumuladas por capa, tabla de capas calientes y traza en formato Chrome
+class LayerProfiler:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.layers = {}
+        self.events = []
+        self.steps = 0
+        self._origin = time.perf_counter()
+
+    def _sync(self):
+        pass
+
+    def _record(self, name, layer_type, phase, start, end, **values):
+        if name not in self.layers:
+            self.layers[name] = {'type': layer_type, 'forward_s': 0.0, 'backward_s': 0.0, 'flops': 0,
+                                 'activation_bytes': 0, 'allocations': 0}
+        stats = self.layers[name]
+        stats[f'{phase}_s'] += end - start
+        for key, value in values.items():
+            stats[key] += value
+        self.events.append({'name': name, 'cat': phase, 'ph': 'X', 'pid': 0, 'tid': TRACE_THREADS.index(phase),
+                            'ts': (start - self._origin) * 1e6, 'dur': (end - start) * 1e6,
+                            'args': {'type': layer_type, **values}})
+
+    @contextlib.contextmanager
+    def step(self):
+        self._sync()
+        start = time.perf_counter()
+        yield
+        self._sync()
+        end = time.perf_counter()
+        self.steps += 1
+        self.events.append({'name': f'paso {self.steps}', 'cat': 'paso', 'ph': 'X', 'pid': 0, 'tid': 0,
+                            'ts': (start - self._origin) * 1e6, 'dur': (end - start) * 1e6})
+
+    # Promedios por paso, ordenados por tiempo total (forward + backward) de mayor a menor
+    def hot_layers(self):
+        steps = max(self.steps, 1)
+        total = sum(s['forward_s'] + s['backward_s'] for s in self.layers.values()) or 1.0
+        rows = [{
+            'layer': name,
+            'type': s['type'],
+            'forward_ms': s['forward_s'] / steps * 1000,
+            'backward_ms': s['backward_s'] / steps * 1000,
+            'time_share': (s['forward_s'] + s['backward_s']) / total,
+            'mflops': s['flops'] / steps / 1e6,
+            'gflop_s': s['flops'] / s['forward_s'] / 1e9 if s['forward_s'] else 0.0,
+            'activation_mb': s['activation_bytes'] / steps / 2**20,
+            'allocations': s['allocations'] / steps,
+        } for name, s in self.layers.items()]
+        return sorted(rows, key=lambda r: r['forward_ms'] + r['backward_ms'], reverse=True)
+
+    def print_hot_layers(self, top=15):
+        rows = self.hot_layers()
+        print(f'{"Capa":<28}{"Tipo":<18}{"fwd ms":>9}{"bwd ms":>9}{"% tiempo":>10}{"MFLOPs":>10}'
+              f'{"GFLOP/s":>9}{"act MB":>9}{"allocs":>8}')
+        for r in rows[:top]:
+            print(f'{r["layer"][:27]:<28}{r["type"][:17]:<18}{r["forward_ms"]:>9.3f}{r["backward_ms"]:>9.3f}'
+                  f'{r["time_share"]:>10.1%}{r["mflops"]:>10.2f}{r["gflop_s"]:>9.2f}{r["activation_mb"]:>9.2f}'
+                  f'{r["allocations"]:>8.1f}')
+        print(f'{len(rows)} capas, {self.steps} pasos: '
+              f'{sum(r["forward_ms"] + r["backward_ms"] for r in rows):.2f} ms por paso en capas, '
+              f'{sum(r["mflops"] for r in rows):.1f} MFLOPs de forward, '
+              f'{sum(r["activation_mb"] for r in rows):.1f} MB de activaciones')
+
+    def save_chrome_trace(self, path):
+        metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': 0, 'tid': tid, 'args': {'name': name}}
+                    for tid, name in enumerate(TRACE_THREADS)]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': metadata + self.events, 'displayTimeUnit': 'ms'}, f)
+        return path
+
+
+# FLOPs del forward: convoluciones y capas densas con 2 operaciones por multiplicación-suma,
+# el resto (normalización, activaciones, pooling) una o dos por elemento de salida
+def _torch_flops(module, output):
+    import torch.nn as nn
+
+    if isinstance(module, nn.Conv2d):
+        kh, kw = module.kernel_size
+        return 2 * output.numel() * (module.in_channels // module.groups) * kh * kw
+    if isinstance(module, nn.Linear):
+        return 2 * output.numel() * module.in_features
+    if isinstance(module, nn.modules.batchnorm._BatchNorm):
+        return 2 * output.numel()
+    return output.numel()
+
+
+# Modo de dispatch que cuenta los tensores de salida de cada operador que no reutilizan el
+# almacenamiento de una entrada (vistas y operaciones in-place no asignan memoria nueva)
+def _allocation_counter(profiler):
+    import torch
+    from torch.utils._python_dispatch import TorchDispatchMode
+    from torch.utils._pytree import tree_flatten
+
+    class AllocationCounter(TorchDispatchMode):
+        def __torch_dispatch__(self, func, types, args=(), kwargs=None):
+            out = func(*args, **(kwargs or {}))
+            inputs = {t.untyped_storage().data_ptr() for t in tree_flatten((args, kwargs))[0]
+                      if isinstance(t, torch.Tensor)}
+            profiler.allocations += sum(1 for t in tree_flatten(out)[0]
+                                        if isinstance(t, torch.Tensor) and t.untyped_storage().data_ptr() not in inputs)
+            return out
+
+    return AllocationCounter()
+
+
+# Uso:
+#     with TorchLayerProfiler(model) as profiler:
+#         with profiler.step():
+#             criterion(model(images), labels).backward()
+class TorchLayerProfiler(LayerProfiler):
+    def __init__(self, model, count_allocations=True):
+        super().__init__()
+        self.model = model
+        self.device = next(model.parameters()).device
+        self.count_allocations = count_allocations
+        self.allocations = 0
+        self._active = False
+        self._starts = {}
+        self._handles = []
+        self._inplace = []
+
+    def _sync(self):
+        import torch
+
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize(self.device)
+
+    def __enter__(self):
+        for name, module in self.model.named_modules():
+            if next(module.children(), None) is not None:
+                continue
+            name = name or type(module).__name__
+            # Los hooks de backward no admiten que la salida de un módulo se modifique in-place
+            if getattr(module, 'inplace', False):
+                module.inplace = False
+                self._inplace.append(module)
+            self._handles += [module.register_forward_pre_hook(self._enter_hook(name, 'forward')),
+                              module.register_forward_hook(self._exit_hook(name, 'forward')),
+                              module.register_full_backward_pre_hook(self._enter_hook(name, 'backward')),
+                              module.register_full_backward_hook(self._exit_hook(name, 'backward'))]
+        return self
+
+    def __exit__(self, *exc_info):
+        for handle in self._handles:
+            handle.remove()
+        for module in self._inplace:
+            module.inplace = True
+        self._handles, self._inplace = [], []
+
+    @contextlib.contextmanager
+    def step(self):
+        counter = _allocation_counter(self) if self.count_allocations else contextlib.nullcontext()
+        self._active = True
+        try:
+            with super().step(), counter:
+                yield
+        finally:
+            self._active = False
+            self._starts.clear()
+
+    def _enter_hook(self, name, phase):
+        def hook(module, *args):
+            if self._active:
+                self._sync()
+                self._starts[(name, phase)] = (time.perf_counter(), self.allocations)
+        return hook
+
+    def _exit_hook(self, name, phase):
+        def hook(module, inputs, outputs):
+            if (name, phase) not in self._starts:
+                return
+            self._sync()
+            end = time.perf_counter()
+            start, allocations = self._starts.pop((name, phase))
+            values = {'allocations': self.allocations - allocations}
+            if phase == 'forward':
+                output = outputs[0] if isinstance(outputs, (tuple, list)) else outputs
+                values.update(flops=_torch_flops(module, output),
+                              activation_bytes=output.numel() * output.element_size())
+            self._record(name, type(module).__name__, phase, start, end, **values)
+        return hook
+
+
+# Perfila forward + backward de MobileNetV2 sobre los primeros lotes (sin paso del optimizador)
+# Se perfila en modo entrenamiento, pero sobre una copia de los buffers: las estadísticas de BatchNorm
+# (y con ellas las cachés de embeddings que dependen del backbone) quedan como estaban
+def profile_mobilenet(model, batches, criterion, steps=5, warmup=1, count_allocations=True):
+    from .mobilenet import to_model_input
+
+    profiler = TorchLayerProfiler(model, count_allocations)
+    was_training = model.training
+    buffers = {name: buffer.detach().clone() for name, buffer in model.named_buffers()}
+    model.train()
+    try:
+        with profiler:
+            for i, (images, labels) in enumerate(batches):
+                if i == warmup:
+                    profiler.reset()
+                if i >= warmup + steps:
+                    break
+                images, labels = to_model_input(images), labels.to(profiler.device)
+                with profiler.step():
+                    criterion(model(images), labels).backward()
+                model.zero_grad(set_to_none=True)
+    finally:
+        for name, buffer in model.named_buffers():
+            buffer.data.copy_(buffers[name])
+        model.train(was_training)
+    return profiler
+
+
+def _keras_flops(layer, inputs, output):
+    from tensorflow.keras import layers
+
+    n = int(np.prod(output.shape))
+    if isinstance(layer, layers.Conv2D):
+        kh, kw = layer.kernel_size
+        return 2 * n * (inputs.shape[-1] // layer.groups) * kh * kw
+    if isinstance(layer, layers.Dense):
+        return 2 * n * inputs.shape[-1]
+    if isinstance(layer, layers.MaxPooling2D):
+        return n * int(np.prod(layer.pool_size))
+    if isinstance(layer, (layers.Flatten, layers.Reshape)):
+        return 0
+    return n
+
+
+class KerasLayerProfiler(LayerProfiler):
+    def __init__(self, model, loss_fn=None):
+        import tensorflow as tf
+
+        super().__init__()
+        self.model = model
+        self.loss_fn = loss_fn or tf.keras.losses.SparseCategoricalCrossentropy()
+
+    def _sync(self):
+        import tensorflow as tf
+
+        sync_devices = getattr(tf.test.experimental, 'sync_devices', None)
+        if sync_devices is not None and tf.config.list_logical_devices('GPU'):
+            sync_devices()
+
+    # Un paso de entrenamiento capa por capa: cada capa corre dentro de su propia GradientTape y el
+    # backward se encadena en orden inverso con output_gradients. Devuelve la pérdida del lote.
+    def profile_step(self, x, y):
+        import tensorflow as tf
+
+        with self.step():
+            h = tf.convert_to_tensor(x)
+            tapes = []
+            for layer in self.model.layers:
+                start = time.perf_counter()
+                with tf.GradientTape() as tape:
+                    if h.dtype.is_floating:
+                        tape.watch(h)
+                    out = layer(h, training=True)
+                self._sync()
+                self._record(layer.name, type(layer).__name__, 'forward', start, time.perf_counter(),
+                             flops=_keras_flops(layer, h, out), activation_bytes=int(np.prod(out.shape)) * out.dtype.size,
+                             allocations=1)
+                tapes.append((layer, tape, h, out))
+                h = out
+
+            with tf.GradientTape() as tape:
+                tape.watch(h)
+                loss = self.loss_fn(y, h)
+            grad = tape.gradient(loss, h)
+            for layer, tape, inputs, out in reversed(tapes):
+                sources = ([inputs] if inputs.dtype.is_floating else []) + list(layer.trainable_weights)
+                if not sources:  # Rescaling sobre la entrada uint8: no hay nada que derivar
+                    continue
+                start = time.perf_counter()
+                grads = tape.gradient(out, sources, output_gradients=grad)
+                self._sync()
+                self._record(layer.name, type(layer).__name__, 'backward', start, time.perf_counter(),
+                             allocations=sum(g is not None for g in grads))
+                grad = grads[0]
+        return float(loss)
+
+    # Callback para fit: perfila un paso sobre el lote (x, y) fijo cada every_n_batches lotes
+    def callback(self, x, y, every_n_batches=100):
+        import tensorflow as tf
+
+        profiler = self
+
+        class LayerProfilingCallback(tf.keras.callbacks.Callback):
+            def on_train_batch_end(self, batch, logs=None):
+                if batch % every_n_batches == 0:
+                    profiler.profile_step(x, y)
+
+        return LayerProfilingCallback()
+
+
+def profile_model_cnn(model_cnn, x, y, steps=10, warmup=1, batch_size=128):
+    profiler = KerasLayerProfiler(model_cnn)
+    for i in range(warmup + steps):
+        if i == warmup:
+            profiler.reset()
+        start = (i * batch_size) % max(len(x) - batch_size, 1)
+        profiler.profile_step(x[start:start + batch_size], y[start:start + batch_size])
+    return profiler
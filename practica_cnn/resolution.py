@@ -0,0 +1,139 @@
+"""Barrido de la resolución de entrada de MobileNetV2: accuracy frente a imágenes/s y memoria.
+
+`Resize(224)` multiplica por 64 la cantidad de píxeles de un dígito de 28x28, y casi todo el cómputo
+del backbone se va en píxeles interpolados que no agregan información. Para cada resolución se arma el
+almacén redimensionado, se adaptan los strides del backbone (`mobilenet.adapt_strides`), se entrena el
+clasificador sobre la caché de embeddings y se mide accuracy, throughput de inferencia, FLOPs y memoria
+de activaciones. Con eso se elige la resolución más barata que cumple el objetivo de accuracy.
+
+El pico de memoria es el que reserva PyTorch en GPU o, en CPU, la RSS máxima de un proceso nuevo que
+carga el modelo y hace un forward con el lote: dentro del proceso del barrido la RSS máxima solo crece
+y no distinguiría una resolución de otra.
+"""
+
+import os
+import json
+import time
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import torch
+
+from .benchmark import BENCHMARK_DIR, peak_rss_mb
+from .mobilenet import (device, load_datasets, build_mobilenet, build_optimizer, build_embedding_cache,
+                        train_head_from_cache, iterate_embedding_batches, evaluate_streaming, to_model_input)
+from .profiling import TorchLayerProfiler
+
+RESOLUTIONS = (32, 64, 96, 128, 224)
+SWEEP_PATH = os.path.join(BENCHMARK_DIR, 'resolution_sweep.json')
+
+
+# Throughput de inferencia de punta a punta: lotes uint8 del almacén, normalización y forward completo
+def measure_inference(model, dataset, batch_size=256, repeats=5):
+    images, _ = dataset.__getitems__(np.arange(min(batch_size, len(dataset))))
+    model.eval()
+    with torch.no_grad():
+        model(to_model_input(images))
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            model(to_model_input(images)).argmax(1).cpu()
+            times.append(time.perf_counter() - start)
+    return len(images) / float(np.median(times))
+
+
+# Se ejecuta en un proceso nuevo: RSS máxima de un forward en CPU con los pesos entrenados
+def _inference_peak_rss(state_path, input_size, images):
+    model = build_mobilenet(pretrained=False, input_size=input_size).cpu()
+    model.load_state_dict(torch.load(state_path, map_location='cpu'))
+    model.eval()
+    with torch.no_grad():
+        model(to_model_input(torch.from_numpy(images)))
+    return peak_rss_mb()
+
+
+def measure_cpu_peak_rss(model, images, input_size):
+    with tempfile.TemporaryDirectory() as tmp:
+        state_path = os.path.join(tmp, 'model.pt')
+        torch.save({k: v.cpu() for k, v in model.state_dict().items()}, state_path)
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as pool:
+            return pool.submit(_inference_peak_rss, state_path, input_size, np.asarray(images)).result()
+
+
+# FLOPs por imagen y memoria de activaciones de un forward (suma de las salidas de cada capa) con un lote,
+# y el pico de memoria (PyTorch en GPU, RSS de un proceso nuevo en CPU)
+def measure_memory(model, dataset, input_size, batch_size=32):
+    images, _ = dataset.__getitems__(np.arange(min(batch_size, len(dataset))))
+    model.eval()
+    if device.type == 'cuda':
+        torch.cuda.reset_peak_memory_stats(device)
+    with torch.no_grad():
+        feature_map = model.features(to_model_input(images[:1])).shape[-1]
+    profiler = TorchLayerProfiler(model, count_allocations=False)
+    with profiler, profiler.step(), torch.no_grad():
+        model(to_model_input(images))
+    rows = profiler.hot_layers()
+    if device.type == 'cuda':
+        peak_memory_mb = torch.cuda.max_memory_allocated(device) / 2**20
+    else:
+        peak_memory_mb = measure_cpu_peak_rss(model, images, input_size)
+    return {
+        'feature_map': feature_map,
+        'mflops_per_image': sum(r['mflops'] for r in rows) / len(images),
+        'activation_mb_per_batch': sum(r['activation_mb'] for r in rows),
+        'peak_memory_mb': peak_memory_mb,
+    }
+
+
+def sweep_resolutions(sizes=RESOLUTIONS, epochs=3, batch_size=128, use_store=True, pretrained=True):
+    results = []
+    for size in sizes:
+        print(f'--- Resolución {size}x{size}')
+        train_dataset, test_dataset = load_datasets(use_store=use_store, resized=True, size=size)
+        model = build_mobilenet(pretrained=pretrained, input_size=size)
+        criterion, optimizer = build_optimizer(model)
+        start = time.perf_counter()
+        train_features, train_labels = build_embedding_cache(model, train_dataset, 'train')
+        test_features, test_labels = build_embedding_cache(model, test_dataset, 'test')
+        embedding_s = time.perf_counter() - start
+        train_head_from_cache(model, criterion, optimizer, epochs, train_features, train_labels, batch_size)
+        model.classifier.eval()
+        metrics = evaluate_streaming(iterate_embedding_batches(test_features, test_labels, batch_size=1024),
+                                     model.classifier)
+        results.append({'input_size': size, 'accuracy': metrics['accuracy'],
+                        'infer_img_s': measure_inference(model, test_dataset), 'embedding_s': embedding_s,
+                        **measure_memory(model, test_dataset, size)})
+    return results
+
+
+# La resolución recomendada es la de mayor throughput entre las que alcanzan la accuracy objetivo
+def recommend_resolution(results, target_accuracy):
+    candidates = [r for r in results if r['accuracy'] >= target_accuracy]
+    return max(candidates, key=lambda r: r['infer_img_s']) if candidates else None
+
+
+def print_sweep_report(results, target_accuracy=None):
+    print(f'{"Tamaño":>7}{"Mapa":>6}{"Accuracy":>10}{"img/s":>10}{"MFLOPs/img":>12}{"act MB/lote":>13}{"pico MB":>9}')
+    for r in results:
+        print(f'{r["input_size"]:>7}{r["feature_map"]:>6}{r["accuracy"]:>10.4f}{r["infer_img_s"]:>10.1f}'
+              f'{r["mflops_per_image"]:>12.1f}{r["activation_mb_per_batch"]:>13.1f}{r["peak_memory_mb"]:>9.1f}')
+    if target_accuracy is not None:
+        best = recommend_resolution(results, target_accuracy)
+        if best is None:
+            print(f'Ninguna resolución alcanza la accuracy objetivo de {target_accuracy:.4f}')
+        else:
+            print(f'Resolución recomendada para accuracy >= {target_accuracy:.4f}: {best["input_size"]}x{best["input_size"]} '
+                  f'({best["infer_img_s"]:.1f} img/s, accuracy {best["accuracy"]:.4f})')
+
+
+def run_sweep(sizes=RESOLUTIONS, target_accuracy=None, output_path=SWEEP_PATH, **kwargs):
+    results = sweep_resolutions(sizes, **kwargs)
+    print_sweep_report(results, target_accuracy)
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    with open(output_path, 'w') as f:
+        json.dump({'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'target_accuracy': target_accuracy,
+                   'results': results}, f, indent=2)
+    print(f'Resultados guardados en {output_path}')
+    return results
@@ -0,0 +1,24 @@
+"""Utilidades de ejecución en CPU compartidas por los módulos de entrenamiento, barrido y exportación.
+
+- `core_slices` reparte los núcleos disponibles entre workers o procesos. No importa ningún framework,
+  así que se puede usar antes de inicializar TensorFlow o PyTorch.
+- `cpu_input` prepara un lote para un modelo de PyTorch que corre en CPU (DDP con gloo, cuantización).
+"""
+
+import os
+
+
+# Reparte los núcleos disponibles en porciones contiguas y disjuntas, una por worker. Nunca hay más porciones
+# que núcleos / threads_per_worker (y al menos una): quien pida más workers recibe menos porciones
+def core_slices(num_workers, threads_per_worker):
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count()))
+    num_workers = max(1, min(num_workers, len(cores) // threads_per_worker))
+    return [cores[i * threads_per_worker:(i + 1) * threads_per_worker] for i in range(num_workers)]
+
+
+# Los lotes uint8 se normalizan en CPU; los que ya vienen en float se usan tal cual
+def cpu_input(images):
+    import torch
+    from .mobilenet import normalize_batch
+
+    return normalize_batch(images) if images.dtype == torch.uint8 else images
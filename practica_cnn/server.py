@@ -0,0 +1,220 @@
+"""Servicio de inferencia con micro-batching sobre asyncio.
+
+Las peticiones concurrentes de una sola imagen se acumulan en lotes dinámicos, limitados por un
+tamaño máximo de lote y un tiempo máximo de espera; se hace una sola pasada del modelo por lote y se
+devuelve a cada cliente su resultado. El front-end es HTTP mínimo sobre TCP o socket Unix:
+- `POST /predict` con los 784 bytes de la imagen (`application/octet-stream`) o `{"image": [...]}`.
+- `GET /metrics` con la profundidad de la cola, el histograma de tamaños de lote y la latencia p50/p99.
+
+No depende de ningún framework: recibe una función `predict_fn(lote_uint8) -> probabilidades`.
+"""
+
+import json
+import time
+import asyncio
+import collections
+
+import numpy as np
+
+IMAGE_BYTES = 28 * 28
+# Tope del cuerpo de una petición: 784 píxeles en JSON ocupan unos 4 KB
+MAX_BODY_BYTES = 64 * 1024
+
+
+class MicroBatcher:
+    def __init__(self, predict_fn, max_batch_size=64, max_wait_ms=5, latency_window=10000):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = asyncio.Queue()
+        self.batch_sizes = collections.Counter()
+        self.latencies = collections.deque(maxlen=latency_window)
+
+    async def predict(self, image):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((image, future, time.perf_counter()))
+        return await future
+
+    # Bucle principal: toma la primera petición y espera como máximo max_wait a completar el lote
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(items) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    items.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            batch = np.stack([image for image, _, _ in items])
+            try:
+                # El forward corre en un hilo para no bloquear el event loop mientras llegan más peticiones
+                outputs = await loop.run_in_executor(None, self.predict_fn, batch)
+            except Exception as e:
+                for _, future, _ in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            now = time.perf_counter()
+            for (_, future, start), output in zip(items, outputs):
+                if not future.done():
+                    future.set_result(output)
+                self.latencies.append((now - start) * 1000)
+            self.batch_sizes[len(items)] += 1
+
+    def metrics(self):
+        latencies = np.asarray(self.latencies)
+        return {
+            'queue_depth': self.queue.qsize(),
+            'batches': sum(self.batch_sizes.values()),
+            'batch_size_histogram': {str(k): v for k, v in sorted(self.batch_sizes.items())},
+            'latency_p50_ms': float(np.percentile(latencies, 50)) if latencies.size else None,
+            'latency_p99_ms': float(np.percentile(latencies, 99)) if latencies.size else None,
+        }
+
+
+# Petición que no se puede atender; `status` es la respuesta HTTP que corresponde
+class RequestError(ValueError):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+# Lee un mensaje HTTP/1.1 (petición o respuesta): primera línea, cabeceras y cuerpo por Content-Length.
+# Con `max_body` se rechaza, sin leerlo, un cuerpo más grande que ese tope
+async def read_http_message(reader, max_body=None):
+    first_line = await reader.readline()
+    if not first_line:
+        return None
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    length = headers.get('content-length', '0')
+    if not length.isdigit():
+        raise RequestError('400 Bad Request', f'Content-Length inválido: {length!r}')
+    if max_body is not None and int(length) > max_body:
+        raise RequestError('413 Content Too Large', f'Cuerpo de {length} bytes; el máximo es {max_body}')
+    body = await reader.readexactly(int(length))
+    return first_line.decode('latin-1').strip(), headers, body
+
+
+# El tipo de medio se compara sin parámetros (`application/json; charset=utf-8` es JSON)
+def decode_image(body, content_type):
+    media_type = (content_type or '').partition(';')[0].strip().lower()
+    if media_type == 'application/json':
+        pixels = json.loads(body)
+        if not isinstance(pixels, dict) or 'image' not in pixels:
+            raise ValueError('Se esperaba un objeto JSON con la clave "image"')
+        image = np.asarray(pixels['image'])
+        if image.dtype.kind not in 'iuf' or image.size != IMAGE_BYTES:
+            raise ValueError(f'"image" debe tener {IMAGE_BYTES} valores numéricos')
+        if np.any((image < 0) | (image > 255) | (image != np.floor(image))):
+            raise ValueError('Los píxeles deben ser enteros entre 0 y 255')
+        image = image.astype(np.uint8)
+    else:
+        if len(body) != IMAGE_BYTES:
+            raise ValueError(f'Se esperaban {IMAGE_BYTES} bytes y llegaron {len(body)}')
+        image = np.frombuffer(body, dtype=np.uint8)
+    return image.reshape(28, 28, 1)
+
+
+def write_response(writer, status, payload):
+    data = json.dumps(payload).encode()
+    writer.write(f'HTTP/1.1 {status}\r\nContent-Type: application/json\r\n'
+                 f'Content-Length: {len(data)}\r\n\r\n'.encode() + data)
+
+
+async def handle_http(batcher, reader, writer):
+    try:
+        while True:
+            try:
+                message = await read_http_message(reader, MAX_BODY_BYTES)
+            except RequestError as e:
+                # El cuerpo no se leyó: se responde y se cierra, porque el flujo quedó desalineado
+                write_response(writer, e.status, {'error': str(e)})
+                await writer.drain()
+                break
+            if message is None:
+                break
+            request_line, headers, body = message
+            parts = request_line.split(' ')
+            method, path = (parts[0], parts[1]) if len(parts) >= 2 else (None, None)
+            if method is None:
+                status, payload = '400 Bad Request', {'error': f'Línea de petición inválida: {request_line!r}'}
+            elif method == 'POST' and path == '/predict':
+                try:
+                    probabilities = await batcher.predict(decode_image(body, headers.get('content-type')))
+                    status, payload = '200 OK', {'class': int(np.argmax(probabilities)),
+                                                 'probabilities': probabilities.tolist()}
+                except (ValueError, TypeError) as e:
+                    status, payload = '400 Bad Request', {'error': str(e)}
+            elif method == 'GET' and path == '/metrics':
+                status, payload = '200 OK', batcher.metrics()
+            else:
+                status, payload = '404 Not Found', {'error': f'{method} {path}'}
+            write_response(writer, status, payload)
+            await writer.drain()
+            if headers.get('connection', '').lower() == 'close':
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_inference_server(predict_fn, host='127.0.0.1', port=8000, unix_socket=None,
+                                 max_batch_size=64, max_wait_ms=5):
+    batcher = MicroBatcher(predict_fn, max_batch_size, max_wait_ms)
+    worker = asyncio.create_task(batcher.run())
+    handler = lambda reader, writer: handle_http(batcher, reader, writer)
+    if unix_socket:
+        server = await asyncio.start_unix_server(handler, path=unix_socket)
+    else:
+        server = await asyncio.start_server(handler, host, port)
+    return server, batcher, worker
+
+
+# Servir indefinidamente (por ejemplo: asyncio.run(serve_forever(predict_batch)))
+async def serve_forever(predict_fn, **kwargs):
+    server, _, worker = await start_inference_server(predict_fn, **kwargs)
+    async with server:
+        await server.serve_forever()
+    worker.cancel()
+
+
+# Cliente de carga: cada conexión envía sus imágenes de forma secuencial (keep-alive)
+async def _load_test_client(host, port, images, latencies):
+    reader, writer = await asyncio.open_connection(host, port)
+    for image in images:
+        body = image.tobytes()
+        start = time.perf_counter()
+        writer.write(f'POST /predict HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/octet-stream\r\n'
+                     f'Content-Length: {len(body)}\r\n\r\n'.encode() + body)
+        await writer.drain()
+        await read_http_message(reader)
+        latencies.append((time.perf_counter() - start) * 1000)
+    writer.close()
+    await writer.wait_closed()
+
+
+async def load_test(predict_fn, images, concurrency=64, host='127.0.0.1', port=8000, **server_kwargs):
+    server, batcher, worker = await start_inference_server(predict_fn, host, port, **server_kwargs)
+    latencies = []
+    start = time.perf_counter()
+    async with server:
+        await asyncio.gather(*(_load_test_client(host, port, images[i::concurrency], latencies)
+                               for i in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    worker.cancel()
+    print(f'{len(images)} peticiones, concurrencia {concurrency}: {len(images) / elapsed:.1f} peticiones/s, '
+          f'p50 {np.percentile(latencies, 50):.2f} ms, p99 {np.percentile(latencies, 99):.2f} ms')
+    print(json.dumps(batcher.metrics(), indent=2))
@@ -0,0 +1,225 @@
+"""Evaluación en streaming, con memoria acotada, sobre colecciones de imágenes repartidas en shards.
+
+Las evaluaciones de `evaluation` cargan todo el conjunto de prueba y todas sus probabilidades en
+memoria. Acá, en cambio, el conjunto se reparte en shards y se procesa de a uno:
+
+- Un pool de hilos lectores trae los siguientes shards en segundo plano mientras se hace la inferencia
+  sobre el actual. Como mucho hay `max_pending` shards leídos o en lectura.
+- Cada shard se recorre en lotes con una función `predict_batch(images) -> probabilidades`
+  (`keras_cnn.make_predict_batch` o `mobilenet.make_predict_batch`).
+- Los resultados se acumulan en métricas corrientes (pérdida, aciertos y matriz de confusión) y las
+  predicciones por imagen se escriben en un CSV a medida que salen.
+
+La memoria depende del tamaño del shard y de `max_pending`, no del tamaño de la colección. Leer y
+decodificar (zlib, PNG) libera el GIL, así que el throughput de lectura crece con los hilos lectores.
+
+Formatos de shard, elegidos por la extensión:
+- `.npz`: arrays `images` (N, H, W) uint8 y `labels` (N,).
+- `.tar`: estilo WebDataset, con `{clave}.png` y `{clave}.cls` (la etiqueta en texto) por imagen.
+- Un directorio con `images.npy` y `labels.npy` (se abren mapeados en memoria).
+"""
+
+import io
+import os
+import glob
+import time
+import tarfile
+import contextlib
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .benchmark import peak_rss_mb
+
+SHARD_DIR = './data/shards'
+
+
+def write_shards(images, labels, output_dir=SHARD_DIR, shard_size=10000, shard_format='npz'):
+    os.makedirs(output_dir, exist_ok=True)
+    paths = []
+    for shard, start in enumerate(range(0, len(labels), shard_size)):
+        shard_images = np.asarray(images[start:start + shard_size]).reshape(-1, *images.shape[1:3])
+        shard_labels = np.asarray(labels[start:start + shard_size])
+        path = os.path.join(output_dir, f'shard-{shard:05d}.{shard_format}')
+        if shard_format == 'npz':
+            np.savez_compressed(path, images=shard_images, labels=shard_labels)
+        elif shard_format == 'tar':
+            from PIL import Image
+            with tarfile.open(path, 'w') as tar:
+                for offset, (image, label) in enumerate(zip(shard_images, shard_labels)):
+                    png = io.BytesIO()
+                    Image.fromarray(image).save(png, format='PNG')
+                    for name, payload in ((f'{start + offset:09d}.png', png.getvalue()),
+                                          (f'{start + offset:09d}.cls', str(int(label)).encode())):
+                        info = tarfile.TarInfo(name)
+                        info.size = len(payload)
+                        tar.addfile(info, io.BytesIO(payload))
+        else:
+            raise ValueError(f'Formato de shard desconocido: {shard_format}')
+        paths.append(path)
+    return paths
+
+
+# Acepta un shard, un directorio con shards o un patrón glob; los shards se recorren en orden de nombre
+def list_shards(path):
+    if os.path.isdir(path) and not os.path.exists(os.path.join(path, 'images.npy')):
+        candidates = glob.glob(os.path.join(path, '*'))
+    else:
+        candidates = glob.glob(path)
+    shards = sorted(p for p in candidates if p.endswith(('.npz', '.tar'))
+                    or os.path.exists(os.path.join(p, 'images.npy')))
+    if not shards:
+        raise FileNotFoundError(f'No se encontraron shards en {path}')
+    return shards
+
+
+def read_shard(path):
+    if path.endswith('.npz'):
+        with np.load(path) as npz:
+            return npz['images'], npz['labels']
+    if path.endswith('.tar'):
+        from PIL import Image
+        images, labels = {}, {}
+        with tarfile.open(path) as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                key, ext = os.path.splitext(member.name)
+                data = tar.extractfile(member).read()
+                if ext == '.png':
+                    images[key] = np.array(Image.open(io.BytesIO(data)).convert('L'))
+                elif ext == '.cls':
+                    labels[key] = int(data)
+        keys = sorted(images)
+        return np.stack([images[k] for k in keys]), np.array([labels[k] for k in keys], dtype=np.int64)
+    return np.load(os.path.join(path, 'images.npy'), mmap_mode='r'), np.load(os.path.join(path, 'labels.npy'),
+                                                                               mmap_mode='r')
+
+
+# Lectura en segundo plano con a lo sumo `max_pending` shards en vuelo; se entregan en orden
+def prefetch_shards(shards, num_readers=4, max_pending=None):
+    max_pending = max_pending or 2 * num_readers
+    shards = iter(shards)
+    pending = collections.deque()
+    with ThreadPoolExecutor(num_readers, thread_name_prefix='shard-reader') as pool:
+        try:
+            for shard in shards:
+                pending.append((shard, pool.submit(read_shard, shard)))
+                if len(pending) >= max_pending:
+                    break
+            while pending:
+                shard, future = pending.popleft()
+                next_shard = next(shards, None)
+                if next_shard is not None:
+                    pending.append((next_shard, pool.submit(read_shard, next_shard)))
+                images, labels = future.result()
+                yield shard, images, labels
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+
+# Métricas que se actualizan lote a lote: misma pérdida y accuracy que evaluation.PredictionResults
+class RunningMetrics:
+    def __init__(self, num_classes=10):
+        self.num_classes = num_classes
+        self.confusion = np.zeros((num_classes, num_classes), dtype=np.int64)
+        self.loss_sum = 0.0
+        self.count = 0
+
+    def update(self, probabilities, labels):
+        labels = np.asarray(labels, dtype=np.int64)
+        predicted = np.argmax(probabilities, axis=1)
+        self.confusion += np.bincount(labels * self.num_classes + predicted,
+                                      minlength=self.num_classes ** 2).reshape(self.num_classes, self.num_classes)
+        eps = 1e-7
+        p = np.clip(probabilities[np.arange(len(labels)), labels], eps, 1 - eps)
+        self.loss_sum += float(-np.log(p).sum())
+        self.count += len(labels)
+        return predicted
+
+    def compute(self):
+        correct = np.diag(self.confusion).astype(np.float64)
+        return {
+            'loss': self.loss_sum / max(self.count, 1),
+            'accuracy': correct.sum() / max(self.count, 1),
+            'precision': correct / np.maximum(self.confusion.sum(0), 1),
+            'recall': correct / np.maximum(self.confusion.sum(1), 1),
+            'confusion_matrix': self.confusion.copy(),
+        }
+
+
+# Predicciones por imagen en CSV, escritas lote a lote: shard, posición dentro del shard, etiqueta,
+# clase predicha y probabilidad de esa clase
+class PredictionWriter:
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.file = open(path + '.tmp', 'w')
+        self.file.write('shard,index,label,predicted,confidence\n')
+
+    def write(self, shard, start, labels, predicted, confidence):
+        name = os.path.basename(shard.rstrip('/'))
+        self.file.writelines(f'{name},{start + i},{t},{p},{c:.6f}\n'
+                             for i, (t, p, c) in enumerate(zip(labels.tolist(), predicted.tolist(),
+                                                                confidence.tolist())))
+
+    def close(self):
+        self.file.close()
+        os.replace(self.path + '.tmp', self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is None:
+            self.close()
+        else:
+            self.file.close()
+
+
+def evaluate_shards(predict_batch, shards, batch_size=1024, num_readers=4, max_pending=None, predictions_path=None,
+                    num_classes=10, verbose=True):
+    metrics = RunningMetrics(num_classes)
+    start = time.perf_counter()
+    num_shards = 0
+    # Si la evaluación falla, el CSV parcial queda en .tmp y no se publica como si estuviera completo
+    with PredictionWriter(predictions_path) if predictions_path else contextlib.nullcontext() as writer:
+        for shard, images, labels in prefetch_shards(shards, num_readers, max_pending):
+            for s in range(0, len(labels), batch_size):
+                batch_labels = np.asarray(labels[s:s + batch_size])
+                probabilities = predict_batch(np.asarray(images[s:s + batch_size]))
+                predicted = metrics.update(probabilities, batch_labels)
+                if writer:
+                    writer.write(shard, s, batch_labels, predicted, probabilities.max(axis=1))
+            num_shards += 1
+            if verbose:
+                elapsed = time.perf_counter() - start
+                print(f'{num_shards} shards, {metrics.count} imágenes, {metrics.count / elapsed:.1f} img/s, '
+                      f'accuracy {np.trace(metrics.confusion) / max(metrics.count, 1):.4f}', flush=True)
+    elapsed = time.perf_counter() - start
+    return {**metrics.compute(), 'images': metrics.count, 'shards': num_shards, 'seconds': elapsed,
+            'images_per_s': metrics.count / elapsed, 'num_readers': num_readers, 'peak_rss_mb': peak_rss_mb()}
+
+
+def print_streaming_report(results):
+    print(f'{results["images"]} imágenes en {results["shards"]} shards, {results["seconds"]:.1f}s '
+          f'({results["images_per_s"]:.1f} img/s con {results["num_readers"]} lectores), '
+          f'RSS máximo {results["peak_rss_mb"]:.0f} MB')
+    print(f'Loss: {results["loss"]:.4f}, Accuracy: {results["accuracy"]:.4f}')
+    for digit, (precision, recall) in enumerate(zip(results['precision'], results['recall'])):
+        print(f'Clase {digit}: precision={precision:.4f}, recall={recall:.4f}')
+
+
+# Throughput de la evaluación completa con distinta cantidad de hilos lectores
+def measure_reader_scaling(predict_batch, shards, reader_counts=(1, 2, 4, 8), **kwargs):
+    rows = []
+    for num_readers in reader_counts:
+        results = evaluate_shards(predict_batch, shards, num_readers=num_readers, verbose=False, **kwargs)
+        rows.append({'num_readers': num_readers, 'images_per_s': results['images_per_s'],
+                     'peak_rss_mb': results['peak_rss_mb']})
+    print(f'{"Lectores":>9}{"img/s":>10}{"RSS máx MB":>12}')
+    for row in rows:
+        print(f'{row["num_readers"]:>9}{row["images_per_s"]:>10.1f}{row["peak_rss_mb"]:>12.0f}')
+    return rows
@@ -0,0 +1,178 @@
+"""Barrido de hiperparámetros de la CNN de Keras en paralelo, con successive halving.
+
+- Las configuraciones (filtros de las `Conv2D`, unidades de la `Dense`, `Dropout`, `batch_size` y tasa de
+  aprendizaje) se entrenan en un pool de procesos.
+- Cada worker recibe una porción fija de núcleos: afinidad de CPU propia e hilos intra-op/inter-op de
+  TensorFlow acotados a esa porción, para que los workers no compitan por los mismos núcleos.
+- Todos los workers leen los arrays de entrenamiento del almacén local mapeado en memoria
+  (`practica_cnn.data`): una sola copia en el page cache, compartida por todos los procesos.
+- Successive halving: todas las configuraciones arrancan con un presupuesto corto de épocas; en cada
+  ronda sigue solo la mejor fracción 1/eta (por accuracy de validación), con eta veces más épocas, hasta
+  el presupuesto máximo. Cada ronda retoma el modelo guardado en la anterior. Dentro de cada ronda,
+  `EarlyStopping` corta las pruebas que dejaron de mejorar y esas no pasan a la siguiente.
+"""
+
+import os
+import json
+import time
+import random
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from .data import MNIST_STORE, open_mnist_store
+from .runtime import core_slices
+
+SWEEP_DIR = './sweeps'
+
+SEARCH_SPACE = {
+    'filters': [(16, 32), (32, 64), (64, 128)],
+    'dense_units': [64, 128, 256],
+    'dropout': [0.25, 0.5],
+    'batch_size': [64, 128, 256],
+    'learning_rate': [3e-4, 1e-3, 3e-3],
+}
+
+
+def grid_configs(space=SEARCH_SPACE):
+    keys = list(space)
+    return [dict(zip(keys, values)) for values in itertools.product(*(space[k] for k in keys))]
+
+
+def sample_configs(num_trials, space=SEARCH_SPACE, seed=0):
+    configs = grid_configs(space)
+    if num_trials >= len(configs):
+        return configs
+    return random.Random(seed).sample(configs, num_trials)
+
+
+_worker_store = None
+
+
+# Inicialización de cada worker (antes de importar TensorFlow): toma su porción de núcleos de la cola,
+# fija la afinidad y acota los hilos
+def _init_worker(slices, inter_op_threads, store_path):
+    global _worker_store
+    cores = slices.get()
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    for var in ('OMP_NUM_THREADS', 'TF_NUM_INTRAOP_THREADS'):
+        os.environ[var] = str(len(cores))
+    os.environ['TF_NUM_INTEROP_THREADS'] = str(inter_op_threads)
+    os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(len(cores))
+    tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+    _worker_store = store_path
+
+
+# Entrena una prueba hasta `epochs` épocas, retomando desde `initial_epoch` si hay un modelo guardado
+def _run_trial(trial_id, config, initial_epoch, epochs, trial_dir, patience):
+    import tensorflow as tf
+    from .keras_cnn import build_model_cnn, train_model_cnn
+
+    tf.keras.backend.clear_session()
+    (x_train, y_train), _ = open_mnist_store(_worker_store)
+    x_train = x_train.reshape((-1, 28, 28, 1))
+    model_path = os.path.join(trial_dir, f'trial_{trial_id}.keras')
+    if initial_epoch and os.path.exists(model_path):
+        model_cnn = tf.keras.models.load_model(model_path)
+    else:
+        model_cnn = build_model_cnn(True, config['filters'], config['dense_units'], config['dropout'],
+                                    config['learning_rate'])
+    early_stopping = tf.keras.callbacks.EarlyStopping(monitor='val_accuracy', patience=patience,
+                                                      restore_best_weights=True)
+    start = time.perf_counter()
+    history = train_model_cnn(model_cnn, x_train, y_train, epochs=epochs, batch_size=config['batch_size'],
+                              initial_epoch=initial_epoch, callbacks=[early_stopping], verbose=0)
+    elapsed = time.perf_counter() - start
+    model_cnn.save(model_path)
+    epochs_run = len(history.history['val_accuracy'])
+    return {
+        'trial': trial_id,
+        'epochs': initial_epoch + epochs_run,
+        'val_accuracy': float(max(history.history['val_accuracy'])),
+        'val_loss': float(min(history.history['val_loss'])),
+        'stopped_early': initial_epoch + epochs_run < epochs,
+        'seconds': elapsed,
+        'cores': sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else None,
+    }
+
+
+# Presupuestos de épocas por ronda: min_epochs, min_epochs * eta, ... hasta max_epochs
+def rung_budgets(min_epochs, max_epochs, eta):
+    budgets = [min_epochs]
+    while budgets[-1] < max_epochs:
+        budgets.append(min(budgets[-1] * eta, max_epochs))
+    return budgets
+
+
+def run_sweep(configs, num_workers=None, threads_per_worker=4, inter_op_threads=1, min_epochs=1, max_epochs=15,
+              eta=3, patience=3, store_path=MNIST_STORE, output_dir=SWEEP_DIR):
+    num_cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    threads_per_worker = min(threads_per_worker, num_cores)
+    # Más workers que porciones de núcleos sobresuscribiría la máquina: se acota y se avisa
+    max_workers = max(1, num_cores // threads_per_worker)
+    if num_workers and num_workers > max_workers:
+        print(f'{num_workers} workers x {threads_per_worker} hilos no entran en {num_cores} núcleos: '
+              f'se usan {max_workers} workers')
+    num_workers = min(num_workers or max_workers, max_workers)
+    os.makedirs(output_dir, exist_ok=True)
+    open_mnist_store(store_path)  # se construye una sola vez, antes de lanzar los workers
+
+    context = multiprocessing.get_context('spawn')
+    slices = context.Queue()
+    for cores in core_slices(num_workers, threads_per_worker):
+        slices.put(cores)
+
+    trials = {trial_id: {'config': config, 'rungs': []} for trial_id, config in enumerate(configs)}
+    alive = list(trials)
+    sweep_start = time.perf_counter()
+    print(f'{len(configs)} configuraciones, {num_workers} workers x {threads_per_worker} hilos, '
+          f'rondas de {rung_budgets(min_epochs, max_epochs, eta)} épocas')
+    with ProcessPoolExecutor(num_workers, mp_context=context, initializer=_init_worker,
+                             initargs=(slices, inter_op_threads, store_path)) as pool:
+        initial_epoch = 0
+        for rung, budget in enumerate(rung_budgets(min_epochs, max_epochs, eta)):
+            futures = {trial_id: pool.submit(_run_trial, trial_id, trials[trial_id]['config'], initial_epoch, budget,
+                                             output_dir, patience) for trial_id in alive}
+            for trial_id, future in futures.items():
+                trials[trial_id]['rungs'].append(future.result())
+            ranked = sorted(alive, key=lambda t: trials[t]['rungs'][-1]['val_accuracy'], reverse=True)
+            print(f'Ronda {rung} ({budget} épocas): mejor val_accuracy '
+                  f'{trials[ranked[0]]["rungs"][-1]["val_accuracy"]:.4f}, {time.perf_counter() - sweep_start:.1f}s')
+            # Siguen las mejores 1/eta que no se detuvieron por early stopping
+            keep = max(1, len(ranked) // eta)
+            alive = [t for t in ranked[:keep] if not trials[t]['rungs'][-1]['stopped_early']]
+            initial_epoch = budget
+            if not alive:
+                break
+
+    elapsed = time.perf_counter() - sweep_start
+    # Primero las pruebas que llegaron a rondas más largas, después por accuracy de validación
+    leaderboard = sorted(trials.items(), key=lambda item: (len(item[1]['rungs']), item[1]['rungs'][-1]['val_accuracy']),
+                         reverse=True)
+    total_epochs = sum(r['epochs'] - (trial['rungs'][i - 1]['epochs'] if i else 0)
+                       for _, trial in trials.items() for i, r in enumerate(trial['rungs']))
+    results = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'workers': num_workers, 'threads_per_worker': threads_per_worker,
+        'min_epochs': min_epochs, 'max_epochs': max_epochs, 'eta': eta,
+        'seconds': elapsed, 'trial_epochs': total_epochs, 'trial_epochs_per_s': total_epochs / elapsed,
+        'trials': [{'trial': trial_id, 'config': {**trial['config'], 'filters': list(trial['config']['filters'])},
+                    'rungs': trial['rungs']} for trial_id, trial in leaderboard],
+    }
+    with open(os.path.join(output_dir, 'results.json'), 'w') as f:
+        json.dump(results, f, indent=2)
+    print_leaderboard(results)
+    return results
+
+
+def print_leaderboard(results, top=10):
+    print(f'{"Prueba":>7}{"Épocas":>8}{"val_acc":>9}{"Filtros":>11}{"Dense":>7}{"Dropout":>9}{"Lote":>6}{"lr":>8}')
+    for entry in results['trials'][:top]:
+        config, last = entry['config'], entry['rungs'][-1]
+        print(f'{entry["trial"]:>7}{last["epochs"]:>8}{last["val_accuracy"]:>9.4f}{str(tuple(config["filters"])):>11}'
+              f'{config["dense_units"]:>7}{config["dropout"]:>9}{config["batch_size"]:>6}{config["learning_rate"]:>8}')
+    print(f'{results["trial_epochs"]} épocas de prueba en {results["seconds"]:.1f}s '
+          f'({results["trial_epochs_per_s"]:.2f} épocas/s con {results["workers"]} workers)')
@@ -0,0 +1,330 @@
+"""Entrenamiento hasta una accuracy objetivo: el tiempo hasta el objetivo es la métrica principal.
+
+En lugar de un número fijo de épocas (`epochs=15` en la CNN, 3 en MobileNetV2), el entrenamiento corre
+hasta que la accuracy de validación alcanza `target_accuracy`, se agota `time_budget_s` o deja de mejorar
+durante `patience` épocas (early stopping sobre `val_accuracy`). Lo que se reporta es el tiempo y las
+épocas hasta el objetivo.
+
+- La tasa de aprendizaje sigue un schedule por paso: one-cycle (subida lineal y bajada coseno) o coseno,
+  calculado sobre `max_epochs`.
+- Los checkpoints se escriben en un hilo de fondo. El entrenamiento solo paga la copia de los pesos y del
+  estado del optimizador a memoria del host; la serialización y la escritura a disco corren en paralelo
+  con la época siguiente.
+- Con `resume=True` se retoma desde el último checkpoint: pesos, estado del optimizador, paso del
+  schedule, época y reloj acumulado. El tiempo hasta el objetivo incluye el de las corridas anteriores.
+  El checkpoint guarda la configuración de la corrida y no se retoma con otra distinta.
+
+Hay dos variantes: `train_cnn_to_target` para model_cnn (Keras) y `train_torch_to_target` para
+MobileNetV2, sea el modelo completo con lotes de imágenes o el clasificador sobre la caché de embeddings.
+"""
+
+import os
+import copy
+import json
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+CNN_CHECKPOINT = './models/checkpoints/model_cnn.npz'
+MOBILENET_CHECKPOINT = './models/checkpoints/mobilenet_v2.ckpt'
+SCHEDULES = ('one_cycle', 'cosine', 'constant')
+
+
+# Un checkpoint por modo (clasificador sobre la caché o modelo completo) y resolución de entrada
+def mobilenet_checkpoint_path(mode, input_size, checkpoint_dir=os.path.dirname(MOBILENET_CHECKPOINT)):
+    return os.path.join(checkpoint_dir, f'mobilenet_v2_{mode}_{input_size}.ckpt')
+
+
+# Tasa de aprendizaje del paso `step`. one-cycle: sube de max_lr/div a max_lr durante warmup_frac de los
+# pasos y baja con un coseno hasta max_lr/final_div; coseno: baja de max_lr a max_lr/final_div
+def lr_at(step, total_steps, max_lr, schedule='one_cycle', warmup_frac=0.3, div=25.0, final_div=1e4):
+    progress = min(step / max(total_steps, 1), 1.0)
+    if schedule == 'constant':
+        return max_lr
+    min_lr = max_lr / final_div
+    if schedule == 'one_cycle':
+        if progress < warmup_frac:
+            return max_lr / div + (max_lr - max_lr / div) * progress / warmup_frac
+        progress = (progress - warmup_frac) / (1 - warmup_frac)
+    elif schedule != 'cosine':
+        raise ValueError(f'Schedule desconocido: {schedule}')
+    return min_lr + (max_lr - min_lr) * 0.5 * (1 + math.cos(math.pi * progress))
+
+
+# Objetivo, presupuesto de tiempo y early stopping; su estado viaja en cada checkpoint
+class TargetTracker:
+    def __init__(self, target_accuracy=None, time_budget_s=None, patience=None):
+        self.target_accuracy = target_accuracy
+        self.time_budget_s = time_budget_s
+        self.patience = patience
+        self.elapsed_before = 0.0
+        self.history = []
+        self.best_accuracy = 0.0
+        self.best_epoch = 0
+        self.time_to_target_s = None
+        self.epochs_to_target = None
+        self.stop_reason = None
+        self._started = None
+
+    def start(self):
+        self._started = time.perf_counter()
+
+    def elapsed(self):
+        return self.elapsed_before + time.perf_counter() - self._started
+
+    def budget_exceeded(self):
+        if self.time_budget_s is not None and self.elapsed() >= self.time_budget_s:
+            self.stop_reason = self.stop_reason or 'budget'
+        return self.stop_reason == 'budget'
+
+    # Devuelve True si hay que cortar el entrenamiento
+    def end_epoch(self, epoch, val_accuracy):
+        elapsed = self.elapsed()
+        self.history.append({'epoch': epoch, 'val_accuracy': float(val_accuracy), 'elapsed_s': elapsed})
+        if val_accuracy > self.best_accuracy:
+            self.best_accuracy, self.best_epoch = float(val_accuracy), epoch
+        print(f'Época {epoch}: val_accuracy {val_accuracy:.4f} (mejor {self.best_accuracy:.4f}), {elapsed:.1f}s',
+              flush=True)
+        if self.target_accuracy is not None and val_accuracy >= self.target_accuracy:
+            self.time_to_target_s, self.epochs_to_target = elapsed, epoch
+            self.stop_reason = 'target'
+        elif self.patience is not None and epoch - self.best_epoch >= self.patience:
+            self.stop_reason = 'early_stopping'
+        else:
+            self.budget_exceeded()
+        return self.stop_reason is not None
+
+    def state(self):
+        return {'elapsed_s': self.elapsed(), 'history': self.history, 'best_accuracy': self.best_accuracy,
+                'best_epoch': self.best_epoch, 'time_to_target_s': self.time_to_target_s,
+                'epochs_to_target': self.epochs_to_target, 'stop_reason': self.stop_reason}
+
+    # Un checkpoint de una corrida que ya había parado (objetivo, presupuesto o early stopping) no se vuelve
+    # a entrenar y conserva el motivo
+    def restore(self, state):
+        self.elapsed_before = state['elapsed_s']
+        self.history = state['history']
+        self.best_accuracy = state['best_accuracy']
+        self.best_epoch = state['best_epoch']
+        self.time_to_target_s = state['time_to_target_s']
+        self.epochs_to_target = state['epochs_to_target']
+        self.stop_reason = state['stop_reason']
+
+    def report(self, checkpointer=None):
+        return {
+            'target_accuracy': self.target_accuracy, 'reached': self.time_to_target_s is not None,
+            'time_to_target_s': self.time_to_target_s, 'epochs_to_target': self.epochs_to_target,
+            'best_accuracy': self.best_accuracy, 'best_epoch': self.best_epoch, 'epochs': len(self.history),
+            'total_s': self.elapsed(), 'stop_reason': self.stop_reason or 'max_epochs', 'history': self.history,
+            'checkpoint_stall_s': checkpointer.stall_s if checkpointer else 0.0,
+            'checkpoint_write_s': checkpointer.write_s if checkpointer else 0.0,
+        }
+
+
+# Escritura de checkpoints en un hilo de fondo. Como mucho hay una escritura pendiente: si la anterior no
+# terminó, se espera (así la memoria de las copias queda acotada). `stall_s` es el tiempo que el
+# entrenamiento estuvo detenido por los checkpoints (copia al host más esperas) y `write_s` el de escritura.
+class AsyncCheckpointer:
+    def __init__(self, write_fn):
+        self.write_fn = write_fn
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix='checkpoint')
+        self.pending = None
+        self.stall_s = 0.0
+        self.write_s = 0.0
+
+    def save(self, snapshot_fn, path):
+        start = time.perf_counter()
+        if self.pending is not None:
+            self.pending.result()
+        snapshot = snapshot_fn()
+        self.pending = self.executor.submit(self._write, snapshot, path)
+        self.stall_s += time.perf_counter() - start
+
+    def _write(self, snapshot, path):
+        start = time.perf_counter()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.write_fn(snapshot, path + '.tmp')
+        os.replace(path + '.tmp', path)
+        self.write_s += time.perf_counter() - start
+
+    def close(self):
+        if self.pending is not None:
+            self.pending.result()
+        self.executor.shutdown()
+
+
+def print_target_report(report):
+    if report['reached']:
+        print(f'Objetivo {report["target_accuracy"]:.4f} alcanzado en {report["time_to_target_s"]:.1f}s '
+              f'({report["epochs_to_target"]} épocas)')
+    else:
+        target = f'{report["target_accuracy"]:.4f}' if report['target_accuracy'] is not None else '-'
+        print(f'Objetivo {target} no alcanzado ({report["stop_reason"]}): mejor val_accuracy '
+              f'{report["best_accuracy"]:.4f} en la época {report["best_epoch"]}')
+    print(f'{report["epochs"]} épocas en {report["total_s"]:.1f}s; checkpoints: {report["checkpoint_stall_s"]:.2f}s '
+          f'de entrenamiento detenido, {report["checkpoint_write_s"]:.2f}s de escritura en segundo plano')
+
+
+# Un checkpoint solo se retoma con la misma configuración con la que se escribió: otro modelo, modo o
+# resolución no carga, y otro schedule, max_lr, max_epochs o pasos por época desfasaría la tasa de aprendizaje
+def check_checkpoint_config(saved, config, path):
+    differences = [f'{key}: {saved.get(key)!r} en el checkpoint, {value!r} ahora'
+                   for key, value in config.items() if saved.get(key) != value]
+    if differences:
+        raise ValueError(f'El checkpoint {path} es de otra configuración ({"; ".join(differences)}). '
+                         'Usar otro checkpoint o empezar de cero (resume=False, --no-resume)')
+
+
+def _write_keras_checkpoint(snapshot, path):
+    weights, optimizer_vars, meta = snapshot
+    with open(path, 'wb') as f:
+        np.savez(f, meta=np.array(json.dumps(meta)), **{f'w{i}': w for i, w in enumerate(weights)},
+                 **{f'o{i}': v for i, v in enumerate(optimizer_vars)})
+
+
+# Retoma model_cnn desde un checkpoint: pesos, variables del optimizador (incluido el número de pasos) y meta
+def load_keras_checkpoint(model_cnn, path, config=None):
+    with np.load(path) as npz:
+        meta = json.loads(str(npz['meta']))
+        if config is not None:
+            check_checkpoint_config(meta['config'], config, path)
+        model_cnn.set_weights([npz[f'w{i}'] for i in range(meta['num_weights'])])
+        model_cnn.optimizer.build(model_cnn.trainable_variables)
+        for i, variable in enumerate(model_cnn.optimizer.variables):
+            variable.assign(npz[f'o{i}'])
+    return meta
+
+
+def train_cnn_to_target(model_cnn, x_train, y_train, target_accuracy=0.99, time_budget_s=None, max_epochs=15,
+                        batch_size=128, max_lr=3e-3, schedule='one_cycle', patience=3,
+                        checkpoint_path=CNN_CHECKPOINT, resume=True, augment=None):
+    import tensorflow as tf
+    from .keras_cnn import make_tf_dataset, split_indices
+
+    train_idx, val_idx = split_indices(len(x_train))
+    train_ds = make_tf_dataset(x_train, y_train, train_idx, batch_size=batch_size, shuffle=True, augment=augment)
+    val_ds = make_tf_dataset(x_train, y_train, val_idx, batch_size=batch_size)
+    total_steps = max_epochs * len(train_ds)
+    config = {'model': 'cnn', 'input_dtype': str(x_train.dtype), 'batch_size': batch_size,
+              'steps_per_epoch': len(train_ds), 'max_epochs': max_epochs, 'max_lr': max_lr, 'schedule': schedule}
+
+    tracker = TargetTracker(target_accuracy, time_budget_s, patience)
+    initial_epoch = 0
+    if resume and checkpoint_path and os.path.exists(checkpoint_path):
+        meta = load_keras_checkpoint(model_cnn, checkpoint_path, config)
+        tracker.restore(meta['tracker'])
+        initial_epoch = meta['epoch']
+        print(f'Retomando desde {checkpoint_path} (época {initial_epoch})')
+    checkpointer = AsyncCheckpointer(_write_keras_checkpoint) if checkpoint_path else None
+    learning_rate = model_cnn.optimizer.learning_rate
+    # Paso global del schedule, desde el contador del optimizador (restaurado con el checkpoint)
+    step = [int(model_cnn.optimizer.iterations.numpy())]
+
+    def on_train_batch_begin(batch, logs=None):
+        learning_rate.assign(lr_at(step[0], total_steps, max_lr, schedule))
+        step[0] += 1
+
+    def on_train_batch_end(batch, logs=None):
+        if tracker.budget_exceeded():
+            model_cnn.stop_training = True
+
+    def on_epoch_end(epoch, logs=None):
+        if tracker.end_epoch(epoch + 1, logs['val_accuracy']):
+            model_cnn.stop_training = True
+        if checkpointer:
+            meta = {'epoch': epoch + 1, 'num_weights': len(model_cnn.weights), 'config': config,
+                    'tracker': tracker.state()}
+            checkpointer.save(lambda: (model_cnn.get_weights(), [v.numpy() for v in model_cnn.optimizer.variables],
+                                       meta), checkpoint_path)
+
+    callback = tf.keras.callbacks.LambdaCallback(on_train_batch_begin=on_train_batch_begin,
+                                                 on_train_batch_end=on_train_batch_end, on_epoch_end=on_epoch_end)
+    tracker.start()
+    try:
+        if initial_epoch < max_epochs and tracker.stop_reason is None:
+            model_cnn.fit(train_ds, epochs=max_epochs, initial_epoch=initial_epoch, validation_data=val_ds,
+                          callbacks=[callback])
+    finally:
+        if checkpointer:
+            checkpointer.close()
+    return tracker.report(checkpointer)
+
+
+# Copia en el host del estado a guardar, para que el hilo de fondo no lea tensores que el entrenamiento modifica
+def _torch_snapshot(module, optimizer, meta):
+    import torch
+
+    def to_host(value):
+        if isinstance(value, torch.Tensor):
+            return value.detach().to('cpu', copy=True)
+        if isinstance(value, dict):
+            return {k: to_host(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return type(value)(to_host(v) for v in value)
+        return copy.copy(value)
+
+    return {'module': to_host(module.state_dict()), 'optimizer': to_host(optimizer.state_dict()), 'meta': meta}
+
+
+def _write_torch_checkpoint(snapshot, path):
+    import torch
+    torch.save(snapshot, path)
+
+
+# `module` es lo que se entrena (el modelo o model.classifier) y `forward` lo que se evalúa sobre los lotes
+# de validación (por defecto, el mismo módulo). Los lotes son iterables que se recorren una vez por época
+# (un DataLoader o mobilenet.EmbeddingBatches). `config` identifica la corrida en el checkpoint (por ejemplo
+# modelo, modo y resolución de entrada), junto con el schedule
+def train_torch_to_target(module, train_batches, val_batches, criterion, optimizer, forward=None,
+                          target_accuracy=0.99, time_budget_s=None, max_epochs=10, max_lr=3e-3,
+                          schedule='one_cycle', patience=3, checkpoint_path=MOBILENET_CHECKPOINT, resume=True,
+                          config=None):
+    import torch
+    from .mobilenet import device, to_model_input, evaluate_streaming
+
+    forward = forward or module
+    total_steps = max_epochs * len(train_batches)
+    config = {**(config or {}), 'steps_per_epoch': len(train_batches), 'max_epochs': max_epochs, 'max_lr': max_lr,
+              'schedule': schedule}
+    tracker = TargetTracker(target_accuracy, time_budget_s, patience)
+    initial_epoch, step = 0, 0
+    if resume and checkpoint_path and os.path.exists(checkpoint_path):
+        checkpoint = torch.load(checkpoint_path, map_location=device)
+        check_checkpoint_config(checkpoint['meta']['config'], config, checkpoint_path)
+        module.load_state_dict(checkpoint['module'])
+        optimizer.load_state_dict(checkpoint['optimizer'])
+        tracker.restore(checkpoint['meta']['tracker'])
+        initial_epoch, step = checkpoint['meta']['epoch'], checkpoint['meta']['step']
+        print(f'Retomando desde {checkpoint_path} (época {initial_epoch})')
+    checkpointer = AsyncCheckpointer(_write_torch_checkpoint) if checkpoint_path else None
+
+    tracker.start()
+    try:
+        for epoch in range(initial_epoch, max_epochs):
+            if tracker.stop_reason is not None:
+                break
+            module.train()
+            for inputs, labels in train_batches:
+                for group in optimizer.param_groups:
+                    group['lr'] = lr_at(step, total_steps, max_lr, schedule)
+                optimizer.zero_grad(set_to_none=True)
+                loss = criterion(module(to_model_input(inputs)), labels.to(device))
+                loss.backward()
+                optimizer.step()
+                step += 1
+                if tracker.budget_exceeded():
+                    break
+            module.eval()
+            val_accuracy = evaluate_streaming(val_batches, forward)['accuracy']
+            stop = tracker.end_epoch(epoch + 1, val_accuracy)
+            if checkpointer:
+                meta = {'epoch': epoch + 1, 'step': step, 'config': config, 'tracker': tracker.state()}
+                checkpointer.save(lambda: _torch_snapshot(module, optimizer, meta), checkpoint_path)
+            if stop:
+                break
+    finally:
+        if checkpointer:
+            checkpointer.close()
+    return tracker.report(checkpointer)